@@ -0,0 +1,110 @@
+'''
+Routing of many scenarios (departure times, polars or perturbed winds) across a process pool. The wind fields are
+saved once and memory mapped read-only by all workers, so they are neither copied nor pickled per scenario.
+'''
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from polar import Polar
+from routers.router import get_router, route_summary
+from wind.field_wind import FieldWind
+from wind.perturbed_wind import PerturbedWind
+from wind.wind_field import WindField
+
+
+class Scenario:
+    '''
+    A routing scenario: the departure time and optionally another polar (2xN array) or a perturbation of the wind
+    (see PerturbedWind)
+    '''
+
+    def __init__(self, start_time, polar=None, speed_factor=1., direction_offset=0.):
+        self.start_time = start_time
+        self.polar = polar
+        self.speed_factor = speed_factor
+        self.direction_offset = direction_offset
+
+
+def departure_window(start_time, end_time, step):
+    '''Scenarios for departures every step seconds from start_time up to end_time'''
+    return [Scenario(t) for t in np.arange(start_time, end_time + 1, step)]
+
+
+def ensemble(start_time, speed_factors=(0.8, 0.9, 1., 1.1, 1.2), direction_offsets=(-20., -10., 0., 10., 20.)):
+    '''Scenarios for all combinations of wind speed factors and direction offsets'''
+    return [Scenario(start_time, speed_factor=s, direction_offset=d) for s in speed_factors for d in direction_offsets]
+
+
+# Set in each worker by _init_worker
+_worker = {}
+
+
+def _init_worker(directory, start_point, end_point, polar, max_duration, router, router_args, routing_args,
+                 land_mask):
+    field = WindField.load(os.path.join(directory, 'forecast'))
+    clima_directory = os.path.join(directory, 'clima')
+    clima = WindField.load(clima_directory) if os.path.isdir(clima_directory) else None
+    _worker.update(wind=FieldWind(field, clima), start_point=start_point, end_point=end_point, polar=polar,
+                   max_duration=max_duration, router=get_router(router), router_args=router_args,
+                   routing_args=routing_args, land_mask=land_mask)
+
+
+def _route(scenario: Scenario):
+    '''Route a scenario in a worker and return a compact result'''
+    wind = _worker['wind']
+    if scenario.speed_factor != 1. or scenario.direction_offset != 0.:
+        wind = PerturbedWind(wind, scenario.speed_factor, scenario.direction_offset)
+    polar = Polar(scenario.polar) if scenario.polar is not None else _worker['polar']
+    r = _worker['router'](*_worker['router_args'], _worker['start_point'], _worker['end_point'], polar, wind,
+                          scenario.start_time, scenario.start_time + _worker['max_duration'],
+                          land_mask=_worker['land_mask'])
+    return route_summary(r.calculate_routing(*_worker['routing_args']), scenario.start_time)
+
+
+def route_scenarios(scenarios, start_point, end_point, polar, field, clima=None, max_duration=60 * 60 * 24 * 60,
+                    router='dp', router_args=(20, 20), routing_args=(), land_mask=None, processes=None,
+                    directory=None):
+    '''
+    Route all scenarios in a process pool and return their results (passage time, distance and route) in the same
+    order. field (and clima, the monthly climatology used after the end of field) are saved to directory (a temporary
+    one by default) and memory mapped by the workers. router_args are passed to the router's constructor before the
+    common arguments and routing_args to calculate_routing, e.g. router_args=(3600 * 6,) for the isochrone router.
+    '''
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        field.save(os.path.join(tmp, 'forecast'))
+        if clima is not None:
+            clima.save(os.path.join(tmp, 'clima'))
+        initargs = (tmp, start_point, end_point, polar, max_duration, router, router_args, routing_args, land_mask)
+        processes = processes or os.cpu_count()
+        with ProcessPoolExecutor(processes, initializer=_init_worker, initargs=initargs) as executor:
+            # Scenarios take similar time, so sending them in chunks saves round trips without unbalancing workers
+            chunksize = max(1, len(scenarios) // (4 * processes))
+            return list(executor.map(_route, scenarios, chunksize=chunksize))
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+    from shapely.geometry import Point
+    from benchmarks.polars import POLARS
+    from benchmarks.synthetic_wind import CubeWind
+
+    parser = argparse.ArgumentParser(description='Departure window sweep on a synthetic wind field')
+    parser.add_argument('--scenarios', type=int, default=50)
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, os.cpu_count()])
+    args = parser.parse_args()
+
+    t0 = 1700000000.
+    field = CubeWind(t0, hours=24 * 30).field
+    start, end = Point(-4.91519, 48.26118), Point(-74.71870, 38.86484)
+    scenarios = departure_window(t0, t0 + 3600 * 6 * (args.scenarios - 1), 3600 * 6)
+    for processes in args.processes:
+        t = time.perf_counter()
+        results = route_scenarios(scenarios, start, end, Polar(POLARS['racer']), field, processes=processes)
+        print(f'{processes} processes: {time.perf_counter() - t:.2f}s')
+    best = results[np.nanargmin([x['passage_time'] for x in results])]
+    print(f"Best departure: +{(best['start_time'] - t0) / 3600:.0f}h, passage time "
+          f"{best['passage_time'] / 3600:.1f}h, distance {best['distance'] / 1000:.0f}km")
@@ -0,0 +1,55 @@
+'''
+Import time regression check. Each module is imported in a fresh interpreter, which must not load any of the heavy
+dependencies (they are imported lazily by the code paths that need them) and must take less than the budget.
+
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --budget 0.3
+'''
+import argparse
+import json
+import subprocess
+import sys
+
+# Modules used for headless routing, e.g. batch routing on synthetic winds
+MODULES = ['cli', 'routers.router', 'routers.gc_router', 'routers.dp_router', 'routers.multires_dp_router',
+           'routers.time_dp_router', 'routers.astar_router', 'routers.isochrone_router', 'batch_routing', 'service',
+           'route_evaluator', 'visualizer', 'benchmarks.run']
+# Only needed to download and decode GRIB files or to plot
+HEAVY = ['requests', 'scipy', 'pytz', 'matplotlib', 'cartopy', 'eccodes']
+
+SCRIPT = '''
+import json, sys, time
+t = time.perf_counter()
+import {module}
+print(json.dumps([time.perf_counter() - t, [m for m in {heavy} if m in sys.modules]]))
+'''
+
+
+def import_time(module, repeat=3):
+    '''Returns the fastest time to import module in a fresh interpreter and the heavy modules it loaded'''
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', SCRIPT.format(module=module, heavy=HEAVY)], check=True,
+                                capture_output=True, text=True).stdout
+        runs.append(json.loads(output))
+    return min(runs)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--budget', type=float, default=0.5, help='maximum import time per module in s')
+    parser.add_argument('--repeat', type=int, default=3, help='number of imports per module (the fastest counts)')
+    args = parser.parse_args(argv)
+    failed = []
+    for module in MODULES:
+        t, heavy = import_time(module, args.repeat)
+        ok = t <= args.budget and not heavy
+        print(f"{module:>28}: {t:6.3f}s {', '.join(heavy)}{'' if ok else '  FAILED'}")
+        if not ok:
+            failed.append(module)
+    if failed:
+        sys.exit(f"Import time regression in {', '.join(failed)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+import numpy as np
+
+from polar import Polar
+
+# True wind angle in degrees -> speed in m/s
+POLARS = {
+    # The polar used in routers.router
+    'default': np.array([[0., 45., 90., 135., 180.], [0., 0., 2.8, 4.2, 2.8]]),
+    'cruiser': np.array([[0., 30., 45., 60., 90., 120., 150., 180.], [0., 0., 2.2, 2.9, 3.3, 3.4, 3.0, 2.5]]),
+    'racer': np.array([[0., 30., 40., 60., 90., 110., 135., 150., 180.],
+                       [0., 0., 3.6, 4.4, 5.2, 5.8, 6.2, 5.6, 4.4]]),
+}
+
+# True wind angle in degrees -> speed in m/s for each true wind speed in m/s
+POLAR_TABLES = {
+    'cruiser-tws': (np.array([[0., 30., 45., 60., 90., 120., 150., 180.],
+                              [0., 0., 0., 0., 0., 0., 0., 0.],
+                              [0., 0., 1.4, 1.8, 2.1, 2.1, 1.8, 1.4],
+                              [0., 0., 2.2, 2.9, 3.3, 3.4, 3.0, 2.5],
+                              [0., 0., 2.6, 3.2, 3.7, 3.9, 3.6, 3.2]]), np.array([0., 4., 8., 12.])),
+}
+
+
+def get_polar(name):
+    if name in POLAR_TABLES:
+        return Polar(*POLAR_TABLES[name])
+    return Polar(POLARS[name])
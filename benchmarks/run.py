@@ -0,0 +1,191 @@
+'''
+Routing benchmarks on synthetic wind fields and polars. Every run reports wall time, peak memory, the number of
+polar, wind and geodesic calls (and the number of points evaluated by them) and the resulting passage time, so
+results of two commits can be compared with --compare.
+
+    python -m benchmarks.run --out bench.json
+    python -m benchmarks.run --out new.json --compare bench.json
+'''
+import argparse
+import json
+import time
+import tracemalloc
+
+import numpy as np
+from shapely.geometry import Point
+
+from benchmarks.polars import get_polar
+from benchmarks.synthetic_wind import CubeWind, FrontalWind, RotatingWind, UniformWind
+from routers.astar_router import AStarRouter
+from routers.dp_router import DPRouter
+from routers.gc_router import GCRouter
+from routers.isochrone_router import IsochroneRouter
+from routers.multires_dp_router import MultiResolutionDPRouter
+from routers.time_dp_router import TimeDependentDPRouter
+
+START_TIME = 1700000000.
+MAX_TIME = START_TIME + 60 * 60 * 24 * 365
+
+ROUTES = {
+    'biscay': (Point(-4.91519, 48.26118), Point(-9.5, 43.5)),
+    'azores': (Point(-9.5, 43.5), Point(-25.7, 37.7)),
+    'transatlantic': (Point(-4.91519, 48.26118), Point(-74.71870, 38.86484)),
+}
+
+WINDS = {
+    'uniform': lambda: UniformWind(0., 8.),
+    'rotating': lambda: RotatingWind((-40., 45.), 15., 8.),
+    'frontal': lambda: FrontalWind(-60., 0.5, START_TIME),
+    'cube': lambda: CubeWind(START_TIME),
+}
+
+# Router -> list of (constructor arguments, calculate_routing arguments)
+SIZES = {
+    'gc': [((), (10,)), ((), (50,))],
+    'dp': [((10, 10), ()), ((20, 20), ()), ((40, 30), ())],
+    'dp-multi': [((11, 30), ()), ((21, 30), ())],
+    'dp-time': [((10, 10), ()), ((20, 20), ())],
+    'astar': [((10, 10), ()), ((20, 20), ()), ((40, 30), ())],
+    'isochrone': [((3600 * 48,), ()), ((3600 * 24,), ()), ((3600 * 12,), ())],
+}
+HEADING_STEPS = [2., 1., 0.5]
+
+QUICK = {
+    'routes': ['transatlantic'],
+    'winds': ['uniform', 'cube'],
+    'polars': ['default'],
+}
+
+
+class Counter:
+    '''Counts calls and evaluated points of the wrapped object's methods'''
+
+    def __init__(self, wrapped, methods):
+        self._wrapped = wrapped
+        self._methods = methods
+        self.calls = 0
+        self.points = 0
+
+    def __getattr__(self, name):
+        attribute = getattr(self._wrapped, name)
+        if name not in self._methods:
+            return attribute
+
+        def counted(*args, **kwargs):
+            self.calls += 1
+            self.points += max(int(np.size(a)) for a in args) if args else 1
+            return attribute(*args, **kwargs)
+        return counted
+
+
+def make_router(router, size, heading_step, route, polar, wind, geodesy='ellipsoid'):
+    args, _ = size
+    start, end = ROUTES[route]
+    common = (start, end, polar, wind, START_TIME, MAX_TIME)
+    if router == 'gc':
+        return GCRouter(*common, geodesy=geodesy)
+    if router == 'dp':
+        return DPRouter(*args, *common, geodesy=geodesy)
+    if router == 'dp-multi':
+        return MultiResolutionDPRouter(*args, *common, geodesy=geodesy)
+    if router == 'dp-time':
+        return TimeDependentDPRouter(*args, *common, geodesy=geodesy)
+    if router == 'astar':
+        return AStarRouter(*args, *common, geodesy=geodesy)
+    return IsochroneRouter(*args, *common, heading_step=heading_step, geodesy=geodesy)
+
+
+def run_once(router, size, heading_step, route, polar_name, wind_name, trace_memory=False, geodesy='ellipsoid'):
+    polar = Counter(get_polar(polar_name), ('get_speed', 'get_speed_batch'))
+    wind = Counter(WINDS[wind_name](), ('get_wind', 'get_wind_batch'))
+    if trace_memory:
+        tracemalloc.start()
+    t0 = time.perf_counter()
+    r = make_router(router, size, heading_step, route, polar, wind, geodesy)
+    t1 = time.perf_counter()
+    geod = r.g = Counter(r.g, ('fwd', 'inv'))
+    best = r.calculate_routing(*size[1])
+    t2 = time.perf_counter()
+    peak = None
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return {
+        'setup_time': t1 - t0,
+        'routing_time': t2 - t1,
+        'peak_memory': peak,
+        'polar_calls': polar.calls, 'polar_points': polar.points,
+        'wind_calls': wind.calls, 'wind_points': wind.points,
+        'geod_calls': geod.calls, 'geod_points': geod.points,
+        'passage_time_h': float((best.time - START_TIME) / 3600),
+        'distance_km': float(best.distance_to_start / 1000),
+        'layers': len(r.get_isochrones()),
+        # Nodes expanded by the A* router
+        'expanded': getattr(r, 'expanded', None),
+    }
+
+
+def cases(quick=False):
+    for route in QUICK['routes'] if quick else ROUTES:
+        for wind in QUICK['winds'] if quick else WINDS:
+            for polar in QUICK['polars'] if quick else ['default', 'cruiser', 'racer', 'cruiser-tws']:
+                for router, sizes in SIZES.items():
+                    for size in sizes[:2] if quick else sizes:
+                        for heading_step in HEADING_STEPS if router == 'isochrone' and not quick else [1.]:
+                            yield router, size, heading_step, route, polar, wind
+
+
+def run(quick=False, repeat=3, geodesy='ellipsoid'):
+    results = []
+    for router, size, heading_step, route, polar, wind in cases(quick):
+        # Take the fastest of several runs; memory is traced in a separate run as tracing slows down execution
+        runs = [run_once(router, size, heading_step, route, polar, wind, geodesy=geodesy) for _ in range(repeat)]
+        result = min(runs, key=lambda x: x['setup_time'] + x['routing_time'])
+        result['peak_memory'] = run_once(router, size, heading_step, route, polar, wind, True, geodesy)['peak_memory']
+        # The geodesy is not part of the key, so runs with different backends can be compared
+        result.update({'router': router, 'size': list(size[0]) + list(size[1]), 'heading_step': heading_step,
+                       'route': route, 'polar': polar, 'wind': wind, 'geodesy': geodesy})
+        results.append(result)
+        print(f"{router:>9} {str(result['size']):>10} {heading_step:>4} {route:>13} {polar:>8} {wind:>8}: "
+              f"{result['setup_time'] + result['routing_time']:8.3f}s {result['peak_memory'] / 1e6:8.1f}MB "
+              f"{result['passage_time_h']:8.1f}h")
+    return results
+
+
+def key(result):
+    return result['router'], tuple(result['size']), result['heading_step'], result['route'], result['polar'], \
+        result['wind']
+
+
+def compare(results, baseline):
+    '''Print the relative change in run time, memory and passage time compared to a baseline'''
+    baseline = {key(x): x for x in baseline}
+    for result in results:
+        base = baseline.get(key(result))
+        if base is None:
+            continue
+        t = (result['setup_time'] + result['routing_time']) / (base['setup_time'] + base['routing_time'])
+        m = result['peak_memory'] / base['peak_memory']
+        dt = result['passage_time_h'] - base['passage_time_h']
+        print(f"{' '.join(str(x) for x in key(result))}: time x{t:.2f}, memory x{m:.2f}, passage time {dt:+.2f}h")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--out', default='bench.json', help='JSON file to write the results to')
+    parser.add_argument('--compare', help='JSON file of a previous run to compare against')
+    parser.add_argument('--quick', action='store_true', help='only run a small subset of the cases')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs per case')
+    parser.add_argument('--geodesy', choices=['ellipsoid', 'spherical'], default='ellipsoid',
+                        help='geodesy backend of the routers')
+    args = parser.parse_args(argv)
+    results = run(args.quick, args.repeat, args.geodesy)
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import numpy as np
+
+from util import angle360, wind_from_uv
+from wind.wind import Wind
+from wind.wind_field import WindField
+
+
+class SyntheticWind(Wind):
+    '''Deterministic wind defined by its u/v components, used for benchmarks'''
+
+    def uv(self, lons, lats, t):
+        raise NotImplementedError()
+
+    def get_wind(self, loc, h, t):
+        direction, velocity = self.get_wind_batch(loc.x, loc.y, h, t)
+        return np.atleast_1d(direction), np.atleast_1d(velocity)
+
+    def get_wind_batch(self, lons, lats, h, t):
+        lons, lats, h, t = np.broadcast_arrays(*(np.asarray(a, dtype=float) for a in (lons, lats, h, t)))
+        direction, velocity = wind_from_uv(*self.uv(lons, lats, t))
+        return angle360(h - direction), velocity  # direction, speed
+
+
+class UniformWind(SyntheticWind):
+    '''Same wind everywhere and at all times; direction is where the wind is coming from'''
+
+    def __init__(self, direction=0., velocity=8.):
+        self.u = -velocity * np.sin(np.deg2rad(direction))
+        self.v = -velocity * np.cos(np.deg2rad(direction))
+
+    def uv(self, lons, lats, t):
+        return np.full(lons.shape, self.u), np.full(lons.shape, self.v)
+
+
+class RotatingWind(SyntheticWind):
+    '''Cyclonic (counterclockwise) vortex with its maximum wind speed at radius_max degrees from the center'''
+
+    def __init__(self, center=(-40., 45.), velocity_max=15., radius_max=8.):
+        self.center = center
+        self.velocity_max = velocity_max
+        self.radius_max = radius_max
+
+    def uv(self, lons, lats, t):
+        dx = (np.mod(lons - self.center[0] + 180, 360) - 180) * np.cos(np.deg2rad(self.center[1]))
+        dy = lats - self.center[1]
+        r = np.maximum(np.hypot(dx, dy), 1e-6)
+        velocity = self.velocity_max * r / self.radius_max * np.exp(1 - r / self.radius_max)
+        return -velocity * dy / r, velocity * dx / r
+
+
+class FrontalWind(SyntheticWind):
+    '''
+    A north-south front moving east. Ahead of the front the wind comes from the south-west, behind it from the
+    north-west, with a smooth transition over width degrees.
+    '''
+
+    def __init__(self, longitude=-60., speed=0.5, t0=0., width=3., velocity=10.):
+        self.longitude = longitude
+        self.speed = speed  # degrees per hour
+        self.t0 = t0
+        self.width = width
+        self.velocity = velocity
+
+    def uv(self, lons, lats, t):
+        front = self.longitude + self.speed * (t - self.t0) / 3600
+        behind = 0.5 * (1 - np.tanh((lons - front) / self.width))
+        # From south-west (225 degrees) ahead of the front, from north-west (315 degrees) behind it
+        direction = np.deg2rad(225 + 90 * behind)
+        return -self.velocity * np.sin(direction), -self.velocity * np.cos(direction)
+
+
+class CubeWind(SyntheticWind):
+    '''
+    Smooth pseudo-random wind stored in a (time, lat, lon) WindField, like the forecast cubes of GRIBLoader. The
+    field is generated from a few random Fourier modes, so it is the same for the same seed.
+    '''
+
+    def __init__(self, t0=0., hours=240, step=3, resolution=0.5, bbox=(-90., 20., 10., 70.), seed=0,
+                 velocity=8.):
+        rng = np.random.default_rng(seed)
+        times = t0 + np.arange(0, hours + step, step) * 3600.
+        lats = np.arange(bbox[1], bbox[3] + resolution, resolution)
+        lons = np.arange(bbox[0], bbox[2] + resolution, resolution)
+        t, y, x = np.meshgrid((times - t0) / 3600, lats, lons, indexing='ij')
+        u = np.full(t.shape, velocity * 0.5)
+        v = np.zeros(t.shape)
+        for _ in range(4):
+            kx, ky, kt = rng.uniform(0.02, 0.1), rng.uniform(0.02, 0.1), rng.uniform(0.005, 0.03)
+            phase, amplitude = rng.uniform(0, 2 * np.pi, 2), rng.uniform(0.3, 1.0, 2) * velocity
+            u += amplitude[0] * np.sin(kx * x + ky * y + kt * t + phase[0])
+            v += amplitude[1] * np.cos(kx * x - ky * y + kt * t + phase[1])
+        self.field = WindField(times, lats, lons, u.astype(np.float32), v.astype(np.float32))
+
+    def uv(self, lons, lats, t):
+        return self.field.interpolate(t, lats, lons)
@@ -0,0 +1,211 @@
+'''
+Command line interface of the weather routing.
+
+    python cli.py route --router dp --dp-args 20 20 --start -4.9 48.3 --end -74.7 38.9 --land
+    python cli.py route --router isochrone --wind synthetic --polar racer --out route.json
+    python cli.py prefetch --bbox -75 38 -4 49
+    python cli.py benchmark --quick --out bench.json
+    python cli.py plot --router isochrone dp --land --slider
+
+Heavy dependencies (downloading and decoding the GRIB files, matplotlib and cartopy) are only imported by the
+commands that need them, so e.g. routing on a synthetic wind starts quickly (see benchmarks/import_time.py).
+'''
+import argparse
+import json
+import time
+
+# Brest to Chesapeake Bay, as in routers.router
+START = (-4.91519, 48.26118)
+END = (-74.71870, 38.86484)
+
+
+def _number(x):
+    '''Router arguments are node counts or seconds, so integers are kept as such'''
+    return int(x) if float(x).is_integer() else float(x)
+
+
+def load_polar(name):
+    '''A polar of benchmarks.polars by name or a .pol file'''
+    from polar import Polar
+    if name.endswith('.pol'):
+        return Polar.load(name)
+    from benchmarks.polars import get_polar
+    return get_polar(name)
+
+
+def load_wind(name, start, end, start_time, max_duration, path='./tmp', margin=10.):
+    if name == 'synthetic':
+        from benchmarks.synthetic_wind import CubeWind
+        return CubeWind(start_time - 60 * 60, hours=int(max_duration / 3600) + 2)
+    from wind.grib_wind import GRIBWind
+    # Only load the weather data around the route
+    wind = GRIBWind(path, bbox=(min(start[0], end[0]), min(start[1], end[1]), max(start[0], end[0]),
+                                max(start[1], end[1])), margin=margin)
+    # Download all forecast steps concurrently instead of one at a time while routing
+    wind.loader.prefetch(start_time, max_duration)
+    return wind
+
+
+def calculate_routes(args):
+    '''Route with each of args.router and return the routers and their best points'''
+    from shapely.geometry import Point
+    from routers.router import DEFAULT_ARGS, get_router
+
+    start_time = args.start_time if args.start_time is not None else time.time() + args.departure * 3600
+    max_duration = args.max_duration * 24 * 3600
+    polar = load_polar(args.polar)
+    wind = load_wind(args.wind, args.start, args.end, start_time, max_duration, args.path)
+    land_mask = None
+    if args.land:
+        from land_mask import LandMask
+        land_mask = LandMask.from_natural_earth(cache_dir=args.path)
+    options = {'geodesy': args.geodesy, 'envelope': args.envelope, 'instrument': args.instrument}
+    results = []
+    for name in args.router:
+        router_args = getattr(args, _args_dest(name), None) or DEFAULT_ARGS[name]
+        kwargs = dict(options, heading_step=args.heading_step) if name == 'isochrone' else options
+        r = get_router(name)(*router_args, Point(*args.start), Point(*args.end), polar, wind, start_time,
+                             start_time + max_duration, land_mask=land_mask, **kwargs)
+        t = time.perf_counter()
+        best = r.calculate_routing(args.legs) if name == 'gc' else r.calculate_routing()
+        print(f'{name}: passage time {(best.time - start_time) / 3600:.1f}h, distance '
+              f'{best.distance_to_start / 1000:.1f}km, routed in {time.perf_counter() - t:.2f}s')
+        if args.instrument:
+            print(json.dumps(r.report(), indent=1))
+        results.append((name, r, best))
+    return start_time, wind, results
+
+
+def route(args):
+    from routers.router import route_summary
+    start_time, wind, results = calculate_routes(args)
+    routes = {name: best.route() for name, _, best in results}
+    isochrones = results[-1][1].get_isochrones()
+    if args.geojson:
+        from visualizer import write_geojson
+        write_geojson(args.geojson, routes, isochrones, start_time)
+    if args.binary:
+        import numpy as np
+        from visualizer import write_binary
+        end_time = max(route.time[-1] for route in routes.values())
+        write_binary(args.binary, routes, isochrones, start_time, wind, np.arange(start_time, end_time, 3 * 3600))
+    if args.out:
+        summaries = {}
+        for name, _, best in results:
+            summary = route_summary(best, start_time)
+            summary['route'] = summary['route'].tolist()
+            summaries[name] = summary
+        with open(args.out, 'w') as f:
+            json.dump(summaries, f)
+
+
+def prefetch(args):
+    from wind.grib_wind import GRIBWind
+    wind = GRIBWind(args.path, bbox=args.bbox, margin=args.margin)
+    t = time.perf_counter()
+    wind.loader.prefetch(time.time(), args.horizon * 3600)
+    print(f'Prefetched run {wind.revision} in {time.perf_counter() - t:.1f}s')
+
+
+def benchmark(args):
+    from benchmarks.run import main
+    main(args.args)
+
+
+def plot(args):
+    from visualizer import Visualizer
+    start_time, wind, results = calculate_routes(args)
+    v = Visualizer()
+    for _, _, best in results:
+        v.add_route(best.route())
+    # Isochrones (or layers) of the last router
+    v.add_isochrones(results[-1][1].get_isochrones(), linewidth=0.1)
+    v.add_points([args.start, args.end])
+    if args.slider:
+        v.add_slider([best.route() for _, _, best in results], wind, start_time)
+    else:
+        v.add_wind(wind, start_time)
+    if args.out:
+        v.save(args.out)
+    else:
+        v.show()
+
+
+def _args_dest(name):
+    '''Attribute of the parsed arguments holding the --<router>-args'''
+    return f"{name.replace('-', '_')}_args"
+
+
+def add_routing_arguments(parser, routers):
+    from routers.router import DEFAULT_ARGS, ROUTERS
+    parser.add_argument('--router', nargs='+', choices=list(ROUTERS), default=routers, help='routing algorithms')
+    # Each router has its own arguments before the common ones, so they can't be mixed up between routers
+    for name, defaults in DEFAULT_ARGS.items():
+        if defaults:
+            parser.add_argument(f'--{name}-args', dest=_args_dest(name), type=_number, nargs=len(defaults),
+                                metavar=('TIME_STEP',) if name == 'isochrone' else ('NODES', 'LAYERS'),
+                                help=f"arguments of the {name} router (default: {' '.join(map(str, defaults))})")
+    parser.add_argument('--legs', type=int, default=20, help='number of legs of the gc router')
+    parser.add_argument('--start', type=float, nargs=2, default=START, metavar=('LON', 'LAT'))
+    parser.add_argument('--end', type=float, nargs=2, default=END, metavar=('LON', 'LAT'))
+    parser.add_argument('--start-time', type=float, help='departure in s since epoch')
+    parser.add_argument('--departure', type=float, default=3., help='departure in h from now (without --start-time)')
+    parser.add_argument('--max-duration', type=float, default=30., help='maximum passage time in days')
+    parser.add_argument('--polar', default='default',
+                        help='polar of benchmarks.polars (default, cruiser, racer, cruiser-tws) or a .pol file')
+    parser.add_argument('--wind', choices=['grib', 'synthetic'], default='grib',
+                        help='DWD ICON forecasts or a synthetic wind field')
+    parser.add_argument('--land', action='store_true', help='avoid land (Natural Earth land polygons)')
+    parser.add_argument('--geodesy', choices=['ellipsoid', 'spherical'], default='ellipsoid')
+    parser.add_argument('--envelope', action='store_true',
+                        help="tack or gybe at the polar's VMG angles instead of sailing all courses directly")
+    parser.add_argument('--heading-step', type=float, default=1., help='heading step of the isochrone router')
+    parser.add_argument('--instrument', action='store_true', help='print the time spent in each stage')
+    parser.add_argument('--path', default='./tmp', help='directory for the weather data and land mask')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    parser_route = commands.add_parser('route', help='calculate a route and print its passage time')
+    add_routing_arguments(parser_route, ['dp'])
+    parser_route.add_argument('--out', help='JSON file for the routes (by router)')
+    parser_route.add_argument('--geojson', help='GeoJSON file for the routes and the isochrones of the last router')
+    parser_route.add_argument('--binary', help='binary file (see visualizer.py) for the routes, the isochrones of '
+                                               'the last router and the wind every 3h, e.g. for web viewers')
+    parser_route.set_defaults(run=route)
+
+    parser_prefetch = commands.add_parser('prefetch', help='download and decode the latest forecast run')
+    parser_prefetch.add_argument('--bbox', type=float, nargs=4, metavar=('LON_MIN', 'LAT_MIN', 'LON_MAX', 'LAT_MAX'))
+    parser_prefetch.add_argument('--margin', type=float, default=10., help='margin around the bbox in degrees')
+    parser_prefetch.add_argument('--horizon', type=float, default=24 * 7.5, help='hours from now')
+    parser_prefetch.add_argument('--path', default='./tmp', help='directory for the weather data')
+    parser_prefetch.set_defaults(run=prefetch)
+
+    parser_benchmark = commands.add_parser('benchmark', help='run the benchmarks (arguments of benchmarks.run)',
+                                           add_help=False)
+    parser_benchmark.set_defaults(run=benchmark)
+
+    parser_plot = commands.add_parser('plot', help='calculate and plot routes of one or more routers')
+    add_routing_arguments(parser_plot, ['isochrone', 'dp'])
+    parser_plot.add_argument('--out', help='image file for the plot (shown in a window otherwise)')
+    parser_plot.add_argument('--slider', action='store_true', help='add a time slider for the boats and the wind')
+    parser_plot.set_defaults(run=plot)
+
+    # The arguments of benchmark are parsed by benchmarks.run
+    args, unknown = parser.parse_known_args(argv)
+    if args.command == 'benchmark':
+        args.args = unknown
+    elif unknown:
+        parser.error(f"unrecognized arguments: {' '.join(unknown)}")
+    if args.command in ('route', 'plot'):
+        from routers.router import ROUTERS
+        unused = [name for name in ROUTERS if name not in args.router and getattr(args, _args_dest(name), None)]
+        if unused:
+            parser.error(f"--{'-args, --'.join(unused)}-args given, but not in --router")
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
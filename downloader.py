@@ -0,0 +1,37 @@
+import os
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class Downloader:
+    '''
+    Downloads files over a shared, pooled HTTP session. Files are first written to a partial file, which is resumed on
+    the next attempt if the download is interrupted, and atomically renamed once complete.
+    '''
+
+    def __init__(self, max_connections=8, chunk_size=1 << 20, retries=3, timeout=60):
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections, max_retries=retries)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def download(self, url, filename):
+        part_file = f'{filename}.part'
+        offset = os.path.getsize(part_file) if os.path.isfile(part_file) else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        with self.session.get(url, stream=True, headers=headers, timeout=self.timeout) as r:
+            # The partial file is already complete
+            if offset and r.status_code == 416:
+                os.replace(part_file, filename)
+                return filename
+            r.raise_for_status()
+            # Start from scratch if the server ignored the range request
+            mode = 'ab' if offset and r.status_code == 206 else 'wb'
+            with open(part_file, mode) as fd:
+                for block in r.iter_content(chunk_size=self.chunk_size):
+                    fd.write(block)
+        os.replace(part_file, filename)
+        return filename
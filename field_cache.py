@@ -0,0 +1,57 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class FieldCache:
+    '''
+    Least recently used cache for decoded fields with a byte budget. Keys are e.g. (run, forecast step or climatology
+    month, variable). When the cached arrays exceed max_bytes, the least recently used fields are evicted.
+    '''
+
+    def __init__(self, max_bytes=1024 ** 3):
+        self.max_bytes = max_bytes
+        self.fields = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self.fields
+
+    def get(self, key, load):
+        '''Returns the cached field for key, calling load() to create it if it is not cached'''
+        with self._lock:
+            if key in self.fields:
+                self.hits += 1
+                self.fields.move_to_end(key)
+                return self.fields[key]
+            self.misses += 1
+        # Load outside of the lock, so other threads can use the cache in the meantime
+        field = np.asarray(load())
+        with self._lock:
+            if key not in self.fields:
+                self.fields[key] = field
+                self.nbytes += field.nbytes
+                self._evict()
+        return field
+
+    def _evict(self):
+        # Always keep the most recently added field, even if it alone exceeds the budget
+        while self.nbytes > self.max_bytes and len(self.fields) > 1:
+            _, field = self.fields.popitem(last=False)
+            self.nbytes -= field.nbytes
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self.fields.clear()
+            self.nbytes = 0
+
+    @property
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'bytes': self.nbytes,
+                'fields': len(self.fields)}
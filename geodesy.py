@@ -0,0 +1,122 @@
+'''
+Geodesy backends for the routers. Both have the fwd/inv API of pyproj's Geod for arrays (degrees and meters):
+
+    fwd(lons, lats, azimuths, distances) -> lons, lats, back azimuths
+    inv(lons1, lats1, lons2, lats2) -> forward azimuths, back azimuths, distances
+
+SphericalGeod uses closed-form great circle formulas on the conformal sphere in NumPy, which is about 2.5x (fwd) and
+4x (inv) faster than pyproj. Against pyproj's Geod(ellps='WGS84'), for latitudes up to 85 degrees, the errors are at
+most (checked by running this module)
+
+    leg length    distance (relative)    azimuths    position (fwd)
+    <= 100 km     2e-7                   0.005°      3 m
+    <= 1000 km    2e-5                   0.05°       300 m
+    <= 5000 km    5e-4                   2°          7 km
+
+so it is meant for the legs of the routers (up to a few hundred km), not for the great circle of a whole passage.
+'''
+import numpy as np
+
+# WGS84
+A = 6378137.
+F = 1 / 298.257223563
+E2 = F * (2 - F)
+E = np.sqrt(E2)
+# Series from conformal to geodetic latitude, accurate to about 1e-9 rad
+B2 = E2 / 2 + 5 * E2 ** 2 / 24 + E2 ** 3 / 12
+B4 = 7 * E2 ** 2 / 48 + 29 * E2 ** 3 / 240
+B6 = 7 * E2 ** 3 / 120
+
+
+def _conformal(sin_phi):
+    '''
+    Returns sine and cosine of the conformal latitude and the scale of the conformal sphere (radius A) relative to
+    the ellipsoid, given the sine of the geodetic latitude
+    '''
+    sin_chi = np.tanh(np.arctanh(sin_phi) - E * np.arctanh(E * sin_phi))
+    cos_chi2 = 1 - sin_chi ** 2
+    return sin_chi, np.sqrt(cos_chi2), np.sqrt(cos_chi2 * (1 - E2 * sin_phi ** 2) / (1 - sin_phi ** 2))
+
+
+def _geodetic(sin_chi, cos_chi):
+    '''Geodetic latitude in radians of a conformal latitude given by its sine and cosine'''
+    sin2, cos2 = 2 * sin_chi * cos_chi, 1 - 2 * sin_chi ** 2
+    # sin(4 chi) = 2 sin(2 chi) cos(2 chi) and sin(6 chi) = sin(2 chi) (3 - 4 sin(2 chi)^2)
+    return np.arcsin(sin_chi) + sin2 * (B2 + 2 * B4 * cos2 + B6 * (3 - 4 * sin2 ** 2))
+
+
+class SphericalGeod:
+    '''
+    Fast geodesy on the conformal sphere, see the module docstring for the error bounds. Conformal latitudes preserve
+    angles, so azimuths are exact for short legs, and distances are corrected by the scale of the sphere at the
+    middle of the leg.
+    '''
+
+    def fwd(self, lons, lats, azimuths, distances):
+        phi = np.deg2rad(lats)
+        alpha = np.deg2rad(azimuths)
+        sin_alpha, cos_alpha = np.sin(alpha), np.cos(alpha)
+        sin_chi1, cos_chi1, _ = _conformal(np.sin(phi))
+        # The scale changes along the leg, so it is taken at the (approximate) middle latitude
+        distances = np.asarray(distances, dtype=float)
+        _, _, k = _conformal(np.sin(phi + distances * cos_alpha / (2 * A)))
+        delta = distances * k / A
+        sin_delta, cos_delta = np.sin(delta), np.cos(delta)
+        sin_chi2 = np.clip(sin_chi1 * cos_delta + cos_chi1 * sin_delta * cos_alpha, -1, 1)
+        cos_chi2 = np.sqrt(1 - sin_chi2 ** 2)
+        dlon = np.arctan2(sin_alpha * sin_delta * cos_chi1, cos_delta - sin_chi1 * sin_chi2)
+        lon2 = np.mod(np.asarray(lons) + np.rad2deg(dlon) + 180, 360) - 180
+        back_az = np.arctan2(-sin_alpha * cos_chi1, sin_chi1 * sin_delta - cos_chi1 * cos_delta * cos_alpha)
+        return lon2, np.rad2deg(_geodetic(sin_chi2, cos_chi2)), np.rad2deg(back_az)
+
+    def inv(self, lons1, lats1, lons2, lats2):
+        phi1, phi2 = np.deg2rad(lats1), np.deg2rad(lats2)
+        dlon = np.deg2rad(np.asarray(lons2) - lons1)
+        sin_dlon, cos_dlon = np.sin(dlon), np.cos(dlon)
+        sin_chi1, cos_chi1, _ = _conformal(np.sin(phi1))
+        sin_chi2, cos_chi2, _ = _conformal(np.sin(phi2))
+        y, x = cos_chi2 * sin_dlon, cos_chi1 * sin_chi2 - sin_chi1 * cos_chi2 * cos_dlon
+        # The angle between the points, which is precise for short and long legs
+        delta = np.arctan2(np.hypot(y, x), sin_chi1 * sin_chi2 + cos_chi1 * cos_chi2 * cos_dlon)
+        _, _, k = _conformal(np.sin((phi1 + phi2) / 2))
+        back_az = np.arctan2(-cos_chi1 * sin_dlon, sin_chi1 * cos_chi2 - cos_chi1 * sin_chi2 * cos_dlon)
+        return np.rad2deg(np.arctan2(y, x)), np.rad2deg(back_az), delta * A / k
+
+
+def get_geod(geodesy='ellipsoid', crs='WGS84'):
+    '''Returns the geodesy backend: 'ellipsoid' (pyproj, exact), 'spherical' (SphericalGeod) or a backend object'''
+    if geodesy == 'ellipsoid':
+        # Imported here, so the spherical backend doesn't need to load pyproj
+        from pyproj import Geod
+        return Geod(ellps=crs)
+    if geodesy == 'spherical':
+        return SphericalGeod()
+    return geodesy
+
+
+if __name__ == '__main__':
+    from pyproj import Geod
+
+    # Check the error bounds in the module docstring against pyproj on random legs
+    rng = np.random.default_rng(0)
+    n = 200000
+    g, s = Geod(ellps='WGS84'), SphericalGeod()
+    lons, lats = rng.uniform(-180, 180, n), rng.uniform(-85, 85, n)
+    azimuths = rng.uniform(-180, 180, n)
+
+    def angle_error(a, b):
+        return np.max(np.abs(np.mod(a - b + 180, 360) - 180))
+
+    for max_distance, bounds in ((100e3, (2e-7, 0.005, 3)), (1000e3, (2e-5, 0.05, 300)), (5000e3, (5e-4, 2, 7e3))):
+        distances = rng.uniform(1, max_distance, n)
+        lons2, lats2, back_azimuths = g.fwd(lons, lats, azimuths, distances)
+        az, back_az, dist = s.inv(lons, lats, lons2, lats2)
+        x, y, fwd_back_az = s.fwd(lons, lats, azimuths, distances)
+        _, _, position_error = g.inv(lons2, lats2, x, y)
+        errors = (np.max(np.abs(dist - distances) / distances),
+                  max(angle_error(az, azimuths), angle_error(back_az, back_azimuths),
+                      angle_error(fwd_back_az, back_azimuths)),
+                  np.max(position_error))
+        print(f'<= {max_distance / 1e3:.0f} km: distance {errors[0]:.1e}, azimuths {errors[1]:.4f}°, '
+              f'position {errors[2]:.1f} m')
+        assert all(error <= bound for error, bound in zip(errors, bounds))
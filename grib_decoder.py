@@ -0,0 +1,19 @@
+import numpy as np
+
+
+def decode_grib(message):
+    '''
+    Decode the values of a single GRIB message (e.g. a field on the ICON icosahedral grid). Missing values are
+    returned as NaN.
+    '''
+    # eccodes is only needed when fields are decoded, so it is imported lazily
+    import eccodes
+
+    gid = eccodes.codes_new_from_message(message)
+    try:
+        values = eccodes.codes_get_values(gid)
+        if eccodes.codes_get(gid, 'bitmapPresent'):
+            values = np.where(values == eccodes.codes_get(gid, 'missingValue'), np.nan, values)
+    finally:
+        eccodes.codes_release(gid)
+    return values
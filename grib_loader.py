@@ -1,191 +1,347 @@
+import bz2
+import copy
 import datetime
 import os
+import tarfile
 import tempfile
+import threading
 import time
-from subprocess import call
+from concurrent.futures import ThreadPoolExecutor
 
 import pytz
-import requests
 import numpy as np
 import scipy.io as sio
-import scipy.interpolate as sip
 
-from util import angle360
+from downloader import Downloader
+from field_cache import FieldCache
+from instrumentation import NULL_INSTRUMENTATION
+from grib_decoder import decode_grib
+from remap import Remapper
+from util import wind_from_uv
+from wind.wind_field import WindField
+from wind_store import FORECAST_STEPS, WindStore, grid_window, window_coordinates
 
 
 class GRIBLoader:
-    '''Loads GRIB files from DWD and interpolates them to a regular grid'''
+    '''
+    Loads GRIB files from DWD and interpolates them to a regular grid. The fields of a run are cached in a WindStore.
+    If a bounding box (lon_min, lat_min, lon_max, lat_max) is given, only that area plus a margin in degrees is loaded
+    into memory. Decoded fields are kept in a FieldCache with a byte budget, which can be shared between loaders. The
+    base URLs can be pointed to a local server, e.g. for testing.
+    '''
     
-    def __init__(self, path=None):
+    def __init__(self, path=None, bbox=None, margin=5., base_url='https://opendata.dwd.de',
+                 clima_url='https://www.ncei.noaa.gov/thredds/fileServer/uv/clm/uvclm95to05.nc', max_workers=8,
+                 cache=None, cache_bytes=1024 ** 3):
         self.path = path if path else tempfile.gettempdir()
+        self.bbox = bbox
+        self.margin = margin
+        self.base_url = base_url
+        self.max_workers = max_workers
+        self.downloader = Downloader(max_connections=max_workers)
+        self._lock = threading.Lock()
+        # Filename -> lock, so concurrent prefetches don't download the same forecast file at once
+        self._file_locks = {}
 
         grid_dir = os.path.join(self.path, 'ICON_GLOBAL2WORLD_025_EASY/')
         if not os.path.exists(grid_dir):
             grid_tar = os.path.join(self.path, 'ICON_GLOBAL2WORLD_025_EASY.tar.bz2')
-            self.download_file('https://opendata.dwd.de/weather/lib/cdo/ICON_GLOBAL2WORLD_025_EASY.tar.bz2', grid_tar)
+            self.download_file(f'{self.base_url}/weather/lib/cdo/ICON_GLOBAL2WORLD_025_EASY.tar.bz2', grid_tar)
 
-            rt = call(['tar', 'xf', grid_tar, '-C', self.path])
-            if rt != 0:
-                raise SystemError('Could not untar file')
-            rt = call(['rm', grid_tar])
-            if rt != 0:
-                raise SystemError("Error with remove")
+            with tarfile.open(grid_tar) as tar:
+                tar.extractall(self.path, filter='data')
+            os.remove(grid_tar)
 
-        self.target_file = os.path.join(grid_dir, 'target_grid_world_025.txt')
         self.weight_file = os.path.join(grid_dir, 'weights_icogl2world_025.nc')
+        self._remapper = None
 
         self.clima_file = os.path.join(self.path, 'uvclm95to05.nc')
         if not os.path.exists(self.clima_file):
-            self.download_file('https://www.ncei.noaa.gov/thredds/fileServer/uv/clm/uvclm95to05.nc', self.clima_file)
+            self.download_file(clima_url, self.clima_file)
 
-        now = datetime.datetime.utcnow()
-        if now.hour < 4:
-            now -= datetime.timedelta(hours=12)
-            self.run = '12'
-        else:
-            self.run = '00'
-        self.today = datetime.datetime(year=now.year, month=now.month, day=now.day, hour=0 if self.run == '00' else 12,
-                                       tzinfo=pytz.utc)
+        # Decoded fields (cropped to the bounding box) by (run, forecast step or climatology month, variable, area)
+        self.cache = cache if cache is not None else FieldCache(cache_bytes)
+        # (months or steps, WindField) of the last field, replaced at once so concurrent lookups see consistent pairs
+        self._clima_field = None
+        # (area, (lats, lons)) of the climatology fields
+        self._clima_coordinates = None
+        self.instrumentation = NULL_INSTRUMENTATION
+        self.select_run(self.latest_run())
 
-        self.wind_direction = {}
-        self.wind_velocity = {}
+    @staticmethod
+    def latest_run(now=None):
+        '''Returns the start of the latest run (00 or 12 UTC) available at now, i.e. that started at least 4h before'''
+        now = datetime.datetime.utcnow() if now is None else now
+        now -= datetime.timedelta(hours=4)
+        return datetime.datetime(year=now.year, month=now.month, day=now.day, hour=0 if now.hour < 12 else 12,
+                                 tzinfo=pytz.utc)
 
-    def get_dwd_weather_data(self, metric='u_10m', hours='000'):
+    def select_run(self, today):
+        '''Use the run starting at the given time. Fields of other runs are evicted from the cache eventually.'''
+        self.today = today
+        self.run = f'{today.hour:02}'
+        date = time.strftime("%Y%m%d", self.today.timetuple())
+        self.store_file = os.path.join(self.path, f'icon_global_{date}{self.run}.wind')
+        self.store = WindStore(self.store_file) if os.path.isfile(f'{self.store_file}.json') else None
+        self.run_id = f'{date}{self.run}'
+        self._wind_field = None
+
+    def refresh(self, now=None):
+        '''
+        Switch to the latest run if a newer one is available. Returns True if the run changed. The run is switched in
+        place, so this must not be called while other threads use the loader (see newer_run).
+        '''
+        today = self.latest_run(now)
+        if today <= self.today:
+            return False
+        self.select_run(today)
+        return True
+
+    def newer_run(self, now=None):
+        '''
+        Returns a loader for the latest run if a newer one is available, else None. It shares the downloader, grid
+        weights and field cache with this loader, so it can be prefetched while this one is in use and then replace it.
+        '''
+        today = self.latest_run(now)
+        if today <= self.today:
+            return None
+        loader = copy.copy(self)
+        loader.select_run(today)
+        return loader
+
+    def get_dwd_url(self, metric='u_10m', hours='000'):
         date = time.strftime("%Y%m%d", self.today.timetuple())
-        filename = f'icon_global_{date}{self.run}_{hours}_{metric.upper()}'
-        nc_file = os.path.join(self.path, f'{filename}.nc')
-        if not os.path.isfile(nc_file):
-            url = f'https://opendata.dwd.de/weather/nwp/icon/grib/{self.run}/{metric.lower()}/' \
-                  f'icon_global_icosahedral_single-level_{date}{self.run}_{hours}_{metric.upper()}.grib2.bz2'
-            bz2_file = os.path.join(self.path, f'{filename}.grib2.bz2')
-            self.download_file(url, bz2_file)
-
-            rt = call(['bzip2', '-d', bz2_file])
-            if rt != 0:
-                raise RuntimeError('Bzip2 failed.')
-            grib2_file = os.path.join(self.path, f'{filename}.grib2')
-            rt = call(['cdo', '-f', 'nc', f'remap,{self.target_file},{self.weight_file}', grib2_file, nc_file])
-            if rt != 0:
-                raise RuntimeError('CDO failed.')
-            rt = call(['rm', grib2_file])
-            if rt != 0:
-                raise RuntimeError('Removing GRIB2 failed.')
-        return nc_file
+        return f'{self.base_url}/weather/nwp/icon/grib/{self.run}/{metric.lower()}/' \
+               f'icon_global_icosahedral_single-level_{date}{self.run}_{hours}_{metric.upper()}.grib2.bz2'
+
+    def get_dwd_weather_data(self, metric='u_10m', hours='000'):
+        '''
+        Download a field on the icosahedral grid and decode it. The compressed file is downloaded to the data
+        directory, so an interrupted download is resumed by the next attempt, and removed once it is decoded.
+        '''
+        url = self.get_dwd_url(metric, hours)
+        filename = os.path.join(self.path, url.rsplit('/', 1)[-1])
+        with self._lock:
+            lock = self._file_locks.setdefault(filename, threading.Lock())
+        with lock:
+            self.download_file(url, filename)
+            with open(filename, 'rb') as f:
+                grib = bz2.decompress(f.read())
+            os.remove(filename)
+        return decode_grib(grib)
+
+    def get_remapper(self):
+        '''Returns the remapper from the icosahedral to the regular grid. The weights are only loaded once.'''
+        with self._lock:
+            if self._remapper is None:
+                self._remapper = Remapper(self.weight_file)
+        return self._remapper
     
-    @staticmethod
-    def download_file(url, filename):
-        r = requests.get(url, stream=True)
-        r.raise_for_status()
-        with open(filename, 'wb') as fd:
-            for block in r.iter_content(chunk_size=1024):
-                fd.write(block)
+    def download_file(self, url, filename):
+        self.downloader.download(url, filename)
 
     @staticmethod
-    def extract_data(filename, key):
+    def extract_data_time(filename, key, bbox=None, margin=0., month=None):
         with sio.netcdf_file(filename) as f:
             data = f.variables[key]
-            if len(data.shape) == 3:
-                data = np.array(data[0, :, :])
-            elif len(data.shape) == 4:
-                data = np.array(data[0, 0, :, :])
             lons = np.array(f.variables['lon'][:])
             lats = np.array(f.variables['lat'][:])
-        return data, lats, lons
-
-    @staticmethod
-    def extract_data_time(filename, key):
-        with sio.netcdf_file(filename) as f:
-            data = f.variables[key]
+            # The file is memory mapped, so cropping before copying only reads the window
+            lat_slice, lon_index = grid_window(lats, lons, bbox, margin) if bbox else (slice(None), slice(None))
+            months = slice(None) if month is None else month
             if len(data.shape) == 3:
-                data = np.array(data[:, :, :])
+                data = np.array(data[months, lat_slice, :][..., lon_index])
             elif len(data.shape) == 4:
-                data = np.array(data[:, 0, :, :])
-            lons = np.array(f.variables['lon'][:])
-            lats = np.array(f.variables['lat'][:])
+                data = np.array(data[months, 0, lat_slice, :][..., lon_index])
+            if bbox:
+                lats, lons = window_coordinates(lats, lons, (lat_slice, lon_index))
         return data, lats, lons
 
     def get_uv_dwd(self, forecast):
-        filename = self.get_dwd_weather_data(metric='u_10m', hours=f"{forecast:03}")
-        u, lats, lons = self.extract_data(filename, '10u')
-        filename = self.get_dwd_weather_data(metric='v_10m', hours=f"{forecast:03}")
-        v, lats, lons = self.extract_data(filename, '10v')
-        return u, v, lats, lons
+        u = self.get_dwd_weather_data(metric='u_10m', hours=f"{forecast:03}")
+        v = self.get_dwd_weather_data(metric='v_10m', hours=f"{forecast:03}")
+        remapper = self.get_remapper()
+        u, v = remapper.remap(np.stack([u, v]))
+        return u, v, remapper.lats, remapper.lons
+
+    def extract_clima(self, key, month):
+        '''Returns a variable of a climatology month (cropped to the bounding box) and its coordinates'''
+        data, lats, lons = self.extract_data_time(self.clima_file, key, self.bbox, self.margin, month)
+        return np.where(np.abs(data) > 1000, 1e-10, data).astype(np.float32), (lats, lons)
+
+    def clima_coordinates(self):
+        '''Returns the latitudes and longitudes of the climatology fields (cropped to the bounding box)'''
+        area = self._area()
+        current = self._clima_coordinates
+        if current is None or current[0] != area:
+            with sio.netcdf_file(self.clima_file) as f:
+                lats = np.array(f.variables['lat'][:])
+                lons = np.array(f.variables['lon'][:])
+            if self.bbox:
+                lats, lons = window_coordinates(lats, lons, grid_window(lats, lons, self.bbox, self.margin))
+            current = (area, (lats, lons))
+            self._clima_coordinates = current
+        return current[1]
+
+    def forecast_hours(self, timestamps):
+        '''Hours since the start of the forecast run'''
+        return (np.asarray(timestamps, dtype=float) - self.today.timestamp()) / 60 / 60
+
+    @staticmethod
+    def bracketing_forecasts(hours):
+        '''Returns the forecast steps before and after the given hours since the start of the run'''
+        hours = np.clip(hours, 0, 180)
+        # Below 78h, the forecast is available in 1h steps, after 78h only in 3h steps
+        lower = np.where(hours <= 78, np.floor(hours), 78 + np.floor((hours - 78) / 3) * 3).astype(int)
+        upper = np.where(hours <= 78, np.ceil(hours), 78 + np.ceil((hours - 78) / 3) * 3).astype(int)
+        return lower, upper
+
+    def convert_forecast(self, forecast):
+        '''Download a forecast step and write it into the wind store'''
+        with self.instrumentation.stage('download'):
+            u, v, lats, lons = self.get_uv_dwd(forecast)
+        self._put_forecast(forecast, u, v, lats, lons)
+
+    def _put_forecast(self, forecast, u, v, lats, lons):
+        with self._lock:
+            if self.store is None:
+                self.store = WindStore(self.store_file, lats, lons)
+            self.store.put(forecast, u, v)
+
+    def forecasts_between(self, start_time, end_time):
+        '''Returns all forecast steps needed to interpolate the wind between the given times'''
+        first, _ = self.bracketing_forecasts(self.forecast_hours(start_time))
+        _, last = self.bracketing_forecasts(self.forecast_hours(end_time))
+        return [step for step in FORECAST_STEPS if first <= step <= last]
 
-    def get_uv_clima(self):
-        u, lats, lons = self.extract_data_time(self.clima_file, 'u')
-        v, lats, lons = self.extract_data_time(self.clima_file, 'v')
-        u = np.where(np.abs(u) > 1000, 1e-10, u)
-        v = np.where(np.abs(v) > 1000, 1e-10, v)
+    def prefetch(self, start_time, horizon, batch_size=8):
+        '''
+        Download and convert all forecast steps needed between start_time and start_time + horizon (in seconds)
+        concurrently. Steps that are already in the wind store are skipped.
+        '''
+        steps = [step for step in self.forecasts_between(start_time, start_time + horizon)
+                 if self.store is None or not self.store.has(step)]
+        remapper = self.get_remapper()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # Download and decode a batch of steps concurrently, then remap all of its fields with one sparse
+            # matrix multiplication
+            for i in range(0, len(steps), batch_size):
+                batch = steps[i:i + batch_size]
+                jobs = [(metric, f'{step:03}') for step in batch for metric in ('u_10m', 'v_10m')]
+                fields = list(executor.map(lambda job: self.get_dwd_weather_data(*job), jobs))
+                fields = remapper.remap(np.stack(fields))
+                for j, step in enumerate(batch):
+                    self._put_forecast(step, fields[2 * j], fields[2 * j + 1], remapper.lats, remapper.lons)
+        return steps
+
+    def _area(self):
+        '''Part of the cache keys, as the cache may be shared by loaders of different areas'''
+        return tuple(self.bbox) if self.bbox else None, self.margin
+
+    def _cached(self, key, load):
+        self.instrumentation.count('wind_cache_hits' if key in self.cache else 'wind_cache_misses')
+        return self.cache.get(key, load)
+
+    def load_forecast(self, forecast):
+        '''Returns u and v of a forecast step (cropped to the bounding box) and their coordinates'''
+        if self.store is None or not self.store.has(forecast):
+            self.convert_forecast(forecast)
+        lats, lons = self.store.lats, self.store.lons
+        window = grid_window(lats, lons, self.bbox, self.margin) if self.bbox else None
+
+        def load(variable):
+            with self.instrumentation.stage('load_forecast'):
+                return self.store.get_variable(forecast, variable, window)
+        u = self._cached((self.run_id, forecast, 'u') + self._area(), lambda: load(0))
+        v = self._cached((self.run_id, forecast, 'v') + self._area(), lambda: load(1))
+        if window is not None:
+            lats, lons = window_coordinates(lats, lons, window)
         return u, v, lats, lons
 
-    def get_wind_velocity_direction(self, time, force_file_read=False):
-        forecast = round((time - self.today.timestamp()) / 60 / 60)
-        # After 78h, the forecast is only available in 3h steps, so we round to the nearest 3h step
-        if 78 < forecast <= 180:
-            m = forecast % 3
-            if m == 1:
-                forecast -= 1
-            elif m == 2:
-                forecast += 1
-            forecast_str = str(forecast)
-        # After 180h, we fallback to monthly climatology
-        elif forecast > 180:
-            month = datetime.datetime.utcfromtimestamp(time).month - 1
-            forecast_str = f'm{month}'
-        # Below 78h, the forecast is available in 1h steps
-        else:
-            forecast_str = str(forecast)
-        forecast_in_dicts = forecast_str in self.wind_velocity and forecast_str in self.wind_direction
-        # Load file if it is not in memory yet or if we want to force a file read
-        if force_file_read or not forecast_in_dicts:
-            if forecast <= 180:
-                u, v, lats, lons = self.get_uv_dwd(forecast)
-                velocity = np.sqrt(u**2 + v**2)
-                direction = angle360(np.rad2deg(np.arccos(v / velocity)))
-            elif self.clima_file:
-                u, v, lats, lons = self.get_uv_clima()
-                velocity = np.sqrt(u**2 + v**2)
-                # When velocity is NaN or a very small number, we set it to 1e-10 to avoid division by zero
-                velocity = np.where(velocity == np.nan, 1e-10, np.where(velocity < 1e-10, 1e-10, velocity))
-                acos = v / velocity
-                # Clip acos to [-1, 1] to avoid NaNs
-                acos = np.where(acos > 1, 1, np.where(acos < -1, -1, acos))
-                direction = angle360(np.rad2deg(np.arccos(acos)))
-            else:
-                raise FileNotFoundError()
-            # Store interpolators in memory
-            if not forecast_in_dicts:
-                if len(u.shape) == 2:
-                    self.wind_velocity[forecast_str] = sip.interp2d(lons, lats, velocity)
-                    self.wind_direction[forecast_str] = sip.interp2d(lons, lats, direction)
-                else:
-                    for m in range(u.shape[0]):
-                        self.wind_velocity[f'm{m}'] = sip.interp2d(lons, lats, velocity[m])
-                        self.wind_direction[f'm{m}'] = sip.interp2d(lons, lats, direction[m])
-            if len(u.shape) == 2:
-                return forecast_str, velocity, direction, lats, lons
-            else:
-                return forecast_str, velocity[month], direction[month], lats, lons
-        else:
-            return forecast_str, self.wind_velocity[forecast_str], self.wind_direction[forecast_str], None, None
+    def load_clima(self, month):
+        '''Returns u and v of a climatology month (cropped to the bounding box) and their coordinates'''
+        if not self.clima_file:
+            raise FileNotFoundError()
+
+        def load(key):
+            with self.instrumentation.stage('load_climatology'):
+                return self.extract_clima(key, month)[0]
+        u = self._cached(('clima', month, 'u') + self._area(), lambda: load('u'))
+        v = self._cached(('clima', month, 'v') + self._area(), lambda: load('v'))
+        # The fields may have been loaded by another loader sharing the cache
+        return (u, v) + self.clima_coordinates()
+
+    def get_wind_field(self, forecasts):
+        '''Returns a WindField containing (at least) the given forecast steps'''
+        steps = sorted(set(int(forecast) for forecast in forecasts))
+        # Reuse the last field if it contains all steps
+        current = self._wind_field
+        if current is not None and set(steps) <= set(current[0]):
+            return current[1]
+        fields = [self.load_forecast(step) for step in steps]
+        with self.instrumentation.stage('build_wind_field'):
+            times = [self.today.timestamp() + step * 60 * 60 for step in steps]
+            u = np.stack([field[0] for field in fields])
+            v = np.stack([field[1] for field in fields])
+            field = WindField(times, fields[0][2], fields[0][3], u, v)
+        self._wind_field = (steps, field)
+        return field
+
+    def get_clima_field(self, months):
+        '''Returns a WindField with the given climatology months, whose time axis is the month (0-11)'''
+        months = sorted(set(int(month) for month in months))
+        current = self._clima_field
+        if current is not None and set(months) <= set(current[0]):
+            return current[1]
+        fields = [self.load_clima(month) for month in months]
+        u = np.stack([field[0] for field in fields])
+        v = np.stack([field[1] for field in fields])
+        field = WindField(months, fields[0][2], fields[0][3], u, v)
+        self._clima_field = (months, field)
+        return field
+
+    def get_wind_uv_batch(self, timestamps, lons, lats):
+        '''
+        Returns the wind components at the given times and locations. Up to 180h after the start of the run, the
+        forecast is interpolated in time between the surrounding forecast steps. After 180h, we fallback to monthly
+        climatology.
+        '''
+        timestamps, lons, lats = np.broadcast_arrays(np.asarray(timestamps, dtype=float), lons, lats)
+        u = np.empty(lons.shape)
+        v = np.empty(lons.shape)
+        hours = self.forecast_hours(timestamps)
+        forecast = hours <= 180
+        if np.any(forecast):
+            lower, upper = self.bracketing_forecasts(hours[forecast])
+            field = self.get_wind_field(np.unique(np.concatenate([lower, upper])))
+            u[forecast], v[forecast] = field.interpolate(timestamps[forecast], lats[forecast], lons[forecast])
+        if not np.all(forecast):
+            month = timestamps[~forecast].astype('datetime64[s]').astype('datetime64[M]').astype(int) % 12
+            field = self.get_clima_field(np.unique(month))
+            u[~forecast], v[~forecast] = field.interpolate(month, lats[~forecast], lons[~forecast])
+        return u, v
 
     def get_wind(self, timestamp, loc):
-        forecast, *_ = self.get_wind_velocity_direction(timestamp)
-        direction = self.wind_direction[forecast](loc.x, loc.y)
-        velocity = self.wind_velocity[forecast](loc.x, loc.y)
-        return direction, velocity
+        direction, velocity = self.get_wind_batch(timestamp, loc.x, loc.y)
+        # Routers index the result, so we return arrays of shape (1,)
+        return np.atleast_1d(direction), np.atleast_1d(velocity)
+
+    def get_wind_batch(self, timestamps, lons, lats):
+        '''Vectorized get_wind. Returns the direction the wind is coming from and its speed.'''
+        u, v = self.get_wind_uv_batch(timestamps, lons, lats)
+        return wind_from_uv(u, v)
 
     def display_wind(self, timestamp):
-        # _, velocity, _, lats, lons = self.get_wind_velocity_direction(timestamp, force_file_read=True)
-        u, v, lats, lons = self.get_uv_clima()
         month = datetime.datetime.utcfromtimestamp(timestamp).month - 1
-        return u[month], v[month], lats, lons
+        return self.load_clima(month)
 
 
 if __name__ == '__main__':
     import matplotlib.pyplot as plt
     import cartopy.crs as crs
     l = GRIBLoader(path='./tmp')
+    # Fetch the first three days of the current run
+    l.prefetch(time.time(), 60 * 60 * 24 * 3)
     t = (datetime.datetime.utcnow() + datetime.timedelta(days=1)).timestamp()
     u, v, lats, lons = l.display_wind(t)
     fig = plt.figure()
@@ -0,0 +1,132 @@
+import cProfile
+import functools
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+
+
+class Instrumentation:
+    '''
+    Opt-in counters and cumulative timers for the stages of a routing (geodesic calls, polar and wind lookups,
+    pruning, file loading, ...) plus a record per isochrone or layer.
+    '''
+
+    enabled = True
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.calls = defaultdict(int)
+        self.points = defaultdict(int)
+        self.timers = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.layers = []
+        self._last_layer = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name, points=0):
+        '''Time a stage and count its calls and the number of points it processed'''
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timers[name] += time.perf_counter() - t
+            self.calls[name] += 1
+            self.points[name] += points
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def layer(self, **info):
+        '''Record information about an isochrone or layer, including the time since the previous one'''
+        now = time.perf_counter()
+        self.layers.append(dict(info, time=now - self._last_layer))
+        self._last_layer = now
+
+    def report(self):
+        return {
+            'stages': {name: {'calls': self.calls[name], 'points': self.points[name], 'time': self.timers[name]}
+                       for name in self.timers},
+            'counters': dict(self.counters),
+            'layers': self.layers,
+        }
+
+
+class NullInstrumentation:
+    '''Instrumentation that does nothing, so it can stay in the hot path at (almost) no cost'''
+
+    enabled = False
+    _context = nullcontext()
+
+    def reset(self):
+        pass
+
+    def stage(self, name, points=0):
+        return self._context
+
+    def count(self, name, n=1):
+        pass
+
+    def layer(self, **info):
+        pass
+
+    def report(self):
+        return {}
+
+
+NULL_INSTRUMENTATION = NullInstrumentation()
+
+
+class InstrumentedProxy:
+    '''Wraps an object (e.g. a Geod or Wind) and times the given methods as one stage'''
+
+    def __init__(self, wrapped, instrumentation, name, methods):
+        self._wrapped = wrapped
+        self._instrumentation = instrumentation
+        self._name = name
+        self._methods = methods
+
+    def __getattr__(self, name):
+        attribute = getattr(self._wrapped, name)
+        if name not in self._methods:
+            return attribute
+
+        @functools.wraps(attribute)
+        def timed(*args, **kwargs):
+            with self._instrumentation.stage(self._name, max((np.size(a) for a in args), default=1)):
+                return attribute(*args, **kwargs)
+        return timed
+
+
+def instrumented(calculate_routing):
+    '''
+    Decorator for Router.calculate_routing that times the whole routing and, if the router has a profile path,
+    dumps a cProfile of it to that file. The wind source records its statistics in the router's instrumentation only
+    during the routing, as the wind may be shared with other routers.
+    '''
+    @functools.wraps(calculate_routing)
+    def wrapper(self, *args, **kwargs):
+        self.instrumentation.reset()
+        if not self.instrumentation.enabled:
+            return _profiled(calculate_routing, self, *args, **kwargs)
+        previous = self.wind.instrument(self.instrumentation)
+        try:
+            return _profiled(calculate_routing, self, *args, **kwargs)
+        finally:
+            self.wind.instrument(previous)
+    return wrapper
+
+
+def _profiled(calculate_routing, router, *args, **kwargs):
+    '''Time calculate_routing and profile it if the router has a profile path'''
+    if router.profile is None:
+        with router.instrumentation.stage('calculate_routing'):
+            return calculate_routing(router, *args, **kwargs)
+    profile = cProfile.Profile()
+    with router.instrumentation.stage('calculate_routing'):
+        result = profile.runcall(calculate_routing, router, *args, **kwargs)
+    profile.dump_stats(router.profile)
+    return result
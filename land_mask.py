@@ -0,0 +1,145 @@
+import os
+
+import numpy as np
+
+
+class LandMask:
+    '''
+    Rasterized land/sea mask on a regular global lat/lon grid with the given resolution in degrees. The mask is kept as
+    a packed bit array (one bit per cell, row-major from -90/-180), so a lookup is a few array operations, and it is
+    cached on disk so the coastline only has to be rasterized once. A coarse mask of blocks of coarse_factor cells is
+    derived from it, so legs far from land are cleared with a few lookups.
+    '''
+
+    def __init__(self, bits, resolution, coarse_factor=16):
+        self.bits = bits
+        self.resolution = resolution
+        self.nlat = int(round(180 / resolution))
+        self.nlon = int(round(360 / resolution))
+        self.coarse_factor = coarse_factor
+        self._coarse = None
+
+    @classmethod
+    def from_shapefile(cls, shapefile, resolution=0.05, cache_dir=None):
+        '''Create a mask from a shapefile with land polygons, reusing the cached mask if there is one'''
+        cache_dir = cache_dir if cache_dir else os.path.dirname(shapefile)
+        name = os.path.splitext(os.path.basename(shapefile))[0]
+        cache_file = os.path.join(cache_dir, f'{name}_{resolution}.npz')
+        if os.path.isfile(cache_file):
+            return cls.load(cache_file)
+        # cartopy is only needed to rasterize a new mask
+        from cartopy.io.shapereader import Reader
+        mask = cls.rasterize(Reader(shapefile).geometries(), resolution)
+        mask.save(cache_file)
+        return mask
+
+    @classmethod
+    def from_natural_earth(cls, scale='50m', resolution=0.05, cache_dir=None):
+        '''Create a mask from the Natural Earth land polygons, which cartopy downloads if necessary'''
+        from cartopy.io.shapereader import natural_earth
+        return cls.from_shapefile(natural_earth(resolution=scale, category='physical', name='land'), resolution,
+                                  cache_dir)
+
+    @classmethod
+    def rasterize(cls, geometries, resolution=0.05):
+        '''Rasterize shapely geometries. A cell is land if its center lies inside a geometry.'''
+        import shapely
+        nlat, nlon = int(round(180 / resolution)), int(round(360 / resolution))
+        mask = np.zeros((nlat, nlon), dtype=bool)
+        for geometry in geometries:
+            shapely.prepare(geometry)
+            lon_min, lat_min, lon_max, lat_max = geometry.bounds
+            # Only test the cells within the bounds of the geometry
+            i0, i1 = (int(np.clip(np.floor((v + 90) / resolution), 0, nlat)) for v in (lat_min, lat_max))
+            j0, j1 = (int(np.clip(np.floor((v + 180) / resolution), 0, nlon)) for v in (lon_min, lon_max))
+            i1, j1 = min(i1 + 1, nlat), min(j1 + 1, nlon)
+            lats = -90 + (np.arange(i0, i1) + 0.5) * resolution
+            lons = -180 + (np.arange(j0, j1) + 0.5) * resolution
+            lons, lats = np.meshgrid(lons, lats)
+            mask[i0:i1, j0:j1] |= shapely.contains_xy(geometry, lons, lats)
+        return cls(np.packbits(mask.ravel()), resolution)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as f:
+            return cls(f['bits'], float(f['resolution']))
+
+    def save(self, filename):
+        np.savez_compressed(filename, bits=self.bits, resolution=self.resolution)
+
+    def is_land(self, lons, lats):
+        '''Returns a boolean array that is True where the given points are on land'''
+        i = np.clip(np.floor((np.asarray(lats) + 90) / self.resolution).astype(int), 0, self.nlat - 1)
+        j = np.floor(np.mod(np.asarray(lons) + 180, 360) / self.resolution).astype(int) % self.nlon
+        index = i * self.nlon + j
+        return ((self.bits[index >> 3] >> (7 - (index & 7))) & 1).astype(bool)
+
+    def coarse_mask(self):
+        '''
+        Returns a boolean array of blocks of coarse_factor x coarse_factor cells that is True where a block or one of
+        its neighbours contains land
+        '''
+        if self._coarse is None:
+            f = self.coarse_factor
+            nlat, nlon = -(-self.nlat // f), -(-self.nlon // f)
+            mask = np.zeros((nlat * f, nlon * f), dtype=bool)
+            mask[:self.nlat, :self.nlon] = np.unpackbits(self.bits, count=self.nlat * self.nlon).reshape(
+                self.nlat, self.nlon)
+            coarse = mask.reshape(nlat, f, nlon, f).any(axis=(1, 3))
+            # Dilate by one block, longitudes wrap around
+            rows = coarse.copy()
+            rows[1:] |= coarse[:-1]
+            rows[:-1] |= coarse[1:]
+            self._coarse = rows | np.roll(rows, 1, axis=1) | np.roll(rows, -1, axis=1)
+        return self._coarse
+
+    def _is_land_coarse(self, lons, lats):
+        coarse = self.coarse_mask()
+        resolution = self.resolution * self.coarse_factor
+        i = np.clip(np.floor((lats + 90) / resolution).astype(int), 0, coarse.shape[0] - 1)
+        j = np.floor(np.mod(lons + 180, 360) / resolution).astype(int) % coarse.shape[1]
+        return coarse[i, j]
+
+    def crosses_land(self, lons0, lats0, lons1, lats1, max_samples=1000, chunk_size=1 << 20):
+        '''
+        Returns a boolean array that is True for every leg from (lons0, lats0) to (lons1, lats1) that touches land.
+        Each leg is sampled along a straight line in lon/lat at (about) the resolution of the mask, which is accurate
+        enough for legs that are short compared to the curvature of the great circle. The legs are first sampled at the
+        resolution of the coarse mask: as its blocks are dilated, legs that miss it can't touch a land cell either,
+        and only the others are sampled at the full resolution.
+        '''
+        lons0, lats0, lons1, lats1 = np.broadcast_arrays(*(np.asarray(a, dtype=float)
+                                                           for a in (lons0, lats0, lons1, lats1)))
+        shape = lons0.shape
+        lons0, lats0 = lons0.ravel(), lats0.ravel()
+        dlon = (np.mod(lons1 - lons0.reshape(shape) + 180, 360) - 180).ravel()
+        dlat = lats1.ravel() - lats0
+        extent = np.maximum(np.abs(dlon), np.abs(dlat))
+        land = self._sample_legs(self._is_land_coarse, self.resolution * self.coarse_factor, lons0, lats0, dlon,
+                                 dlat, extent, max_samples, chunk_size)
+        near = np.flatnonzero(land)
+        land[near] = self._sample_legs(self.is_land, self.resolution, lons0[near], lats0[near], dlon[near],
+                                       dlat[near], extent[near], max_samples, chunk_size)
+        return land.reshape(shape)
+
+    @staticmethod
+    def _sample_legs(is_land, resolution, lons0, lats0, dlon, dlat, extent, max_samples, chunk_size):
+        '''
+        Samples each leg at the given resolution, depending on its own length, and returns whether any sample is on
+        land. The samples of all legs are looked up at once, in chunks of about chunk_size samples.
+        '''
+        n = np.clip(np.ceil(extent / resolution) + 1, 2, max_samples).astype(int)
+        end = np.cumsum(n)
+        land = np.zeros(len(n), dtype=bool)
+        start = 0
+        while start < len(n):
+            stop = max(int(np.searchsorted(end, end[start] - n[start] + chunk_size, side='right')), start + 1)
+            # Ragged samples of the legs of the chunk: leg index and fraction along the leg
+            k = n[start:stop]
+            first = np.cumsum(k) - k
+            leg = np.repeat(np.arange(start, stop), k)
+            f = (np.arange(len(leg)) - np.repeat(first, k)) / np.repeat(k - 1, k)
+            samples = is_land(lons0[leg] + dlon[leg] * f, lats0[leg] + dlat[leg] * f)
+            land[start:stop] = np.logical_or.reduceat(samples, first)
+            start = stop
+        return land
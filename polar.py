@@ -1,3 +1,5 @@
+import re
+
 from shapely.geometry import Point
 
 from util import angle360
@@ -5,42 +7,134 @@ from wind.wind import Wind
 import numpy as np
 
 
+# m/s per knot
+KNOTS = 1852 / 3600
+
+
 class Polar:
-    '''Polar diagram of a boat'''
-    
-    def __init__(self, polar):
-        self.polar = polar
+    '''
+    Polar diagram of a boat: the boat speed in m/s by true wind angle (0-180 degrees) and true wind speed in m/s.
+    polar is an array of the angles followed by one row of speeds per wind speed in tws, so a 2xN array of angles and
+    speeds (without tws) is a polar that doesn't depend on the wind speed. The table is resampled to a dense regular
+    grid, in which speeds are looked up by bilinear interpolation without searching. The optimal upwind and downwind
+    VMG angles are precomputed for each wind speed of the grid.
+    '''
+    TWA_STEP = 0.5  # degrees
+    TWS_STEP = 0.25  # m/s
+
+    def __init__(self, polar, tws=None):
+        self.polar = np.asarray(polar, dtype=float)
+        self.tws = np.zeros(1) if tws is None else np.asarray(tws, dtype=float)
+        twa, speeds = self.polar[0], self.polar[1:]
+        self.twa_grid = np.arange(0, 180 + self.TWA_STEP / 2, self.TWA_STEP)
+        # A polar without wind speeds gets two equal columns, so lookups don't need a special case
+        self.tws_grid = np.arange(0, self.tws[-1] + self.TWS_STEP, self.TWS_STEP) if len(self.tws) > 1 else \
+            np.array([0., self.TWS_STEP])
+        by_angle = np.array([np.interp(self.twa_grid, twa, row) for row in speeds])
+        self.grid = np.array([np.interp(self.tws_grid, self.tws, column) for column in by_angle.T]) if len(speeds) > 1 \
+            else np.repeat(by_angle.T, 2, axis=1)
+
+        # Optimal VMG angles: the largest speed towards (upwind) and away from (downwind) the wind
+        vmg = self.grid * np.cos(np.deg2rad(self.twa_grid))[:, None]
+        upwind = np.argmax(np.where(self.twa_grid[:, None] <= 90, vmg, -np.inf), axis=0)
+        downwind = np.argmin(np.where(self.twa_grid[:, None] >= 90, vmg, np.inf), axis=0)
+        self.upwind_angle = self.twa_grid[upwind]
+        self.downwind_angle = self.twa_grid[downwind]
+
+    @classmethod
+    def load(cls, filename):
+        '''
+        Load a polar table in the common .pol format: a header row with a label (e.g. TWA\\TWS) and the true wind
+        speeds in knots, then one row per true wind angle with the boat speeds in knots, separated by tabs,
+        semicolons or spaces
+        '''
+        with open(filename) as f:
+            rows = [re.split(r'[\t; ]+', line.strip()) for line in f if line.strip()]
+        tws = np.array(rows[0][1:], dtype=float) * KNOTS
+        table = np.array([[float(x) if x else 0. for x in row] for row in rows[1:]])
+        twa, speeds = table[:, 0], table[:, 1:] * KNOTS
+        # Unless given, the boat doesn't move without wind or straight into the wind
+        if tws[0] > 0:
+            tws = np.concatenate([[0.], tws])
+            speeds = np.concatenate([np.zeros((len(twa), 1)), speeds], axis=1)
+        if twa[0] > 0:
+            twa = np.concatenate([[0.], twa])
+            speeds = np.concatenate([np.zeros((1, len(tws))), speeds])
+        return cls(np.vstack([twa, speeds.T]), tws)
 
-    def get_speed(self, loc: Point, heading: float, velocity_boat: float, t: int, wind: Wind):
+    def get_speed(self, loc: Point, heading: float, velocity_boat: float, t: int, wind: Wind, envelope=False):
         # TODO: Currently true wind speed; add currents and apparent wind (taking into account speed?)
         # TODO: should polar map from true wind speed to velocity or from apparent wind speed?
         direction_true_wind, velocity_true_wind = wind.get_wind(loc, heading, t)
+        return self._speed(direction_true_wind, velocity_true_wind, velocity_boat, envelope)
+
+    def get_speed_batch(self, lons, lats, headings, velocity_boat, t, wind: Wind, envelope=False):
+        '''
+        Vectorized version of get_speed. All arguments are broadcast against each other and an array of speeds with
+        the broadcast shape is returned. With envelope=True, the speed made good by tacking or gybing at the optimal
+        VMG angles is returned for headings closer to the wind or further downwind than these angles.
+        '''
+        lons, lats, headings, velocity_boat, t = np.broadcast_arrays(lons, lats, headings, velocity_boat, t)
+        direction_true_wind, velocity_true_wind = wind.get_wind_batch(lons, lats, headings, t)
+        return self._speed(direction_true_wind, velocity_true_wind, velocity_boat, envelope)
+
+    def max_speed(self):
+        '''Upper bound of the boat speed, e.g. for lower bounds of the time to go'''
+        return float(np.max(self.grid))
+
+    def lookup(self, twa, tws):
+        '''Boat speed at true wind angles (0-180 degrees) and speeds (m/s) by bilinear interpolation in the grid'''
+        twa, tws = np.broadcast_arrays(np.asarray(twa, dtype=float), np.asarray(tws, dtype=float))
+        a = np.clip(np.nan_to_num(twa), 0, 180) / self.TWA_STEP
+        i = np.minimum(a.astype(int), len(self.twa_grid) - 2)
+        wa = a - i
+        b = np.clip(np.nan_to_num(tws) / self.TWS_STEP, 0, len(self.tws_grid) - 1)
+        j = np.minimum(b.astype(int), len(self.tws_grid) - 2)
+        wb = b - j
+        speed = ((1 - wa) * ((1 - wb) * self.grid[i, j] + wb * self.grid[i, j + 1]) +
+                 wa * ((1 - wb) * self.grid[i + 1, j] + wb * self.grid[i + 1, j + 1]))
+        return np.where(np.isnan(twa) | np.isnan(tws), np.nan, speed)
+
+    def optimal_angles(self, tws):
+        '''Optimal upwind and downwind VMG angles (degrees) at true wind speeds (m/s)'''
+        j = np.clip(np.rint(np.nan_to_num(tws) / self.TWS_STEP).astype(int), 0, len(self.tws_grid) - 1)
+        return self.upwind_angle[j], self.downwind_angle[j]
+
+    def envelope_speed(self, twa, tws):
+        '''
+        Speed made good at true wind angles (0-180 degrees) and speeds (m/s) when tacking or gybing between the
+        optimal VMG angles on both sides of the wind instead of sailing too close to the wind or too deep downwind
+        '''
+        upwind, downwind = self.optimal_angles(tws)
+        optimal = np.clip(twa, upwind, downwind)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            made_good = np.cos(np.deg2rad(optimal)) / np.cos(np.deg2rad(twa))
+        return self.lookup(optimal, tws) * np.where(optimal == twa, 1., made_good)
+
+    def _speed(self, direction_true_wind, velocity_true_wind, velocity_boat, envelope=False):
         # law of cosines
         velocity_apparent_wind = np.sqrt(velocity_boat ** 2 + velocity_true_wind ** 2 +
                                          2 * velocity_boat * velocity_true_wind *
                                          np.cos(np.deg2rad(direction_true_wind)))
-        if velocity_apparent_wind == 0:
-            direction_apparent_wind = 0.
-        elif velocity_boat == 0:
-            direction_apparent_wind = direction_true_wind
-        else:
-            direction_apparent_wind = angle360(np.rad2deg(np.arccos(
-                (velocity_apparent_wind ** 2 + velocity_boat ** 2 - velocity_true_wind ** 2) /
-                (2 * velocity_apparent_wind * velocity_boat))))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cos_apparent_wind = ((velocity_apparent_wind ** 2 + velocity_boat ** 2 - velocity_true_wind ** 2) /
+                                 (2 * velocity_apparent_wind * velocity_boat))
+        # Clip to [-1, 1] as rounding errors would otherwise lead to NaNs
+        direction_apparent_wind = np.rad2deg(np.arccos(np.clip(cos_apparent_wind, -1, 1)))
+        direction_apparent_wind = np.where(velocity_apparent_wind == 0, 0.,
+                                           np.where(velocity_boat == 0, direction_true_wind, direction_apparent_wind))
         direction_apparent_wind = angle360(direction_apparent_wind)
-        if direction_apparent_wind > 180:
-            x = 360 - direction_apparent_wind
-        else:
-            x = direction_apparent_wind
-        speed = np.interp(x, self.polar[0], self.polar[1])
+        x = np.where(direction_apparent_wind > 180, 360 - direction_apparent_wind, direction_apparent_wind)
+        speed = self.envelope_speed(x, velocity_true_wind) if envelope else self.lookup(x, velocity_true_wind)
         speed = np.where(speed < 1e-5, 1e-5, speed)
         return speed
 
 
 if __name__ == '__main__':
     from wind.constant_wind import ConstantWind
-    # angle in degrees -> speed in m/s TODO: make dependent on wind speed
+    # angle in degrees -> speed in m/s
     p = np.array([[0., 45., 90., 135., 180.], [0., 0., 2.8, 4.2, 2.8]])
     p = Polar(p)
     w = ConstantWind(150., 20.)
-    print(p.get_speed(0., 0., 270., 0., 0, w))
+    print(p.get_speed(Point(0., 0.), 270., 0., 0, w))
+    print(p.get_speed_batch(np.zeros(8), np.zeros(8), np.arange(0., 360., 45.), 0., 0, w))
@@ -0,0 +1,50 @@
+import numpy as np
+import scipy.io as sio
+from scipy.sparse import csr_matrix
+
+
+def read_variables(filename, keys):
+    '''Read variables and attributes from a NetCDF file. NetCDF4 files need the optional netCDF4 package.'''
+    try:
+        with sio.netcdf_file(filename, mmap=False) as f:
+            return {k: (np.array(f.variables[k][:]), f.variables[k]._attributes) for k in keys}
+    except TypeError:
+        # scipy can only read classic NetCDF files
+        import netCDF4
+        with netCDF4.Dataset(filename) as f:
+            return {k: (np.array(f.variables[k][:]), f.variables[k].__dict__) for k in keys}
+
+
+class Remapper:
+    '''
+    Remaps fields with a SCRIP weight file (as written by CDO) to a regular lat/lon grid. The weights are loaded once
+    into a sparse matrix, so remapping is a single sparse matrix multiplication that can process many fields at once.
+    '''
+
+    def __init__(self, weight_file):
+        v = read_variables(weight_file, ['src_address', 'dst_address', 'remap_matrix', 'dst_grid_dims',
+                                         'dst_grid_center_lat', 'dst_grid_center_lon', 'src_grid_imask'])
+        src = v['src_address'][0].astype(np.int64) - 1  # Fortran indices
+        dst = v['dst_address'][0].astype(np.int64) - 1
+        weights = v['remap_matrix'][0].reshape(len(src), -1)[:, 0].astype(np.float64)
+        nlon, nlat = v['dst_grid_dims'][0]
+        self.shape = (int(nlat), int(nlon))
+        n_src = len(v['src_grid_imask'][0])
+        self.matrix = csr_matrix((weights, (dst, src)), shape=(self.shape[0] * self.shape[1], n_src))
+
+        lats, lat_attributes = v['dst_grid_center_lat']
+        lons, lon_attributes = v['dst_grid_center_lon']
+        if lat_attributes.get('units', b'') in ('radians', b'radians'):
+            lats, lons = np.rad2deg(lats), np.rad2deg(lons)
+        self.lats = lats.reshape(self.shape)[:, 0]
+        self.lons = lons.reshape(self.shape)[0, :]
+
+    def remap(self, fields):
+        '''
+        Remap one field of shape (source points,) or several fields of shape (fields, source points). Returns arrays of
+        shape (lat, lon) or (fields, lat, lon).
+        '''
+        fields = np.asarray(fields)
+        if fields.ndim == 1:
+            return (self.matrix @ fields).reshape(self.shape)
+        return (self.matrix @ fields.T).T.reshape((len(fields),) + self.shape)
@@ -0,0 +1,157 @@
+'''
+Evaluation of many fixed tracks at once, e.g. GPX imports, route variants or the routes of the routers under a newer
+forecast run. Long legs are split into segments of at most max_segment meters, so the wind along them is taken into
+account. All tracks are advanced together, one segment per step: the geodesy of all segments is computed at once and
+each step is one batched polar and wind lookup for all tracks.
+'''
+import xml.etree.ElementTree as ElementTree
+
+import numpy as np
+
+from geodesy import get_geod
+from util import angle360
+
+
+def read_gpx(filename):
+    '''Returns the tracks (track segments) and routes of a GPX file as (n, 2) arrays of lon, lat'''
+    tracks = []
+    for element in ElementTree.parse(filename).iter():
+        tag = element.tag.rsplit('}', 1)[-1]
+        if tag in ('trkseg', 'rte'):
+            points = [(float(p.get('lon')), float(p.get('lat'))) for p in element
+                      if p.tag.rsplit('}', 1)[-1] in ('trkpt', 'rtept')]
+            tracks.append(np.array(points).reshape(-1, 2))
+    return tracks
+
+
+class RouteEvaluator:
+    '''
+    Sails fixed tracks with a polar through a wind field. Each segment is sailed at the speed for its initial course
+    at its start point and time, as the legs of the routers are, so a route of a router evaluated without splitting
+    (max_segment=None) gets the router's passage time. Segments crossing land (if a land mask is given) or sailed at
+    zero speed can't be sailed: the times from there on are NaN.
+    '''
+
+    def __init__(self, polar, wind, max_segment=25e3, crs='WGS84', geodesy='ellipsoid', envelope=False,
+                 land_mask=None):
+        self.polar = polar
+        self.wind = wind
+        self.max_segment = max_segment
+        self.g = get_geod(geodesy, crs)
+        self.envelope = envelope
+        self.land_mask = land_mask
+
+    @staticmethod
+    def _coordinates(track):
+        '''(n, 2) array of lon, lat of a track given as an array (e.g. route_summary's route) or a RouteLayer'''
+        if hasattr(track, 'lon'):
+            return np.stack([track.lon, track.lat], axis=1)
+        return np.asarray(track, dtype=float)[:, :2]
+
+    def evaluate(self, tracks, start_time):
+        '''
+        Evaluate tracks (see _coordinates) departing at start_time (s since epoch, one for all or one per track).
+        Returns the arrival times (eta), passage times and distances of the tracks and the distance, duration, mean
+        speed, initial course and arrival time of every leg as (tracks, legs) arrays, padded with NaN.
+        '''
+        tracks = [self._coordinates(track) for track in tracks]
+        n = len(tracks)
+        start_time = np.broadcast_to(np.asarray(start_time, dtype=float), n).copy()
+        legs = np.array([max(len(track) - 1, 0) for track in tracks], dtype=int)
+        # Legs of all tracks, one after another
+        lon0, lat0 = (np.concatenate([track[:-1, i] for track in tracks] + [np.empty(0)]) for i in (0, 1))
+        lon1, lat1 = (np.concatenate([track[1:, i] for track in tracks] + [np.empty(0)]) for i in (0, 1))
+        leg_track = np.repeat(np.arange(n), legs)
+        az, _, dist = self.g.inv(lon0, lat0, lon1, lat1)
+        blocked = np.zeros(len(dist), dtype=bool)
+        if self.land_mask is not None:
+            blocked = self.land_mask.crosses_land(lon0, lat0, lon1, lat1)
+
+        # Split the legs into segments of equal length along the geodesic
+        k = np.ones(len(dist), dtype=int) if self.max_segment is None else \
+            np.maximum(np.ceil(dist / self.max_segment), 1).astype(int)
+        segment_leg = np.repeat(np.arange(len(dist)), k)
+        segment_index = np.arange(len(segment_leg)) - np.repeat(np.cumsum(k) - k, k)
+        length = (dist / k)[segment_leg]
+        x, y, back_az = self.g.fwd(lon0[segment_leg], lat0[segment_leg], az[segment_leg], segment_index * length)
+        course = np.where(segment_index == 0, az[segment_leg], angle360(back_az + 180))
+
+        # (tracks, steps) matrix of the segment sailed by each track in each step, -1 once a track has arrived
+        segment_track = leg_track[segment_leg]
+        segments = np.bincount(segment_track, minlength=n)
+        steps = np.full((n, segments.max(initial=0)), -1)
+        steps[segment_track, np.arange(len(segment_leg)) - np.repeat(np.cumsum(segments) - segments, segments)] = \
+            np.arange(len(segment_leg))
+        t = start_time.copy()
+        segment_end = np.empty(len(segment_leg))
+        for step in steps.T:
+            active = step >= 0
+            i = step[active]
+            v = self.polar.get_speed_batch(x[i], y[i], course[i], 0, t[active], self.wind, self.envelope)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                dt = np.where(length[i] > 0, length[i] / v, 0.)
+            dt = np.where(blocked[segment_leg[i]] | (v <= 0), np.inf, dt)
+            t[active] += dt
+            segment_end[i] = t[active]
+
+        # Legs end with their last segment
+        leg_eta = np.where(np.isfinite(segment_end), segment_end, np.nan)[np.cumsum(k) - 1]
+        leg_start = np.concatenate([[np.nan], leg_eta[:-1]])
+        first = np.cumsum(legs) - legs
+        leg_start[first[legs > 0]] = start_time[legs > 0]
+
+        def by_track(values):
+            matrix = np.full((n, legs.max(initial=0)), np.nan)
+            matrix[leg_track, np.arange(len(dist)) - first[leg_track]] = values
+            return matrix
+
+        eta = np.where(np.isfinite(t), t, np.nan)
+        duration = leg_eta - leg_start
+        with np.errstate(divide='ignore', invalid='ignore'):
+            speed = dist / duration
+        return {
+            'start_time': start_time,
+            'eta': eta,  # s since epoch, NaN if the track can't be sailed
+            'passage_time': eta - start_time,  # s
+            'distance': np.bincount(leg_track, weights=dist, minlength=n),  # m
+            'leg_distance': by_track(dist),  # m
+            'leg_duration': by_track(duration),  # s
+            'leg_speed': by_track(speed),  # m/s, mean speed over ground
+            'leg_course': by_track(az),  # degrees, initial course
+            'leg_eta': by_track(leg_eta),  # s since epoch at the end of the leg
+        }
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+    from shapely.geometry import Point
+    from benchmarks.polars import get_polar
+    from benchmarks.synthetic_wind import CubeWind
+    from routers.dp_router import DPRouter
+
+    parser = argparse.ArgumentParser(description='Evaluate variants of a DP route on a synthetic wind field')
+    parser.add_argument('--tracks', type=int, default=500)
+    args = parser.parse_args()
+
+    t0 = 1700000000.
+    wind = CubeWind(t0, hours=24 * 30)
+    polar = get_polar('racer')
+    r = DPRouter(20, 20, Point(-4.91519, 48.26118), Point(-74.71870, 38.86484), polar, wind, t0,
+                 t0 + 60 * 60 * 24 * 30)
+    route = r.calculate_routing().route()
+    # Without splitting the legs, the route gets the router's passage time
+    result = RouteEvaluator(polar, wind, max_segment=None).evaluate([route], t0)
+    print(f"DP {(route.time[-1] - t0) / 3600:.2f}h, evaluated {result['passage_time'][0] / 3600:.2f}h")
+    assert np.isclose(result['passage_time'][0], route.time[-1] - t0)
+
+    # Variants of the route with the waypoints moved randomly by up to 1 degree
+    rng = np.random.default_rng(0)
+    track = np.stack([route.lon, route.lat], axis=1)
+    tracks = [track + np.pad(rng.uniform(-1, 1, (len(track) - 2, 2)), ((1, 1), (0, 0))) for _ in range(args.tracks)]
+    t = time.perf_counter()
+    result = RouteEvaluator(polar, wind).evaluate(tracks, t0)
+    elapsed = time.perf_counter() - t
+    best = np.nanargmin(result['passage_time'])
+    print(f"{args.tracks} tracks with {result['leg_distance'].shape[1]} legs evaluated in {elapsed:.2f}s, best "
+          f"{result['passage_time'][best] / 3600:.2f}h")
@@ -0,0 +1,147 @@
+import numpy as np
+from shapely.geometry import Point
+
+
+class RouteLayer:
+    '''
+    One isochrone or mesh layer. All attributes of the nodes are stored in contiguous arrays, the parent is the index
+    of the previous node in the previous layer (-1 if there is none).
+    '''
+
+    FIELDS = ('lon', 'lat', 'course', 'speed', 'time', 'distance', 'bearing')
+
+    def __init__(self, lon, lat, course=None, speed=None, time=None, distance=None, bearing=None, parent=None):
+        self.lon = np.asarray(lon, dtype=float)
+        n = len(self.lon)
+        self.lat = np.asarray(lat, dtype=float)
+        self.course = self._array(course, n)  # degrees
+        self.speed = self._array(speed, n)  # m/s
+        self.time = self._array(time, n)  # s since epoch UTC
+        self.distance = self._array(distance, n)  # m
+        self.bearing = self._array(bearing, n)  # degrees
+        self.parent = np.full(n, -1, dtype=np.int32) if parent is None else np.asarray(parent, dtype=np.int32)
+        # Set when the layer is added to a RouteGraph
+        self.graph = None
+        self.index = None
+
+    @staticmethod
+    def _array(values, n):
+        if values is None:
+            return np.full(n, np.nan)
+        return np.array(np.broadcast_to(np.asarray(values, dtype=float), (n,)))
+
+    def __len__(self):
+        return len(self.lon)
+
+    def __getitem__(self, i):
+        return RoutingPointView(self, int(i))
+
+    def __iter__(self):
+        return (RoutingPointView(self, i) for i in range(len(self)))
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, f).nbytes for f in self.FIELDS) + self.parent.nbytes
+
+
+class RouteGraph:
+    '''Route graph of a router made of RouteLayers, where every node points to its parent in the previous layer'''
+
+    def __init__(self, layers=None):
+        self.layers = []
+        for layer in layers or []:
+            self.append(layer)
+
+    def append(self, layer):
+        layer.graph = self
+        layer.index = len(self.layers)
+        self.layers.append(layer)
+        return layer
+
+    def __len__(self):
+        return len(self.layers)
+
+    def __getitem__(self, i):
+        return self.layers[i]
+
+    def __iter__(self):
+        return iter(self.layers)
+
+    @property
+    def nbytes(self):
+        return sum(layer.nbytes for layer in self.layers)
+
+    def route_indices(self, layer, index):
+        '''Returns the layers and node indices of the route to a node by walking the parent indices'''
+        layers, indices = [], []
+        while index >= 0:
+            layers.append(layer)
+            indices.append(index)
+            index = self.layers[layer].parent[index]
+            layer -= 1
+        layers.reverse()
+        indices.reverse()
+        return layers, indices
+
+    def route(self, layer, index):
+        '''
+        Reconstruct the route to a node by walking the parent indices. Returns a RouteLayer with the nodes of the
+        route from the start to the given node, whose parents are consecutive.
+        '''
+        layers, indices = self.route_indices(layer, index)
+        route = RouteLayer(*([np.array([getattr(self.layers[l], f)[i] for l, i in zip(layers, indices)])
+                              for f in RouteLayer.FIELDS]), parent=np.arange(len(indices)) - 1)
+        return route
+
+
+class RoutingPointView:
+    '''A node of a RouteLayer with the attributes of a point of a route (position, course, speed, time, ...)'''
+
+    __slots__ = ('layer', 'i')
+
+    def __init__(self, layer, i):
+        self.layer = layer
+        self.i = i
+
+    @property
+    def x(self):
+        return self.layer.lon[self.i]
+
+    @property
+    def y(self):
+        return self.layer.lat[self.i]
+
+    @property
+    def point(self):
+        return Point(self.x, self.y)
+
+    @property
+    def course(self):
+        return self.layer.course[self.i]
+
+    @property
+    def speed(self):
+        return self.layer.speed[self.i]
+
+    @property
+    def time(self):
+        return self.layer.time[self.i]
+
+    @property
+    def distance_to_start(self):
+        return self.layer.distance[self.i]
+
+    @property
+    def bearing(self):
+        return self.layer.bearing[self.i]
+
+    @property
+    def previous_point(self):
+        parent = self.layer.parent[self.i]
+        if parent < 0:
+            return None
+        return RoutingPointView(self.layer.graph.layers[self.layer.index - 1], int(parent))
+
+    def route(self):
+        '''Returns the route from the start to this point as a RouteLayer'''
+        return self.layer.graph.route(self.layer.index, self.i)
@@ -0,0 +1,72 @@
+import heapq
+
+import numpy as np
+
+from instrumentation import instrumented
+from routers.dp_router import DPRouter
+
+
+class AStarRouter(DPRouter):
+    '''
+    A* Router on the mesh of the DPRouter. Nodes are expanded in the order of their arrival time plus a lower bound of
+    the time to go (the great circle distance to the end point at the maximum speed of the polar). The bound never
+    overestimates and satisfies the triangle inequality, so the result is the same as the DPRouter's while usually
+    only a fraction of the nodes is expanded. The number of expanded nodes is available as expanded.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.expanded = 0
+
+    @instrumented
+    def calculate_routing(self):
+        # Start from a fresh graph, the node times and parents of a previous search would close the nodes early
+        self._build_graph()
+        h = self._time_to_go()
+        closed = [np.zeros(len(layer), dtype=bool) for layer in self.graph]
+        end = len(self.graph) - 1
+        self.expanded = 0
+        # Heap of (lower bound of the arrival time at the end point, layer, node)
+        heap = [(self.start_time + h[0][0], 0, 0)]
+        while heap:
+            _, i, j = heapq.heappop(heap)
+            # A node may be pushed several times before it is expanded, only the first (fastest) entry is used
+            if closed[i][j]:
+                continue
+            closed[i][j] = True
+            if i == end:
+                break
+            if self.graph[i].time[j] > self.max_time:
+                continue
+            self.expanded += 1
+            # There are no complete layers to report, but the routing can be cancelled
+            if self.expanded % 256 == 0:
+                self._notify(None)
+            layer = self.graph[i + 1]
+            for k in self._expand(self.graph[i], j, layer, np.nonzero(~closed[i + 1])[0]):
+                heapq.heappush(heap, (layer.time[k] + h[i + 1][k], i + 1, k))
+        self.instrumentation.count('expanded', self.expanded)
+        return self.graph[-1][0]
+
+    def _expand(self, sources, j, targets, candidates):
+        '''Relax the edges from node j of sources to the candidate nodes of targets and return the improved nodes'''
+        n = len(candidates)
+        x0, y0, t0 = (np.full(n, a[j]) for a in (sources.lon, sources.lat, sources.time))
+        x1, y1 = targets.lon[candidates], targets.lat[candidates]
+        az, _, dist = self.g.inv(x0, y0, x1, y1)
+        with self.instrumentation.stage('polar', n):
+            v = self.polar.get_speed_batch(x0, y0, az, 0, t0, self.wind, self.envelope)
+        t_end = t0 + dist / v
+        # Edges crossing land can't be sailed
+        if self.land_mask is not None:
+            with self.instrumentation.stage('land', n):
+                t_end = np.where(self.land_mask.crosses_land(x0, y0, x1, y1), np.inf, t_end)
+        t_previous = targets.time[candidates]
+        update = np.isfinite(t_end) & (np.isnan(t_previous) | (t_end < t_previous))
+        k = candidates[update]
+        targets.time[k] = t_end[update]
+        targets.parent[k] = j
+        targets.course[k] = az[update]
+        targets.speed[k] = v[update]
+        targets.distance[k] = sources.distance[j] + dist[update]
+        return k
@@ -1,63 +1,163 @@
+from instrumentation import instrumented
+from route_graph import RouteGraph, RouteLayer
 from routers.gc_router import GCRouter
 from routers.router import Router
-from routing_point import RoutingPoint
 from util import angle360
 
 import numpy as np
 
 
 class DPRouter(Router):
-    '''Dynamic Programming Router'''
+    '''
+    Dynamic Programming Router. After calculate_routing, reroute can be used to re-root the mesh at the current
+    position of the boat (e.g. every few hours or when a new forecast run is available), reusing as much of the
+    previous solve as possible.
+    '''
 
-    def __init__(self, nodes, layers, *args):
-        super().__init__(*args)
-        self._create_mesh(nodes, layers, args=args)
+    def __init__(self, nodes, layers, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_mesh(nodes, layers, args=args, kwargs=kwargs)
 
-    def _create_mesh(self, nodes=40, layers=30, args=None):
+    def _create_mesh(self, nodes=40, layers=30, args=None, kwargs=None):
         '''
         Create a mesh of nodes. Each node has a course, speed and time to reach the end point. The mesh is created
-        by calculating the shortest path from end to start point and adding nodes on each side of the path.
-        '''
-        # Create mesh by calculating great circle route from end to start point
-        self.gc = GCRouter(*args)
-        p = self.gc.calculate_routing(layers, constant_speed=5)
-        dist = p.distance_to_start
-        p = p.previous_point  # skip end point
-        self.mesh = [[RoutingPoint(self.end_point.x, self.end_point.y, None, None, None, None, None, None)]]
-        # Iterate over linked list from end to start
-        while p.previous_point is not None:
-            angle = angle360(p.course + 90)
-            layer = []
-            # Add nodes on each side of the path. The width of the path is proportional to the distance to the end point.
-            for d in np.linspace(-dist / 5, dist / 5, nodes):
-                x, y, az = self.g.fwd(p.x, p.y, angle, d)
-                layer.append(RoutingPoint(x, y, None, None, None, None, None, None))
-            self.mesh.append(layer)
-            p = p.previous_point
-        self.mesh.append([RoutingPoint(self.start_point.x, self.start_point.y, None, None, 0, None, 0, self.start_time)])
-        self.mesh = [x for x in reversed(self.mesh)]
+        by calculating the shortest path from start to end point and adding nodes on each side of the path.
+        '''
+        self._create_centers(layers, args, kwargs)
+        # The width of the path is proportional to the distance to the end point
+        offsets = np.linspace(-self.width, self.width, nodes)
+        self._build_mesh(np.broadcast_to(offsets, (len(self.x0), nodes)))
+
+    def _create_centers(self, layers, args, kwargs):
+        '''
+        Calculate the centers of the mesh layers along the great circle and the angles perpendicular to it, along
+        which the nodes are placed
+        '''
+        # Create mesh by calculating great circle route from start to end point
+        # The great circle is only used to build the mesh, so it is not instrumented
+        kwargs = {k: v for k, v in (kwargs or {}).items() if k not in ('instrument', 'profile', 'progress')}
+        self.gc = GCRouter(*args, **kwargs)
+        end = self.gc.calculate_routing(layers, constant_speed=5)
+        self.width = end.distance_to_start / 5
+        # Skip start and end point
+        gc = self.gc.graph.route(end.layer.index, end.i)
+        self.x0, self.y0, self.angle = gc.lon[1:-1], gc.lat[1:-1], angle360(gc.course[1:-1] + 90)
+        # Distance of the layer centers to the end point, to find the layers behind the boat when re-routing
+        self.center_to_end = end.distance_to_start - gc.distance[1:-1]
 
+    def _build_mesh(self, offsets):
+        '''Build the mesh from the offsets (in meters, one row per layer) of the nodes from the layer centers'''
+        self.offsets = offsets
+        shape = offsets.shape
+        x, y, _ = self.g.fwd(*(np.broadcast_to(a[:, None], shape).ravel() for a in (self.x0, self.y0, self.angle)),
+                             offsets.ravel())
+        self.mesh_x, self.mesh_y = x.reshape(shape), y.reshape(shape)
+        # Edges from each layer of the mesh to the next one (or the end point), see _relax_layer
+        self.edges = [{} for _ in range(len(self.x0))]
+        self.first = 0
+        self._build_graph()
+
+    def _build_graph(self):
+        '''Build the graph from the start point, the mesh layers from first on and the end point'''
+        self.graph = RouteGraph()
+        self.graph.append(RouteLayer([self.start_point.x], [self.start_point.y], None, 0, self.start_time, 0))
+        for i in range(self.first, len(self.x0)):
+            self.graph.append(RouteLayer(self.mesh_x[i], self.mesh_y[i]))
+        self.graph.append(RouteLayer([self.end_point.x], [self.end_point.y]))
+
+    @instrumented
     def calculate_routing(self):
-        # Iterate over all nodes in the mesh and calculate the time to reach the end point
-        for i in range(len(self.mesh) - 1):
-            for start in self.mesh[i]:
-                # Skip nodes that are already over the max time
-                if start.time > self.max_time:
-                    continue
-                # Iterate over all nodes in the next layer
-                for end in self.mesh[i+1]:
-                    # Calculate course and distance from start to end point
-                    az, _, dist = self.g.inv(start.x, start.y, end.x, end.y)
-                    v = self.polar.get_speed(start, az, 0, start.time, self.wind)[0]
-                    t_end = start.time + dist / v
-                    # Update node if time to reach end point is shorter than previous time
-                    if end.time is None or t_end < end.time:
-                        end.time = t_end
-                        end.previous_point = start
-                        end.course = az
-                        end.speed = v
-                        end.distance_to_start = start.distance_to_start + dist
-        return self.mesh[-1][0]
+        # Start from a fresh graph, the node times and parents of a previous solve would only be overwritten by faster
+        # ones (e.g. not after the wind weakened)
+        self._build_graph()
+        return self._solve()
+
+    @instrumented
+    def reroute(self, position, time):
+        '''
+        Re-root the mesh at the current position and time of the boat and calculate the routing again. Layers whose
+        center is not closer to the end point than the boat are dropped. Courses, distances and land crossings of the
+        remaining edges are reused, as are the speeds of nodes whose time and wind (see Wind.revision) didn't change.
+        Call wind.refresh() before to switch to a new forecast run.
+        '''
+        self.start_point, self.start_time = position, time
+        _, _, dist = self.g.inv(position.x, position.y, self.end_point.x, self.end_point.y)
+        self.first = int(np.count_nonzero(self.center_to_end >= dist))
+        self._build_graph()
+        return self._solve()
+
+    def _solve(self):
+        # Iterate over all layers in the mesh and calculate the time to reach the nodes of the next layer. The edges
+        # from the start point change with every re-route, so they are not kept.
+        for i in range(len(self.graph) - 1):
+            self._relax_layer(self.graph[i], self.graph[i+1], self.edges[self.first + i - 1] if i > 0 else None)
+            self._notify(self.graph[i+1])
+        return self.graph[-1][0]
+
+    def _relax_layer(self, sources: RouteLayer, targets: RouteLayer, edges=None):
+        '''
+        Relax all edges between two consecutive layers at once. Courses, distances and speeds are computed as
+        sources x targets matrices and the fastest source for each target is found with a min-reduction. The
+        courses, distances and land crossings of all edges and the speeds of the last relaxation are kept in the
+        dict edges, so they are only computed again if the sources' times or the wind changed.
+        '''
+        edges = {} if edges is None else edges
+        # Skip nodes that were not reached or are already over the max time
+        reachable = np.nonzero(sources.time <= self.max_time)[0]
+        if len(reachable) == 0:
+            self.instrumentation.layer(sources=0, targets=len(targets), edges=0, updated=0)
+            return
+        if 'dist' not in edges:
+            shape = (len(sources), len(targets))
+            x0, y0 = (np.broadcast_to(a[:, None], shape) for a in (sources.lon, sources.lat))
+            x1, y1 = (np.broadcast_to(a[None, :], shape) for a in (targets.lon, targets.lat))
+            # Calculate course and distance from start to end point
+            az, _, dist = self.g.inv(x0.ravel(), y0.ravel(), x1.ravel(), y1.ravel())
+            edges['az'], edges['dist'] = az.reshape(shape), dist.reshape(shape)
+            # Edges crossing land can't be sailed
+            if self.land_mask is not None:
+                with self.instrumentation.stage('land', az.size):
+                    edges['land'] = self.land_mask.crosses_land(x0, y0, x1, y1)
+            edges['time'] = np.full(len(sources), np.nan)
+            edges['speed'] = np.empty(shape)
+        # The speeds only depend on the wind at the source and its time, so only changed rows are computed again
+        if edges.get('revision') != self.wind.revision:
+            edges['time'][:] = np.nan
+            edges['revision'] = self.wind.revision
+        changed = reachable[edges['time'][reachable] != sources.time[reachable]]
+        if len(changed):
+            shape = (len(changed), len(targets))
+            x0, y0, t0 = (np.broadcast_to(a[changed, None], shape) for a in (sources.lon, sources.lat, sources.time))
+            with self.instrumentation.stage('polar', x0.size):
+                edges['speed'][changed] = self.polar.get_speed_batch(x0, y0, edges['az'][changed], 0, t0, self.wind,
+                                                                     self.envelope)
+            edges['time'][changed] = sources.time[changed]
+        az, dist, v = edges['az'][reachable], edges['dist'][reachable], edges['speed'][reachable]
+        t_end = sources.time[reachable, None] + dist / v
+        if self.land_mask is not None:
+            t_end = np.where(edges['land'][reachable], np.inf, t_end)
+        # argmin returns the first minimum, so on ties the first source wins
+        best = np.argmin(t_end, axis=0)
+        columns = np.arange(len(targets))
+        t_best = t_end[best, columns]
+        # Update node if time to reach end point is shorter than previous time
+        update = np.isfinite(t_best) & (np.isnan(targets.time) | (t_best < targets.time))
+        best, columns = best[update], columns[update]
+        targets.time[update] = t_best[update]
+        targets.parent[update] = reachable[best]
+        targets.course[update] = az[best, columns]
+        targets.speed[update] = v[best, columns]
+        targets.distance[update] = sources.distance[reachable[best]] + dist[best, columns]
+        self.instrumentation.layer(sources=len(reachable), targets=len(targets), edges=az.size,
+                                   updated=len(columns))
+
+    def _time_to_go(self):
+        '''Lower bound of the time from each node of the mesh to the end point, one array per layer'''
+        lon = np.concatenate([layer.lon for layer in self.graph])
+        lat = np.concatenate([layer.lat for layer in self.graph])
+        _, _, dist = self.g.inv(lon, lat, np.full(len(lon), self.end_point.x), np.full(len(lat), self.end_point.y))
+        # With a margin of 0.1%, as the spherical geodesy doesn't satisfy the triangle inequality exactly
+        return np.split(0.999 * dist / self.polar.max_speed(), np.cumsum([len(layer) for layer in self.graph])[:-1])
 
     def get_isochrones(self):
-        return self.mesh
+        return self.graph.layers
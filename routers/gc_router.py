@@ -1,33 +1,41 @@
-from shapely.geometry import Point
+import numpy as np
 
+from instrumentation import instrumented
+from route_graph import RouteGraph, RouteLayer
 from routers.router import Router
-from routing_point import RoutingPoint
 from util import angle360
 
 
 class GCRouter(Router):
-    '''Great Circle Router'''
+    '''Great Circle Router: sails the great circle directly, also with envelope=True'''
 
-    def __init__(self, *args):
-        super().__init__(*args)
-        self.route_points = None
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.graph = None
 
+    @instrumented
     def calculate_routing(self, n=20, constant_speed=None):
         az, _, dist = self.g.inv(self.start_point.x, self.start_point.y, self.end_point.x, self.end_point.y)
-        d = 0
-        route_points = [RoutingPoint(self.start_point.x, self.start_point.y, az, None, d, None, 0, self.start_time)]
-        for _ in range(n):
-            d += dist / n
-            x, y, az = self.g.fwd(route_points[-1].x, route_points[-1].y, az, dist / n)
-            loc = Point(x, y)
-            az = angle360(az + 180)
+        # The points along the great circle don't depend on the speed, so they are calculated at once
+        d = dist / n * np.arange(n + 1)
+        x, y, back_az = self.g.fwd(np.full(n, self.start_point.x), np.full(n, self.start_point.y), np.full(n, az),
+                                   d[1:])
+        x = np.concatenate([[self.start_point.x], x])
+        y = np.concatenate([[self.start_point.y], y])
+        course = np.concatenate([[az], angle360(back_az + 180)])
+        speed = np.zeros(n + 1)
+        t = np.full(n + 1, float(self.start_time))
+        # The time of each point depends on the time of the previous one, so the speeds are calculated one by one
+        for i in range(1, n + 1):
             if constant_speed:
-                v = constant_speed
+                speed[i] = constant_speed
             else:
-                v = self.polar.get_speed(loc, az, 0, route_points[-1].time, self.wind)[0]
-            route_points.append(RoutingPoint(loc.x, loc.y, az, route_points[-1], d, None, v,
-                                             route_points[-1].time + dist / v / n))
-        return route_points[-1]
+                with self.instrumentation.stage('polar', 1):
+                    speed[i] = np.squeeze(self.polar.get_speed_batch(x[i], y[i], course[i], 0, t[i - 1], self.wind))
+            t[i] = t[i - 1] + dist / speed[i] / n
+        self.graph = RouteGraph([RouteLayer(x[i:i + 1], y[i:i + 1], course[i], speed[i], t[i], d[i], None,
+                                            None if i == 0 else [0]) for i in range(n + 1)])
+        return self.graph[-1][0]
 
     def get_isochrones(self):
-        return [[x] for x in self.route_points]
+        return self.graph.layers
@@ -1,5 +1,6 @@
+from instrumentation import instrumented
+from route_graph import RouteGraph, RouteLayer
 from routers.router import Router
-from routing_point import RoutingPoint
 from util import angle360
 import numpy as np
 
@@ -10,59 +11,142 @@ class IsochroneRouter(Router):
     shortest path from start to end point. 
     '''
 
-    def __init__(self, time_step, *args):
-        super().__init__(*args)
-        self.isochrones = None
+    def __init__(self, time_step, *args, heading_step=1., **kwargs):
+        super().__init__(*args, **kwargs)
+        self.graph = None
         self.time_step = time_step
+        self.heading_step = heading_step
 
+    @instrumented
     def calculate_routing(self):
         '''
         Calculate the shortest path from start to end point. This is inspired by 
         https://github.com/mak08/Bitsailor/blob/027c3fb699f7ef090349d3eb8fd4fc0b16f06987/simulation.cl#L39.
+        If the end point isn't reached before max_time, the point closest to it that was reached is returned.
         '''
         # Calculate initial course (forward azimuth) and distance from start to end point
         az, _, dist = self.g.inv(self.start_point.x, self.start_point.y, self.end_point.x, self.end_point.y)
         # Calculate initial isochrone
-        self.isochrones = [[RoutingPoint(self.start_point.x, self.start_point.y, az, None, 0, az, 0, self.start_time)]]
-        min_dist = (dist, self.isochrones[0][0])
-        current_min = min_dist
-        while current_min[0] <= min_dist[0]:
-            min_dist = current_min
-            self.isochrones.append(self._next_isochrone(self.isochrones[-1], az))
-            current_min = min([(self.g.inv(x.x, x.y, self.end_point.x, self.end_point.y)[2], x) for x in self.isochrones[-1]])
-        return min_dist[1]
+        self.graph = RouteGraph([RouteLayer([self.start_point.x], [self.start_point.y], az, 0, self.start_time, 0, az)])
+        closest = nearest = (dist, self.graph[0][0])
+        # Beating to windward at the optimal angle leaves the sector of +-20 degrees around the start bearing
+        bearing_range = max(20, np.max(self.polar.upwind_angle) + 5) if self.envelope else 20
+        while self.graph[-1].time[0] <= self.max_time:
+            isochrone = self._next_isochrone(self.graph[-1], az, bearing_range)
+            # Stop if all candidates were rejected, e.g. because they cross land
+            if len(isochrone) == 0:
+                break
+            self.graph.append(isochrone)
+            self._notify(isochrone)
+            previous, closest = closest, self._closest_to_end(isochrone)
+            nearest = min(nearest, closest, key=lambda c: c[0])
+            # The end point is reached once the distance stops shrinking and the isochrones have passed it or the
+            # closest point can sail to it within one step. Isochrones stuck at a coast stop approaching without
+            # either and keep expanding around the coast.
+            if closest[0] > previous[0] and (self._passed(isochrone, az, dist) or self._reaches_end(previous[1])):
+                return previous[1]
+        return nearest[1]
 
     def get_isochrones(self):
-        return self.isochrones
+        return self.graph.layers
 
-    def _next_isochrone(self, previous_isochrone: list[RoutingPoint], start_bearing: float, bearing_range=20, angle_range=20):
-        '''Calculate the next isochrone starting from the previous one.'''
-        isochrone = []
-        # Iterate over all points in previous isochrone
-        for start_point in previous_isochrone:
-            az = start_point.course
-            # Iterate over all full degree angles in range
-            for angle in range(-angle_range, angle_range):
-                angle = angle360(az + angle)
-                # Get speed from current wind at current location and time
-                v = self.polar.get_speed(start_point, angle, 0, start_point.time, self.wind)
-                # Calculate new location and azimuth by travelling for one time step in the given direction at the given speed
-                x, y, new_az = self.g.fwd(start_point.x, start_point.y, angle, v * self.time_step)
-                new_az = angle360(new_az+180)
-                # Calculate bearing and distance from start point
-                az12, _, dist = self.g.inv(self.start_point.x, self.start_point.y, x, y)
-                isochrone.append(RoutingPoint(x, y, new_az, start_point, dist, az12, v, start_point.time + self.time_step))
+    @staticmethod
+    def _passed(isochrone: RouteLayer, bearing, distance):
+        '''Whether the isochrone reaches further from the start point than distance within one degree of bearing'''
+        near = np.abs(np.mod(isochrone.bearing - bearing + 180, 360) - 180) <= 1
+        return bool(np.any(isochrone.distance[near] >= distance))
 
-        # Iterate over all points in isochrone and find the best point in each sector
-        best_per_sector = {}
-        decimals = 0
-        rounded_start_bearing = round(start_bearing, decimals)
-        for x in isochrone:
-            key = round(x.bearing, decimals)
-            if abs(key - rounded_start_bearing) < bearing_range:
-                if key in best_per_sector:
-                    if x.distance_to_start > best_per_sector[key].distance_to_start:
-                        best_per_sector[key] = x
-                else:
-                    best_per_sector[key] = x
-        return [x for x in best_per_sector.values()]
+    def _reaches_end(self, point):
+        '''Whether the end point can be sailed to directly from a point within one time step'''
+        az, _, dist = self.g.inv(point.x, point.y, self.end_point.x, self.end_point.y)
+        if self.land_mask is not None and self.land_mask.crosses_land(point.x, point.y, self.end_point.x,
+                                                                      self.end_point.y):
+            return False
+        v = self.polar.get_speed_batch(point.x, point.y, az, 0, point.time, self.wind, self.envelope)
+        return bool(dist <= v * self.time_step)
+
+    def _closest_to_end(self, isochrone: RouteLayer):
+        '''Return the distance to the end point and the point of the isochrone closest to the end point.'''
+        n = len(isochrone)
+        _, _, dist = self.g.inv(isochrone.lon, isochrone.lat, np.full(n, self.end_point.x), np.full(n, self.end_point.y))
+        i = np.argmin(dist)
+        return dist[i], isochrone[i]
+
+    def _next_isochrone(self, previous_isochrone: RouteLayer, start_bearing: float, bearing_range=20, angle_range=20):
+        '''
+        Calculate the next isochrone starting from the previous one. All candidates of the isochrone are generated as
+        arrays and passed to pyproj and the polar at once, and only the best candidate per sector is kept.
+        '''
+        # One row per point of the previous isochrone, one column per heading
+        angles = angle360(previous_isochrone.course[:, None] +
+                          np.arange(-angle_range, angle_range, self.heading_step)[None, :])
+        n_candidates = angles.size
+        if self.envelope:
+            angles, useful = self._envelope_headings(previous_isochrone, angles)
+        else:
+            useful = np.ones(angles.shape, dtype=bool)
+        rows, columns = np.nonzero(useful)
+        angles = angles[rows, columns]
+        x0, y0, t0 = (a[rows] for a in (previous_isochrone.lon, previous_isochrone.lat, previous_isochrone.time))
+        # Get speed from current wind at current location and time
+        with self.instrumentation.stage('polar', angles.size):
+            v = self.polar.get_speed_batch(x0, y0, angles, 0, t0, self.wind)
+        # Calculate new location and azimuth by travelling for one time step in the given direction at the given speed
+        x, y, new_az = self.g.fwd(x0, y0, angles, v * self.time_step)
+        new_az = angle360(new_az + 180)
+        # Calculate bearing and distance from start point
+        az12, _, dist = self.g.inv(np.full(x.shape, self.start_point.x), np.full(y.shape, self.start_point.y), x, y)
+
+        # Keep the candidate with the largest distance from the start point in each sector. Sorting is stable, so on
+        # ties the first candidate wins.
+        keys = np.round(az12)
+        valid = np.abs(keys - round(start_bearing)) < bearing_range
+        # Reject candidates whose leg crosses land
+        if self.land_mask is not None:
+            with self.instrumentation.stage('land', np.count_nonzero(valid)):
+                valid[valid] = ~self.land_mask.crosses_land(x0[valid], y0[valid], x[valid], y[valid])
+        with self.instrumentation.stage('pruning', angles.size):
+            candidates = np.nonzero(valid)[0]
+            order = candidates[np.lexsort((-dist[candidates], keys[candidates]))]
+            _, first = np.unique(keys[order], return_index=True)
+            # Return the sectors in the order in which they were first reached
+            _, first_seen = np.unique(keys[candidates], return_index=True)
+            survivors = order[first][np.argsort(first_seen)]
+
+        parents = rows[survivors]
+        self.instrumentation.layer(candidates=n_candidates, useful=angles.size, survivors=len(survivors))
+        return RouteLayer(x[survivors], y[survivors], new_az[survivors], v[survivors],
+                          previous_isochrone.time[parents] + self.time_step, dist[survivors], az12[survivors], parents)
+
+    def _envelope_headings(self, isochrone: RouteLayer, angles):
+        '''
+        Replace the headings closer to the wind or further downwind than the polar's optimal VMG angles by these
+        angles. Of the replaced headings of a point, the first one upwind (and downwind) keeps its tack and the second
+        one is used for the other tack, so the boat can tack (or gybe). Returns the headings and a mask of the useful
+        ones.
+        '''
+        # The wind is the same for all headings from a point
+        direction, velocity = self.wind.get_wind_batch(isochrone.lon, isochrone.lat, 0., isochrone.time)
+        wind_from = angle360(-direction)
+        upwind, downwind = self.polar.optimal_angles(velocity)
+        # Signed true wind angle, positive with the wind from starboard
+        twa = np.mod(wind_from[:, None] - angles + 180, 360) - 180
+        side = np.where(twa >= 0, 1., -1.)
+        optimal = np.clip(np.abs(twa), upwind[:, None], downwind[:, None])
+        replaced = optimal != np.abs(twa)
+
+        # Group the replaced headings by point and upwind/downwind and number them within each group
+        rows, columns = np.nonzero(replaced)
+        group = rows * 2 + (np.abs(twa) > downwind[:, None])[rows, columns]
+        order = np.argsort(group, kind='stable')
+        rows, columns, group = rows[order], columns[order], group[order]
+        _, first, counts = np.unique(group, return_index=True, return_counts=True)
+        first = np.repeat(first, counts)
+        rank = np.arange(len(group)) - first
+        other = rank == 1
+        side[rows[other], columns[other]] = -side[rows[first[other]], columns[first[other]]]
+
+        angles = np.where(replaced, angle360(wind_from[:, None] - side * optimal), angles)
+        useful = ~replaced
+        useful[rows[rank < 2], columns[rank < 2]] = True
+        return angles, useful
@@ -0,0 +1,42 @@
+import numpy as np
+
+from instrumentation import instrumented
+from routers.dp_router import DPRouter
+
+
+class MultiResolutionDPRouter(DPRouter):
+    '''
+    Coarse-to-fine DP Router. A wide, coarse mesh is solved first. Then narrower meshes with the same number of nodes
+    are built in a corridor around the previous optimum, until the passage time improves by less than tolerance (in
+    seconds). The number of nodes is made odd, so each mesh contains the previous optimum and the passage time never
+    gets worse. The passage time of each mesh is available as passage_times.
+    '''
+
+    def __init__(self, nodes, layers, *args, shrink=0.5, tolerance=60., max_iterations=8, **kwargs):
+        self.nodes = nodes | 1
+        self.shrink = shrink
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
+        self.passage_times = []
+        super().__init__(self.nodes, layers, *args, **kwargs)
+
+    @instrumented
+    def calculate_routing(self):
+        width = self.width
+        offsets = np.broadcast_to(np.linspace(-width, width, self.nodes), self.offsets.shape)
+        self.passage_times = []
+        for _ in range(self.max_iterations):
+            self._build_mesh(offsets)
+            best = self._solve()
+            self.passage_times.append(best.time - self.start_time)
+            self.instrumentation.count('meshes')
+            converged = len(self.passage_times) > 1 and \
+                not self.passage_times[-2] - self.passage_times[-1] >= self.tolerance
+            if converged or not np.isfinite(best.time):
+                break
+            # Center the nodes of each layer on the optimum of the previous mesh
+            _, indices = self.graph.route_indices(len(self.graph) - 1, 0)
+            centers = self.offsets[np.arange(len(self.x0)), indices[1:-1]]
+            width *= self.shrink
+            offsets = centers[:, None] + np.linspace(-width, width, self.nodes)[None, :]
+        return best
@@ -1,39 +1,102 @@
-import time
+import importlib
 
-from pyproj import Geod
 import numpy as np
 
-from polar import Polar
-from wind.constant_wind import ConstantWind
-from wind.grib_wind import GRIBWind
+from geodesy import get_geod
+from instrumentation import NULL_INSTRUMENTATION, Instrumentation, InstrumentedProxy
 
+# Router name -> (module, class)
+ROUTERS = {
+    'gc': ('routers.gc_router', 'GCRouter'),
+    'dp': ('routers.dp_router', 'DPRouter'),
+    'dp-multi': ('routers.multires_dp_router', 'MultiResolutionDPRouter'),
+    'dp-time': ('routers.time_dp_router', 'TimeDependentDPRouter'),
+    'astar': ('routers.astar_router', 'AStarRouter'),
+    'isochrone': ('routers.isochrone_router', 'IsochroneRouter'),
+}
+# Router name -> default constructor arguments before the common ones (step in s or nodes and layers)
+DEFAULT_ARGS = {'gc': [], 'dp': [20, 20], 'dp-multi': [11, 30], 'dp-time': [20, 20], 'astar': [20, 20],
+                'isochrone': [3600 * 6]}
+
+
+def get_router(name):
+    '''Returns the router class of a name in ROUTERS'''
+    module, cls = ROUTERS[name]
+    return getattr(importlib.import_module(module), cls)
+
+
+def route_summary(best, start_time):
+    '''Compact result of a routing: passage time, distance and the route as a (n, 3) array of lon, lat, time'''
+    route = best.route()
+    return {
+        'start_time': start_time,
+        'passage_time': float(best.time - start_time),  # s, NaN if a mesh router didn't reach the end point
+        'distance': float(best.distance_to_start),  # m
+        # lon, lat and s since the start; float32 is precise enough for plotting and comparing routes
+        'route': np.stack([route.lon, route.lat, route.time - start_time], axis=1).astype(np.float32),
+    }
 
-class Router:
-    '''Base class for routers'''
 
-    def __init__(self, start_point, end_point, polar, wind, start_time, max_time, crs='WGS84'):
+class RoutingCancelled(Exception):
+    '''Raised by a progress callback to stop a routing'''
+    pass
+
+
+class Router:
+    '''
+    Base class for routers. With instrument=True, the time spent in each stage is recorded and available from
+    report() after calculate_routing. If profile is a path, a cProfile of calculate_routing is dumped to it.
+    geodesy selects the backend for courses and distances: 'ellipsoid' (pyproj, exact) or 'spherical' (faster, see
+    geodesy.py for the error bounds). By default, all courses are sailed directly at the speed of the polar. With
+    envelope=True, courses closer to the wind or further downwind than the polar's optimal VMG angles are not sailed
+    directly: the isochrone router uses the optimal angles as headings instead and the mesh routers use the speed made
+    good by tacking or gybing. progress is called with each new isochrone or relaxed layer (or None, if there is none)
+    during the routing; it may raise RoutingCancelled to stop.
+    '''
+
+    def __init__(self, start_point, end_point, polar, wind, start_time, max_time, crs='WGS84', land_mask=None,
+                 instrument=False, profile=None, geodesy='ellipsoid', envelope=False, progress=None):
         self.start_point = start_point
         self.end_point = end_point
         self.polar = polar
         self.wind = wind
         self.start_time = start_time
         self.max_time = max_time
-        self.g = Geod(ellps=crs)
+        self.g = get_geod(geodesy, crs)
+        self.land_mask = land_mask  # LandMask or None to ignore land
+        self.envelope = envelope
+        self.progress = progress
+        self.profile = profile
+        self.instrumentation = Instrumentation() if instrument else NULL_INSTRUMENTATION
+        if instrument:
+            self.g = InstrumentedProxy(self.g, self.instrumentation, 'geod', ('fwd', 'inv'))
+            self.wind = InstrumentedProxy(wind, self.instrumentation, 'wind', ('get_wind', 'get_wind_batch'))
 
     def calculate_routing(self):
         raise NotImplementedError()
 
+    def _notify(self, layer):
+        if self.progress is not None:
+            self.progress(layer)
+
     def get_isochrones(self):
         raise NotImplementedError()
 
+    def report(self):
+        '''Returns the timings and counters recorded during the last calculate_routing (if instrumented)'''
+        return self.instrumentation.report()
+
 
 if __name__ == '__main__':
-    import matplotlib.pyplot as plt
-    import cartopy.crs as crs
-    from shapely.geometry import Point, LineString
+    import time
+    from shapely.geometry import Point
     from routers.gc_router import GCRouter
     from routers.dp_router import DPRouter
     from routers.isochrone_router import IsochroneRouter
+    from land_mask import LandMask
+    from polar import Polar
+    from visualizer import Visualizer
+    from wind.grib_wind import GRIBWind
 
     start = Point(-4.91519, 48.26118)
     end = Point(-74.71870, 38.86484)
@@ -44,11 +107,16 @@ if __name__ == '__main__':
 
     p = np.array([[0., 45., 90., 135., 180.], [0., 0., 2.8, 4.2, 2.8]])
     p = Polar(p)
-    w = GRIBWind()
+    # Only load the weather data around the route
+    w = GRIBWind(bbox=(min(start.x, end.x), min(start.y, end.y), max(start.x, end.x), max(start.y, end.y)),
+                 margin=10.)
     start_time = time.time() + 60 * 60 * 3
     max_time = time.time() + 60 * 60 * 24 * 365
+    # Download all forecast steps concurrently instead of one at a time while routing
+    w.loader.prefetch(start_time, max_time - start_time)
 
-    r = IsochroneRouter(3600 * 24 * 2, start, end, p, w, start_time, max_time)
+    land_mask = LandMask.from_natural_earth(cache_dir='./tmp')
+    r = IsochroneRouter(3600 * 24 * 2, start, end, p, w, start_time, max_time, land_mask=land_mask)
     best_point_iso = r.calculate_routing()
     print(f'Isochrone Distance: {round(best_point_iso.distance_to_start / 1000, 1)}km')
     print(f'Isochrone Passage time: {round((best_point_iso.time - start_time) / 3600, 1)}h')
@@ -57,45 +125,16 @@ if __name__ == '__main__':
     best_point_gc = r.calculate_routing(10)
     print(f'GC Distance: {round(best_point_gc.distance_to_start / 1000, 1)}km')
     print(f'GC Passage time: {round((best_point_gc.time - start_time) / 3600, 1)}h')
-    r = DPRouter(20, 20, start, end, p, w, start_time, max_time)
+    r = DPRouter(20, 20, start, end, p, w, start_time, max_time, land_mask=land_mask)
     best_point_dp = r.calculate_routing()
     isochrones = r.get_isochrones()
     print(f'DP Distance: {round(best_point_dp.distance_to_start / 1000, 1)}km')
     print(f'DP Passage time: {round((best_point_dp.time - start_time) / 3600, 1)}h')
-    fig = plt.figure()
-    ax = fig.add_subplot(1, 1, 1, projection=crs.Mercator())
-    # ax.set_global()
-    ax.coastlines()
-    # plt.plot([start.x, end.x], [start.y, end.y], transform=crs.PlateCarree())
-
-    def color(s):
-        if s < 2:
-            return 'black'
-        elif 2 <= s < 3:
-            return 'blue'
-        elif 3 <= s < 4:
-            return 'green'
-        else:
-            return 'red'
-
-    points = []
+    # Each leg is colored by its speed (black < 2 m/s, blue 2-3 m/s, green 3-4 m/s, red > 4 m/s)
+    v = Visualizer()
     for p in [best_point_dp, best_point_gc, best_point_iso]:
-        points += [[p.x, p.y]]
-        while p.previous_point is not None:
-            points += [[p.previous_point.x, p.previous_point.y]]
-            plt.plot([p.x, p.previous_point.x], [p.y, p.previous_point.y], transform=crs.PlateCarree(), c=color(p.speed))
-            p = p.previous_point
-    bounds = LineString(points).bounds
-    # ax.set_extent([bounds[0] - 1, bounds[2] + 1, bounds[1] - 1, bounds[3] + 1], crs=crs.PlateCarree())
-    for isochrone in isochrones:
-        isochrone = np.array([[x.x, x.y] for x in isochrone])
-        # plt.scatter(isochrone[:, 0], isochrone[:, 1], transform=crs.PlateCarree(), s=0.1, color='black')
-        plt.plot(isochrone[:, 0], isochrone[:, 1], transform=crs.PlateCarree(), linewidth=0.1, color='black')
-    # plt.plot([start.x, end.x], [start.y, end.y], transform=crs.Geodetic())
-    plt.scatter(x=[start.x, end.x], y=[start.y, end.y], transform=crs.PlateCarree())
-
-    u, v, lats, lons = w.loader.display_wind(start_time)
-    # plt.pcolormesh(lons, lats, data, transform=crs.PlateCarree())
-    f = 10
-    plt.barbs(lons[::f], lats[::f], u[::f, ::f], v[::f, ::f], length=4, linewidth=0.4, transform=crs.PlateCarree())
-    plt.show()
+        v.add_route(p.route())
+    v.add_isochrones(isochrones, linewidth=0.1)
+    v.add_points([[start.x, start.y], [end.x, end.y]])
+    v.add_wind(w, start_time)
+    v.show()
@@ -0,0 +1,144 @@
+import numpy as np
+
+from instrumentation import instrumented
+from route_graph import RouteGraph, RouteLayer
+from routers.dp_router import DPRouter
+
+
+class TimeDependentDPRouter(DPRouter):
+    '''
+    Time-expanded DP Router on the mesh of the DPRouter. Instead of only the earliest arrival at each node, a state
+    is kept for each node and arrival time bin (of bin_width seconds), so a later arrival with better wind for the
+    next leg isn't lost. At each node, the boat may also wait up to max_wait seconds: besides right away, it can
+    leave at the start of each following bin. Each layer is relaxed at once for all states, departures and target
+    nodes. States are pruned if they are dominated or can't beat the DPRouter's solution:
+    - the earliest arrival in a bin dominates the others in the bin (arrivals are only resolved to a bin),
+    - with unlimited waiting (max_wait=np.inf), the earliest arrival at a node dominates all later ones,
+    - states whose arrival time plus a lower bound of the time to go is later than the DPRouter's passage time.
+    At most the first max_bins bins are kept per node, so the memory is bounded by the nodes of the mesh times
+    max_bins (and the edges relaxed per layer by that times the waits per state). Unlimited waiting is limited to
+    max_bins bins. The earliest arrival at each node is always kept, so the passage time is never worse than the
+    DPRouter's. The departure time of each state is available from departure (one array per layer of the graph) and
+    the waits along a route from waits.
+    '''
+
+    def __init__(self, nodes, layers, *args, bin_width=3600., max_wait=0., max_bins=8, **kwargs):
+        self.bin_width = bin_width
+        self.max_wait = max_wait
+        self.max_bins = max_bins
+        self.departure = []
+        super().__init__(nodes, layers, *args, **kwargs)
+
+    @instrumented
+    def calculate_routing(self):
+        return self._solve()
+
+    def _solve(self):
+        # The graph of a previous solve holds the states, so the mesh graph is built again. The DPRouter's solution
+        # bounds the passage time; its layers are only used for the nodes of the mesh.
+        self._build_graph()
+        progress, self.progress = self.progress, None
+        try:
+            bound = super()._solve().time
+        finally:
+            self.progress = progress
+        bound = bound if np.isfinite(bound) else self.max_time
+        time_to_go = self._time_to_go()
+        nodes = [(layer.lon, layer.lat) for layer in self.graph]
+        states = RouteLayer(nodes[0][0], nodes[0][1], None, 0, self.start_time, 0)
+        self.graph = RouteGraph([states])
+        self.departure = [np.full(1, self.start_time)]
+        node = np.zeros(1, dtype=int)
+        for i in range(len(nodes) - 1):
+            edges = self.edges[self.first + i - 1] if i > 0 else {}
+            if 'dist' not in edges:
+                edges = self._edge_geometry(nodes[i], nodes[i + 1])
+            states, node, departure = self._relax_states(states, node, nodes[i], nodes[i + 1], edges,
+                                                         time_to_go[i + 1], bound)
+            self.graph.append(states)
+            self.departure.append(departure)
+            self._notify(states)
+        if len(states) == 0:
+            # Like the DPRouter, an end point that isn't reached has no time
+            self.graph.layers.pop()
+            states = self.graph.append(RouteLayer(nodes[-1][0], nodes[-1][1]))
+            self.departure[-1] = np.full(1, np.nan)
+        return states[np.argmin(states.time) if len(states) > 1 else 0]
+
+    def waits(self, point):
+        '''Time in s waited before each leg of the route to point (a node of the graph, e.g. the best one)'''
+        layers, indices = self.graph.route_indices(point.layer.index, point.i)
+        departure = np.array([self.departure[layer][i] for layer, i in zip(layers, indices)])
+        arrival = np.array([self.graph[layer].time[i] for layer, i in zip(layers, indices)])
+        return departure[1:] - arrival[:-1]
+
+    def _edge_geometry(self, sources, targets):
+        '''Courses, distances and land crossings of the edges between two layers of nodes (lon and lat arrays)'''
+        shape = (len(sources[0]), len(targets[0]))
+        x0, y0 = (np.broadcast_to(a[:, None], shape) for a in sources)
+        x1, y1 = (np.broadcast_to(a[None, :], shape) for a in targets)
+        az, _, dist = self.g.inv(x0.ravel(), y0.ravel(), x1.ravel(), y1.ravel())
+        edges = {'az': az.reshape(shape), 'dist': dist.reshape(shape)}
+        if self.land_mask is not None:
+            with self.instrumentation.stage('land', az.size):
+                edges['land'] = self.land_mask.crosses_land(x0, y0, x1, y1)
+        return edges
+
+    def _relax_states(self, sources: RouteLayer, source_node, source_nodes, target_nodes, edges, time_to_go, bound):
+        '''
+        Relax all edges from the states of a layer (at source_node of the source_nodes) to the target_nodes (lon and
+        lat arrays) and return the surviving states, their nodes and departure times. The courses, distances and
+        land crossings of the edges (see DPRouter._relax_layer) are shared with the DPRouter.
+        '''
+        lon, lat = target_nodes
+        # Departures right away and, when waiting, at the start of the following bins
+        bins = np.floor((sources.time - self.start_time) / self.bin_width)
+        waits = int(self.max_wait // self.bin_width) if np.isfinite(self.max_wait) else self.max_bins
+        departure = np.concatenate([sources.time[:, None], self.start_time + self.bin_width *
+                                    (bins[:, None] + np.arange(1, waits + 1))], axis=1)
+        state = np.broadcast_to(np.arange(len(sources))[:, None], departure.shape)
+        valid = (departure <= self.max_time) & (departure - sources.time[:, None] <= self.max_wait)
+        departure, state = departure[valid], state[valid]
+        node = source_node[state]
+        # Departures from the same node at the same time are equivalent, the earliest arrival is kept as the parent
+        order = np.lexsort((sources.time[state], departure, node))
+        node, departure, state = node[order], departure[order], state[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = (node[1:] != node[:-1]) | (departure[1:] != departure[:-1])
+        node, departure, state = node[first], departure[first], state[first]
+
+        shape = (len(node), len(lon))
+        x0, y0, t0 = (np.broadcast_to(a[:, None], shape) for a in (source_nodes[0][node], source_nodes[1][node],
+                                                                    departure))
+        az, dist = edges['az'][node], edges['dist'][node]
+        with self.instrumentation.stage('polar', x0.size):
+            v = self.polar.get_speed_batch(x0, y0, az, 0, t0, self.wind, self.envelope)
+        t_end = departure[:, None] + dist / v
+        if 'land' in edges:
+            t_end = np.where(edges['land'][node], np.inf, t_end)
+
+        # Drop arrivals that can't beat the bound
+        u, target = np.nonzero(np.isfinite(t_end) &
+                               (t_end + time_to_go[None, :] <= bound * (1 + 1e-12)))
+        t = t_end[u, target]
+        if len(t) == 0:
+            return RouteLayer([], []), np.zeros(0, dtype=int), np.zeros(0)
+        # Keep the earliest arrival per node and bin (or per node with unlimited waiting) and the first max_bins
+        # bins of each node
+        arrival_bin = np.floor((t - self.start_time) / self.bin_width) if np.isfinite(self.max_wait) else \
+            np.zeros(len(t))
+        order = np.lexsort((t, arrival_bin, target))
+        u, target, t, arrival_bin = u[order], target[order], t[order], arrival_bin[order]
+        first = np.ones(len(t), dtype=bool)
+        first[1:] = (target[1:] != target[:-1]) | (arrival_bin[1:] != arrival_bin[:-1])
+        u, target, t = u[first], target[first], t[first]
+        starts = np.flatnonzero(np.concatenate([[True], target[1:] != target[:-1]]))
+        rank = np.arange(len(t)) - np.repeat(starts, np.diff(np.append(starts, len(t))))
+        keep = rank < self.max_bins
+        u, target, t = u[keep], target[keep], t[keep]
+
+        parent = state[u]
+        states = RouteLayer(lon[target], lat[target], az[u, target], v[u, target], t,
+                            sources.distance[parent] + dist[u, target], None, parent)
+        self.instrumentation.layer(sources=len(sources), departures=len(node), edges=v.size, targets=len(t))
+        return states, target, departure[u]
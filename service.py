@@ -0,0 +1,316 @@
+'''
+Routing service: a local HTTP/JSON daemon that loads the wind data once and keeps it in memory, so a routing request
+only costs the routing itself. Jobs are queued and run on a thread pool, sharing the wind (and land mask).
+
+    POST   /jobs               start a job, e.g. {"start": [-4.9, 48.3], "end": [-74.7, 38.9], "router": "isochrone"}
+    GET    /jobs/<id>          state and (when done) the result of a job
+    GET    /jobs/<id>/stream   the isochrones (or layers) of a job as newline delimited JSON while it runs
+    DELETE /jobs/<id>          cancel a job
+    GET    /status             forecast run, jobs and wind cache statistics
+
+Jobs take router (see routers.router.ROUTERS), args (passed to the router's constructor before the common
+arguments), start_time (s since epoch, default now), max_duration (s), polar (angles and speeds, optionally with
+tws) and options (envelope, geodesy, heading_step, ...). The forecast run is refreshed in the background.
+Finished jobs are kept for job_ttl seconds (and at most max_jobs of them), their layers only until no stream reads
+them anymore.
+
+    python service.py --port 8765
+    curl -d '{"start": [-4.9, 48.3], "end": [-9.5, 43.5]}' localhost:8765/jobs
+'''
+import asyncio
+import itertools
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from shapely.geometry import Point
+
+from polar import Polar
+from routers.router import DEFAULT_ARGS, RoutingCancelled, get_router, route_summary
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POLAR = [[0., 45., 90., 135., 180.], [0., 0., 2.8, 4.2, 2.8]]
+# Router options that can be set by a job
+OPTIONS = ('envelope', 'geodesy', 'heading_step', 'shrink', 'tolerance', 'max_iterations')
+
+
+class Job:
+    '''
+    A routing job. Its events (layers and the result) are kept while it runs, so streams can start at any time. Once
+    it is finished and no stream reads them, the layers are dropped.
+    '''
+
+    def __init__(self, id, params):
+        self.id = id
+        self.params = params
+        self.state = 'queued'
+        self.result = None
+        self.error = None
+        self.events = []
+        self.layers = 0
+        self.streams = 0
+        # time.monotonic() when the job finished
+        self.finished = None
+        self.cancelled = threading.Event()
+        # Guards the transitions from queued, so a job cancelled while its worker starts is finished only once
+        self.lock = threading.Lock()
+        # Set (from the worker threads) whenever there are new events
+        self.changed = asyncio.Event()
+
+    def summary(self):
+        return {'id': self.id, 'state': self.state, 'result': self.result, 'error': self.error,
+                'layers': self.layers}
+
+    def drop_layers(self):
+        self.events = [event for event in self.events if event['type'] != 'layer']
+
+
+class RoutingService:
+    '''Keeps the wind warm and runs jobs on a pool of worker threads'''
+
+    def __init__(self, wind, land_mask=None, workers=2, refresh_interval=30 * 60, prefetch_horizon=60 * 60 * 24 * 8,
+                 job_ttl=60 * 60, max_jobs=1000):
+        self.wind = wind
+        self.land_mask = land_mask
+        self.executor = ThreadPoolExecutor(workers)
+        self.refresh_interval = refresh_interval
+        self.prefetch_horizon = prefetch_horizon
+        self.job_ttl = job_ttl
+        self.max_jobs = max_jobs
+        self.jobs = {}
+        self._ids = itertools.count(1)
+        self.loop = None
+
+    def submit(self, params):
+        for key in ('start', 'end'):
+            if key not in params:
+                raise ValueError(f'{key} is missing')
+        self._expire()
+        job = Job(str(next(self._ids)), params)
+        self.jobs[job.id] = job
+        self.loop.run_in_executor(self.executor, self._run, job)
+        return job
+
+    def cancel(self, job):
+        with job.lock:
+            job.cancelled.set()
+            if job.state == 'queued':
+                self._finish(job, 'cancelled')
+
+    def _event(self, job, event):
+        job.events.append(event)
+        self.loop.call_soon_threadsafe(job.changed.set)
+
+    def _finish(self, job, state, result=None, error=None):
+        job.state, job.result, job.error = state, result, error
+        self._event(job, {'type': state, 'result': result, 'error': error})
+        self.loop.call_soon_threadsafe(self._retire, job)
+
+    def _retire(self, job):
+        '''Called in the event loop when a job finished'''
+        job.finished = time.monotonic()
+        if job.streams == 0:
+            job.drop_layers()
+        self._expire()
+
+    def _expire(self):
+        '''Forget finished jobs after job_ttl and the oldest finished jobs beyond max_jobs'''
+        now = time.monotonic()
+        finished = [job for job in self.jobs.values() if job.finished is not None]
+        excess = len(self.jobs) - self.max_jobs
+        for i, job in enumerate(finished):
+            if i < excess or now - job.finished > self.job_ttl:
+                del self.jobs[job.id]
+
+    def _run(self, job):
+        '''Run a job in a worker thread'''
+        with job.lock:
+            if job.cancelled.is_set():
+                return
+            job.state = 'running'
+        try:
+            router = self._create_router(job)
+            best = router.calculate_routing()
+            summary = route_summary(best, router.start_time)
+            summary['route'] = summary['route'].tolist()
+            self._finish(job, 'done', _json_safe(summary))
+        except RoutingCancelled:
+            self._finish(job, 'cancelled')
+        except Exception as e:
+            self._finish(job, 'failed', error=f'{type(e).__name__}: {e}')
+
+    def _create_router(self, job):
+        params = job.params
+        name = params.get('router', 'isochrone')
+        args = params.get('args', DEFAULT_ARGS.get(name, []))
+        polar = Polar(params.get('polar', DEFAULT_POLAR), params.get('tws'))
+        start_time = params.get('start_time', time.time())
+        max_time = start_time + params.get('max_duration', 60 * 60 * 24 * 30)
+        options = {k: v for k, v in params.get('options', {}).items() if k in OPTIONS}
+
+        def progress(layer):
+            if job.cancelled.is_set():
+                raise RoutingCancelled()
+            if layer is not None:
+                job.layers += 1
+                self._event(job, {'type': 'layer', 'lon': layer.lon.tolist(), 'lat': layer.lat.tolist(),
+                                  'time': _json_safe((layer.time - start_time).tolist())})
+
+        return get_router(name)(*args, Point(*params['start']), Point(*params['end']), polar, self.wind, start_time,
+                                max_time, land_mask=self.land_mask, progress=progress, **options)
+
+    def status(self):
+        states = [job.state for job in self.jobs.values()]
+        loader = getattr(self.wind, 'loader', None)
+        return {'revision': self.wind.revision, 'jobs': {s: states.count(s) for s in set(states)},
+                'cache': loader.cache.stats if loader is not None else None}
+
+    def prefetch(self):
+        loader = getattr(self.wind, 'loader', None)
+        if loader is not None:
+            loader.prefetch(time.time(), self.prefetch_horizon)
+
+    async def refresh(self):
+        '''
+        Switch to new forecast runs in the background. A new run is downloaded before the wind switches to it, so jobs
+        keep using the previous run in the meantime.
+        '''
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.loop.run_in_executor(None, self.wind.refresh, self.prefetch_horizon)
+            except Exception:
+                logger.exception('Refreshing the wind failed')
+
+    async def handle(self, reader, writer):
+        try:
+            method, path, body = await _read_request(reader)
+            parts = [part for part in path.split('?')[0].split('/') if part]
+            if method == 'POST' and parts == ['jobs']:
+                job = self.submit(json.loads(body or b'{}'))
+                await _respond(writer, 202, {'id': job.id})
+            elif method == 'GET' and parts == ['status']:
+                await _respond(writer, 200, self.status())
+            elif len(parts) >= 2 and parts[0] == 'jobs' and parts[1] in self.jobs:
+                job = self.jobs[parts[1]]
+                if method == 'GET' and parts[2:] == ['stream']:
+                    await self._stream(job, writer)
+                elif method == 'GET' and len(parts) == 2:
+                    await _respond(writer, 200, job.summary())
+                elif method == 'DELETE' and len(parts) == 2:
+                    self.cancel(job)
+                    await _respond(writer, 202, {'id': job.id})
+                else:
+                    await _respond(writer, 405, {'error': 'method not allowed'})
+            else:
+                await _respond(writer, 404, {'error': 'not found'})
+        except (ValueError, KeyError) as e:
+            await _respond(writer, 400, {'error': str(e)})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _stream(self, job, writer):
+        '''Send the events of a job as newline delimited JSON until it is finished'''
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nConnection: close\r\n\r\n')
+        sent = 0
+        job.streams += 1
+        try:
+            while True:
+                job.changed.clear()
+                events = job.events[sent:]
+                for event in events:
+                    writer.write(json.dumps(event).encode() + b'\n')
+                sent += len(events)
+                await writer.drain()
+                if events and events[-1]['type'] not in ('layer',):
+                    return
+                await job.changed.wait()
+        finally:
+            job.streams -= 1
+            if job.finished is not None and job.streams == 0:
+                job.drop_layers()
+
+    async def serve(self, host='127.0.0.1', port=8765):
+        self.loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(self.handle, host, port)
+        refresh = asyncio.ensure_future(self.refresh())
+        print(f'Listening on http://{host}:{port}')
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            refresh.cancel()
+            self.executor.shutdown(cancel_futures=True)
+
+
+def _json_safe(x):
+    '''JSON has no NaN, so they are replaced by None'''
+    if isinstance(x, float):
+        return None if np.isnan(x) else x
+    if isinstance(x, dict):
+        return {k: _json_safe(v) for k, v in x.items()}
+    if isinstance(x, list):
+        return [_json_safe(v) for v in x]
+    return x
+
+
+async def _read_request(reader):
+    request_line = (await reader.readline()).decode('latin-1').split()
+    if len(request_line) < 2:
+        raise ValueError('invalid request')
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode('latin-1').strip()
+        if not line:
+            break
+        key, _, value = line.partition(':')
+        headers[key.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    body = await reader.readexactly(length) if length else b''
+    return request_line[0].upper(), request_line[1], body
+
+
+async def _respond(writer, status, data):
+    reasons = {200: 'OK', 202: 'Accepted', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed'}
+    body = json.dumps(data).encode()
+    writer.write(f'HTTP/1.1 {status} {reasons[status]}\r\nContent-Type: application/json\r\n'
+                 f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body)
+    await writer.drain()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=2, help='number of jobs run at the same time')
+    parser.add_argument('--wind', choices=['grib', 'synthetic'], default='grib',
+                        help='DWD ICON forecasts or a synthetic wind field (for testing)')
+    parser.add_argument('--land', action='store_true', help='avoid land (Natural Earth land polygons)')
+    parser.add_argument('--refresh', type=float, default=30 * 60, help='seconds between checks for new runs')
+    parser.add_argument('--job-ttl', type=float, default=60 * 60, help='seconds finished jobs are kept')
+    parser.add_argument('--max-jobs', type=int, default=1000, help='maximum number of jobs kept')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    if args.wind == 'grib':
+        from wind.grib_wind import GRIBWind
+        wind = GRIBWind()
+    else:
+        from benchmarks.synthetic_wind import CubeWind
+        wind = CubeWind(time.time() - 60 * 60, hours=24 * 30)
+    land_mask = None
+    if args.land:
+        from land_mask import LandMask
+        land_mask = LandMask.from_natural_earth(cache_dir='./tmp')
+    service = RoutingService(wind, land_mask, args.workers, args.refresh, job_ttl=args.job_ttl,
+                             max_jobs=args.max_jobs)
+    service.prefetch()
+    asyncio.run(service.serve(args.host, args.port))
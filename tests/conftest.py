@@ -0,0 +1,163 @@
+'''
+Shared fixtures: a local HTTP server serving fixture files, and a data directory with grid weights and climatology so
+that a GRIBLoader can run against the server.
+'''
+import bz2
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+import scipy.io as sio
+
+from grib_loader import GRIBLoader
+
+# Regular grid the fixture weights remap to
+LATS = np.array([-1., 0., 1.])
+LONS = np.array([0., 1., 2., 3.])
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    '''Serves the files of server.root, honouring single byte ranges (unless server.ranges is False)'''
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get('Range')))
+        filename = os.path.join(self.server.root, self.path.lstrip('/'))
+        if not os.path.isfile(filename):
+            self.send_error(404)
+            return
+        with open(filename, 'rb') as f:
+            body = f.read()
+        status = 200
+        requested = self.headers.get('Range')
+        if requested and self.server.ranges:
+            start = int(requested.split('=')[1].split('-')[0])
+            if start >= len(body):
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(body)}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            status = 206
+            self.send_response(status)
+            self.send_header('Content-Range', f'bytes {start}-{len(body) - 1}/{len(body)}')
+            body = body[start:]
+        else:
+            self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FixtureServer(ThreadingHTTPServer):
+    '''HTTP server on a free local port, recording the (path, Range header) of each request in requests'''
+
+    def __init__(self, root):
+        super().__init__(('127.0.0.1', 0), FixtureHandler)
+        self.root = root
+        self.ranges = True
+        self.requests = []
+        self.url = f'http://127.0.0.1:{self.server_address[1]}'
+
+    def put(self, path, data):
+        '''Serve data at path, which may also be a full URL on this server'''
+        if path.startswith(self.url):
+            path = path[len(self.url):]
+        filename = os.path.join(self.root, path.lstrip('/'))
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, 'wb') as f:
+            f.write(data)
+
+    def put_field(self, url, value):
+        '''Serve a bzip2 compressed GRIB2 field whose values are all value at url'''
+        self.put(url, bz2.compress(grib_message(value)))
+
+
+@pytest.fixture
+def server(tmp_path):
+    root = tmp_path / 'www'
+    root.mkdir()
+    httpd = FixtureServer(str(root))
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def grib_message(value):
+    '''A GRIB2 message (from the eccodes sample) whose values are all value'''
+    import eccodes
+    gid = eccodes.codes_grib_new_from_samples('GRIB2')
+    try:
+        eccodes.codes_set_values(gid, np.full(eccodes.codes_get_size(gid, 'values'), value, dtype=float))
+        return eccodes.codes_get_message(gid)
+    finally:
+        eccodes.codes_release(gid)
+
+
+def write_weights(filename, n_src):
+    '''SCRIP weight file mapping each point of the regular grid to one source point'''
+    n_dst = len(LATS) * len(LONS)
+    lat, lon = np.meshgrid(LATS, LONS, indexing='ij')
+    with sio.netcdf_file(filename, 'w') as f:
+        f.createDimension('num_links', n_dst)
+        f.createDimension('num_wgts', 1)
+        f.createDimension('dst_grid_size', n_dst)
+        f.createDimension('src_grid_size', n_src)
+        f.createDimension('dst_grid_rank', 2)
+        variables = {
+            'src_address': (('num_links',), np.arange(1, n_dst + 1, dtype=np.int32)),
+            'dst_address': (('num_links',), np.arange(1, n_dst + 1, dtype=np.int32)),
+            'remap_matrix': (('num_links', 'num_wgts'), np.ones((n_dst, 1))),
+            'dst_grid_dims': (('dst_grid_rank',), np.array([len(LONS), len(LATS)], dtype=np.int32)),
+            'dst_grid_center_lat': (('dst_grid_size',), lat.ravel()),
+            'dst_grid_center_lon': (('dst_grid_size',), lon.ravel()),
+            'src_grid_imask': (('src_grid_size',), np.ones(n_src, dtype=np.int32)),
+        }
+        for name, (dimensions, values) in variables.items():
+            variable = f.createVariable(name, values.dtype, dimensions)
+            variable[:] = values
+            if name.startswith('dst_grid_center'):
+                variable.units = b'degrees'
+
+
+def write_clima(filename):
+    '''Monthly climatology of u and v on a 1 degree grid, u is the month'''
+    lats, lons = np.arange(-10., 11.), np.arange(-180., 180.)
+    with sio.netcdf_file(filename, 'w') as f:
+        f.createDimension('time', 12)
+        f.createDimension('lat', len(lats))
+        f.createDimension('lon', len(lons))
+        for name, values in (('lat', lats), ('lon', lons)):
+            f.createVariable(name, 'f4', (name,))[:] = values
+        f.createVariable('u', 'f4', ('time', 'lat', 'lon'))[:] = np.arange(12.)[:, None, None] * np.ones(
+            (12, len(lats), len(lons)))
+        f.createVariable('v', 'f4', ('time', 'lat', 'lon'))[:] = np.ones((12, len(lats), len(lons)))
+
+
+@pytest.fixture
+def data_path(tmp_path):
+    '''Data directory with the grid weights and climatology already on disk'''
+    pytest.importorskip('eccodes')
+    import eccodes
+    gid = eccodes.codes_grib_new_from_samples('GRIB2')
+    n_src = eccodes.codes_get_size(gid, 'values')
+    eccodes.codes_release(gid)
+
+    path = tmp_path / 'data'
+    grid_dir = path / 'ICON_GLOBAL2WORLD_025_EASY'
+    grid_dir.mkdir(parents=True)
+    write_weights(str(grid_dir / 'weights_icogl2world_025.nc'), n_src)
+    write_clima(str(path / 'uvclm95to05.nc'))
+    return str(path)
+
+
+@pytest.fixture
+def loader(server, data_path):
+    '''GRIBLoader on the local server'''
+    return GRIBLoader(path=data_path, bbox=(-5, -2, 5, 2), margin=1., base_url=server.url)
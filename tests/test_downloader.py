@@ -0,0 +1,54 @@
+'''
+Downloads against the local fixture server (see conftest.py).
+
+    python -m pytest tests
+'''
+import os
+
+from downloader import Downloader
+
+
+def test_download_resumes_truncated_part_file(server, tmp_path):
+    content = os.urandom(10000)
+    server.put('data/file.bin', content)
+    filename = str(tmp_path / 'file.bin')
+    with open(f'{filename}.part', 'wb') as f:
+        f.write(content[:4000])
+
+    Downloader().download(f'{server.url}/data/file.bin', filename)
+
+    assert server.requests == [('/data/file.bin', 'bytes=4000-')]
+    with open(filename, 'rb') as f:
+        assert f.read() == content
+    assert not os.path.exists(f'{filename}.part')
+
+
+def test_download_complete_part_file(server, tmp_path):
+    content = os.urandom(1000)
+    server.put('file.bin', content)
+    filename = str(tmp_path / 'file.bin')
+    with open(f'{filename}.part', 'wb') as f:
+        f.write(content)
+
+    Downloader().download(f'{server.url}/file.bin', filename)
+
+    # The server answers 416 (range not satisfiable) and the partial file is renamed
+    assert server.requests == [('/file.bin', 'bytes=1000-')]
+    with open(filename, 'rb') as f:
+        assert f.read() == content
+    assert not os.path.exists(f'{filename}.part')
+
+
+def test_download_restarts_if_range_ignored(server, tmp_path):
+    server.ranges = False
+    content = os.urandom(1000)
+    server.put('file.bin', content)
+    filename = str(tmp_path / 'file.bin')
+    with open(f'{filename}.part', 'wb') as f:
+        f.write(b'stale')
+
+    Downloader().download(f'{server.url}/file.bin', filename)
+
+    with open(filename, 'rb') as f:
+        assert f.read() == content
+
@@ -0,0 +1,36 @@
+'''
+Solving the dynamic programming router repeatedly.
+
+    python -m pytest tests
+'''
+import pytest
+from shapely.geometry import Point
+
+from polar import Polar
+from routers.dp_router import DPRouter
+from wind.constant_wind import ConstantWind
+
+START_TIME = 1.7e9
+# Boat speeds at 5 and 10 knots of wind
+POLAR = Polar([[0., 45., 90., 135., 180.], [0., 0., 2.8, 4.2, 2.8], [0., 0., 5.6, 8.4, 5.6]], [5., 10.])
+
+
+def dp_router(wind):
+    return DPRouter(10, 10, Point(-5., 45.), Point(-10., 46.), POLAR, wind, START_TIME, START_TIME + 60 * 60 * 24 * 30)
+
+
+def test_solve_again_after_wind_changed():
+    wind = ConstantWind(0., 10.)
+    router = dp_router(wind)
+    first = router.calculate_routing().time
+    assert router.calculate_routing().time == first
+
+    # The wind weakens with a new forecast run
+    wind.velocity = 5.
+    wind.revision = 1
+    second = router.calculate_routing()
+
+    assert second.time > first
+    assert second.time == pytest.approx(dp_router(ConstantWind(0., 5.)).calculate_routing().time)
+    route = second.route()
+    assert route.time[0] == START_TIME and route.time[-1] == second.time
@@ -0,0 +1,74 @@
+'''
+The LRU field cache, on its own and shared by GRIB loaders.
+
+    python -m pytest tests
+'''
+import numpy as np
+
+from field_cache import FieldCache
+from grib_loader import GRIBLoader
+
+
+def field(value, n=100):
+    '''A float64 field of n * 8 bytes'''
+    return np.full(n, value, dtype=float)
+
+
+def test_cache_hits_and_misses():
+    cache = FieldCache()
+    loads = []
+
+    def load():
+        loads.append(1)
+        return field(1.)
+
+    a = cache.get('a', load)
+    assert cache.get('a', load) is a
+    assert len(loads) == 1
+    assert cache.stats == {'hits': 1, 'misses': 1, 'evictions': 0, 'bytes': 800, 'fields': 1}
+
+
+def test_evicts_least_recently_used():
+    cache = FieldCache(max_bytes=2400)
+    for key in 'abc':
+        cache.get(key, lambda: field(0.))
+    # Using a makes b the least recently used field
+    cache.get('a', lambda: field(0.))
+    cache.get('d', lambda: field(0.))
+
+    assert 'b' not in cache
+    assert all(key in cache for key in 'acd')
+    assert cache.evictions == 1
+    assert list(cache.fields) == ['c', 'a', 'd']
+
+
+def test_byte_limit():
+    cache = FieldCache(max_bytes=2000)
+    for i in range(10):
+        cache.get(i, lambda: field(0.))
+        assert cache.nbytes <= cache.max_bytes
+    assert cache.stats == {'hits': 0, 'misses': 10, 'evictions': 8, 'bytes': 1600, 'fields': 2}
+
+    # A field larger than the whole budget is still kept, as the most recent one
+    big = cache.get('big', lambda: field(0., n=1000))
+    assert list(cache.fields) == ['big'] and cache.nbytes == big.nbytes
+
+    cache.clear()
+    assert cache.stats['bytes'] == 0 and cache.stats['fields'] == 0
+
+
+def test_clima_from_shared_cache(server, loader):
+    u, v, lats, lons = loader.load_clima(3)
+    # A second loader only gets cache hits
+    other = GRIBLoader(path=loader.path, bbox=loader.bbox, margin=loader.margin, base_url=server.url,
+                       cache=loader.cache)
+    misses = loader.cache.misses
+    u2, v2, lats2, lons2 = other.load_clima(3)
+
+    assert loader.cache.misses == misses
+    assert u2 is u and v2 is v
+    np.testing.assert_array_equal(lats2, lats)
+    np.testing.assert_array_equal(lons2, lons)
+    assert u.shape == (len(lats), len(lons))
+    np.testing.assert_allclose(u, 3.)
+    assert lats.min() <= -3 and lats.max() >= 3 and lons.min() <= -6 and lons.max() >= 6
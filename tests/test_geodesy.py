@@ -0,0 +1,78 @@
+'''
+SphericalGeod against pyproj's Geod(ellps='WGS84') at the error bounds of the geodesy module docstring.
+
+    python -m pytest tests
+'''
+import numpy as np
+import pytest
+
+from geodesy import SphericalGeod, get_geod
+
+pyproj = pytest.importorskip('pyproj')
+
+# Maximum leg length and the bounds of the relative distance, azimuth (degrees) and position (m) errors
+BOUNDS = [(100e3, (2e-7, 0.005, 3)), (1000e3, (2e-5, 0.05, 300)), (5000e3, (5e-4, 2, 7e3))]
+N = 20000
+
+
+def angle_error(a, b):
+    return np.max(np.abs(np.mod(a - b + 180, 360) - 180))
+
+
+def check(lons, lats, azimuths, distances, bounds):
+    '''Compare inv (of the end points of pyproj's fwd) and fwd with pyproj'''
+    g, s = pyproj.Geod(ellps='WGS84'), SphericalGeod()
+    lons2, lats2, back_azimuths = g.fwd(lons, lats, azimuths, distances)
+    az, back_az, dist = s.inv(lons, lats, lons2, lats2)
+    x, y, fwd_back_az = s.fwd(lons, lats, azimuths, distances)
+    _, _, position_error = g.inv(lons2, lats2, x, y)
+
+    assert np.max(np.abs(dist - distances) / distances) <= bounds[0]
+    assert angle_error(az, azimuths) <= bounds[1]
+    assert angle_error(back_az, back_azimuths) <= bounds[1]
+    assert angle_error(fwd_back_az, back_azimuths) <= bounds[1]
+    assert np.max(position_error) <= bounds[2]
+    assert np.all((-180 <= x) & (x < 180))
+
+
+@pytest.mark.parametrize('max_distance, bounds', BOUNDS)
+def test_random_legs(max_distance, bounds):
+    rng = np.random.default_rng(0)
+    check(rng.uniform(-180, 180, N), rng.uniform(-85, 85, N), rng.uniform(-180, 180, N),
+          rng.uniform(1, max_distance, N), bounds)
+
+
+@pytest.mark.parametrize('max_distance, bounds', BOUNDS)
+def test_antimeridian(max_distance, bounds):
+    # Legs starting within a degree of the antimeridian, mostly crossing it
+    rng = np.random.default_rng(1)
+    lons = np.mod(rng.uniform(179, 181, N) + 180, 360) - 180
+    azimuths = rng.choice([-1, 1], N) * rng.uniform(45, 135, N)
+    check(lons, rng.uniform(-85, 85, N), azimuths, rng.uniform(1, max_distance, N), bounds)
+
+
+@pytest.mark.parametrize('max_distance, bounds', BOUNDS)
+def test_near_poles(max_distance, bounds):
+    rng = np.random.default_rng(2)
+    lats = rng.choice([-1, 1], N) * rng.uniform(80, 85, N)
+    check(rng.uniform(-180, 180, N), lats, rng.uniform(-180, 180, N), rng.uniform(1, max_distance, N), bounds)
+
+
+def test_inv_across_antimeridian():
+    g, s = pyproj.Geod(ellps='WGS84'), SphericalGeod()
+    lons1, lats1, lons2, lats2 = np.array([179.5, -179.5, 180.]), np.array([10., -40., 60.]), \
+        np.array([-179.5, 179.5, -179.]), np.array([10.5, -40., 60.])
+    az, back_az, dist = s.inv(lons1, lats1, lons2, lats2)
+    expected_az, expected_back_az, expected_dist = g.inv(lons1, lats1, lons2, lats2)
+
+    np.testing.assert_allclose(dist, expected_dist, rtol=2e-7)
+    assert angle_error(az, expected_az) <= 0.005 and angle_error(back_az, expected_back_az) <= 0.005
+    # Short legs, not the way around the world
+    assert np.all(dist < 200e3)
+
+
+def test_get_geod():
+    assert isinstance(get_geod('spherical'), SphericalGeod)
+    assert isinstance(get_geod(), pyproj.Geod)
+    geod = SphericalGeod()
+    assert get_geod(geod) is geod
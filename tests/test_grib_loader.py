@@ -0,0 +1,115 @@
+'''
+Forecast runs of the GRIB loader: selecting runs, downloading, prefetching and switching to newer runs, against the
+local fixture server (see conftest.py).
+
+    python -m pytest tests
+'''
+import datetime
+import os
+
+import numpy as np
+
+from grib_loader import GRIBLoader
+from wind.grib_wind import GRIBWind
+from wind_store import WindStore
+
+
+def test_select_run_and_newer_run(loader):
+    today = datetime.datetime(2024, 3, 1, 12, tzinfo=datetime.timezone.utc)
+    loader.select_run(today)
+    assert (loader.today, loader.run, loader.run_id) == (today, '12', '2024030112')
+    assert loader.store_file.endswith('icon_global_2024030112.wind') and loader.store is None
+    assert loader.get_dwd_url('v_10m', '003').endswith(
+        '/weather/nwp/icon/grib/12/v_10m/icon_global_icosahedral_single-level_2024030112_003_V_10M.grib2.bz2')
+
+    # The run of 12 UTC is available from 16 UTC on
+    assert GRIBLoader.latest_run(datetime.datetime(2024, 3, 1, 15, 59)) == today - datetime.timedelta(hours=12)
+    assert GRIBLoader.latest_run(datetime.datetime(2024, 3, 1, 16)) == today
+    assert loader.newer_run(datetime.datetime(2024, 3, 1, 20)) is None
+    assert loader.newer_run(datetime.datetime(2024, 3, 2, 3)) is None
+
+    new = loader.newer_run(datetime.datetime(2024, 3, 2, 4))
+    assert new.run_id == '2024030200' and new.run == '00'
+    # The loader itself still uses its run, sharing the downloader and cache with the new one
+    assert loader.run_id == '2024030112'
+    assert new.downloader is loader.downloader and new.cache is loader.cache
+
+
+def test_prefetch_skips_steps_in_store(server, loader):
+    # Steps 0-2 are already in the store of the run
+    remapper = loader.get_remapper()
+    store = WindStore(loader.store_file, remapper.lats, remapper.lons)
+    shape = (len(remapper.lats), len(remapper.lons))
+    for step in range(3):
+        store.put(step, np.zeros(shape), np.zeros(shape))
+    loader.select_run(loader.today)
+    for step in range(5):
+        for metric, value in (('u_10m', 3.), ('v_10m', -4.)):
+            server.put_field(loader.get_dwd_url(metric, f'{step:03}'), value)
+
+    steps = loader.prefetch(loader.today.timestamp(), 4 * 60 * 60)
+
+    assert steps == [3, 4]
+    expected = [loader.get_dwd_url(metric, f'{step:03}')[len(server.url):] for step in (3, 4)
+                for metric in ('u_10m', 'v_10m')]
+    assert sorted(path for path, _ in server.requests) == sorted(expected)
+    for step in range(5):
+        assert loader.store.has(step)
+    u, v = loader.store.get(4)
+    np.testing.assert_allclose(u, 3.)
+    np.testing.assert_allclose(v, -4.)
+
+    # Everything is in the store now
+    server.requests.clear()
+    assert loader.prefetch(loader.today.timestamp(), 4 * 60 * 60) == []
+    assert server.requests == []
+
+
+def test_refresh_prefetches_before_switching(server, data_path, monkeypatch):
+    wind = GRIBWind(data_path, base_url=server.url)
+    old = wind.loader
+    revision = wind.revision
+    # A newer run becomes available
+    today = old.today + datetime.timedelta(hours=12)
+    monkeypatch.setattr(GRIBLoader, 'latest_run', staticmethod(lambda now=None: today))
+    new = old.newer_run()
+    # The new run started at most 4h ago, so the next hour needs at most step 5
+    for step in range(8):
+        for metric in ('u_10m', 'v_10m'):
+            server.put_field(new.get_dwd_url(metric, f'{step:03}'), 1.)
+    prefetch = GRIBLoader.prefetch
+    active = []
+
+    def recording_prefetch(self, *args):
+        active.append(wind.loader)
+        return prefetch(self, *args)
+    monkeypatch.setattr(GRIBLoader, 'prefetch', recording_prefetch)
+
+    assert wind.refresh(60 * 60)
+
+    # The old run was used until the new one was downloaded
+    assert active == [old]
+    assert wind.loader is not old and wind.revision != revision
+    assert old.run_id == revision and old.today < wind.loader.today
+    assert wind.loader.store.has(0)
+    assert wind.loader.cache is old.cache and wind.loader.downloader is old.downloader
+    assert not wind.refresh(60 * 60)
+
+
+def test_forecast_download_resumes_part_file(server, loader):
+    url = loader.get_dwd_url('u_10m', '000')
+    server.put_field(url, 7.)
+    path = url[len(server.url):]
+    with open(os.path.join(server.root, path.lstrip('/')), 'rb') as f:
+        compressed = f.read()
+    # A previous download was interrupted halfway
+    filename = os.path.join(loader.path, url.rsplit('/', 1)[-1])
+    with open(f'{filename}.part', 'wb') as f:
+        f.write(compressed[:len(compressed) // 2])
+
+    field = loader.get_dwd_weather_data('u_10m', '000')
+
+    assert server.requests == [(path, f'bytes={len(compressed) // 2}-')]
+    np.testing.assert_allclose(field, 7.)
+    # The decoded file is removed
+    assert not os.path.exists(filename) and not os.path.exists(f'{filename}.part')
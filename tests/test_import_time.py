@@ -0,0 +1,14 @@
+'''
+The modules used for headless routing don't import the heavy dependencies (see benchmarks/import_time.py).
+
+    python -m pytest tests
+'''
+import pytest
+
+from benchmarks.import_time import MODULES, import_time
+
+
+@pytest.mark.parametrize('module', MODULES)
+def test_no_heavy_imports(module):
+    _, heavy = import_time(module, repeat=1)
+    assert heavy == []
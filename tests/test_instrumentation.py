@@ -0,0 +1,35 @@
+'''
+Instrumented routings.
+
+    python -m pytest tests
+'''
+import time
+
+from shapely.geometry import Point
+
+from instrumentation import NULL_INSTRUMENTATION
+from polar import Polar
+from routers.gc_router import GCRouter
+from wind.grib_wind import GRIBWind
+
+POLAR = Polar([[0., 45., 90., 135., 180.], [0., 0., 2.8, 4.2, 2.8]])
+
+
+def test_wind_statistics_only_during_routing(server, data_path):
+    wind = GRIBWind(data_path, bbox=(-5, -2, 5, 2), margin=1., base_url=server.url)
+    # Beyond the forecasts, the wind comes from the climatology
+    start_time = time.time() + 60 * 60 * 24 * 30
+    router = GCRouter(Point(0., 0.), Point(1., 0.5), POLAR, wind, start_time, start_time + 60 * 60 * 24 * 10,
+                      geodesy='spherical', instrument=True)
+
+    router.calculate_routing(5)
+
+    report = router.report()
+    assert report['counters']['wind_cache_misses'] > 0
+    assert report['stages']['load_climatology']['calls'] > 0
+    # Other routers using the wind don't record in the instrumentation of this one
+    assert wind.loader.instrumentation is NULL_INSTRUMENTATION
+    other = GCRouter(Point(0., 0.), Point(-1., -0.5), POLAR, wind, start_time, start_time + 60 * 60 * 24 * 10,
+                     geodesy='spherical')
+    other.calculate_routing(5)
+    assert router.report() == report
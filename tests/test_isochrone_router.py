@@ -0,0 +1,40 @@
+'''
+End conditions of the isochrone router.
+
+    python -m pytest tests
+'''
+import numpy as np
+from shapely.geometry import Point
+
+from polar import Polar
+from routers.isochrone_router import IsochroneRouter
+from routers.router import route_summary
+from wind.constant_wind import ConstantWind
+
+START_TIME = 1.7e9
+POLAR = Polar([[0., 45., 90., 135., 180.], [0., 0., 2.8, 4.2, 2.8]])
+
+
+def isochrone_router(envelope):
+    return IsochroneRouter(6 * 60 * 60, Point(-5., 45.), Point(-5., 47.), POLAR, ConstantWind(0., 10.), START_TIME,
+                           START_TIME + 60 * 60 * 24 * 5, envelope=envelope)
+
+
+def test_end_point_reached():
+    best = isochrone_router(envelope=True).calculate_routing()
+    assert START_TIME < best.time <= START_TIME + 60 * 60 * 24 * 5
+    assert best.route().lat[0] == 45.
+
+
+def test_unreached_end_point_returns_closest_point():
+    # Dead upwind, without tacking the end point is never reached
+    router = isochrone_router(envelope=False)
+    best = router.calculate_routing()
+    summary = route_summary(best, START_TIME)
+
+    assert np.isfinite(summary['passage_time'])
+    assert router.graph[-1].time[0] > router.max_time
+    _, _, dist = router.g.inv(best.x, best.y, -5., 47.)
+    closest = min(np.min(router.g.inv(layer.lon, layer.lat, np.full(len(layer), -5.), np.full(len(layer), 47.))[2])
+                  for layer in router.graph)
+    assert dist == closest
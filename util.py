@@ -7,3 +7,15 @@ def angle360(angle):
     '''Converts an angle to the range [0, 360)'''
     return np.where(angle < 0, angle+360, np.where(angle >= 360, angle-360, angle))
 
+
+def wind_from_uv(u, v):
+    '''Converts wind components to the direction the wind is coming from (degrees) and the wind speed'''
+    velocity = np.sqrt(u ** 2 + v ** 2)
+    direction = angle360(np.rad2deg(np.arctan2(-u, -v)))
+    return direction, velocity
+
+
+def uv_from_wind(direction, velocity):
+    '''Converts the direction the wind is coming from (degrees) and the wind speed to wind components'''
+    direction = np.deg2rad(direction)
+    return -velocity * np.sin(direction), -velocity * np.cos(direction)
@@ -1,14 +1,291 @@
-import matplotlib.pyplot as plt
-import cartopy.crs as crs
-import cartopy.feature as cfeature
+'''
+Plotting and export of routes, isochrones and wind. Routes and isochrones are drawn as single LineCollections, decimated
+to at most max_points points per line, and the wind from a cropped, subsampled view of the wind in memory, so plotting
+is fast even for fine isochrones. Results can be exported to GeoJSON and to a compact binary format for web viewers,
+which also contains the wind over time to show the routes with a time slider without recomputing them.
+
+matplotlib and cartopy are only imported for plotting, so exporting works without them.
+'''
+import json
+import struct
+
+import numpy as np
+
+from util import angle360, uv_from_wind
+
+# Legs are colored by speed in m/s: black < 2, blue 2-3, green 3-4, red > 4
+SPEEDS = [0., 2., 3., 4., np.inf]
+COLORS = ['black', 'blue', 'green', 'red']
+
+# Binary format: MAGIC, the length of the JSON header (uint32), the header padded to a multiple of 8 bytes and the
+# arrays (little endian, each at a multiple of 8 bytes). The header has the metadata and for each array its dtype,
+# shape and offset from the start of the arrays.
+MAGIC = b'WRB1'
+
+
+def decimate(n, max_points):
+    '''Indices of at most max_points evenly spaced points of a line of n points, including the first and the last'''
+    if n <= max_points:
+        return np.arange(n)
+    return np.unique(np.linspace(0, n - 1, max_points).round().astype(int))
+
+
+def _track(route):
+    '''lon, lat, time and speed of a RouteLayer route (e.g. best.route()) or a (n, 2..4) array of them'''
+    if hasattr(route, 'lon'):
+        return route.lon, route.lat, route.time, route.speed
+    route = np.asarray(route, dtype=float)
+    nan = np.full(len(route), np.nan)
+    return route[:, 0], route[:, 1], route[:, 2] if route.shape[1] > 2 else nan, \
+        route[:, 3] if route.shape[1] > 3 else nan
+
+
+def wind_view(wind, times, bbox, resolution=1.):
+    '''
+    Wind components on a grid with the given resolution (degrees) over bbox (lon_min, lat_min, lon_max, lat_max) at
+    each of times, from a single batched lookup of the wind. Returns lons, lats and u and v with the shape
+    (times, lats, lons).
+    '''
+    lons = np.arange(bbox[0], bbox[2] + resolution / 2, resolution)
+    lats = np.arange(bbox[1], bbox[3] + resolution / 2, resolution)
+    times = np.atleast_1d(np.asarray(times, dtype=float))
+    t, y, x = np.meshgrid(times, lats, lons, indexing='ij')
+    # With a heading of 0, the relative direction is the negative direction the wind is coming from
+    direction, velocity = wind.get_wind_batch(x, y, np.zeros(x.shape), t)
+    u, v = uv_from_wind(angle360(-direction), velocity)
+    return lons, lats, u, v
+
+
+def bounds(routes, margin=1.):
+    '''Bounding box (lon_min, lat_min, lon_max, lat_max) of routes plus a margin in degrees'''
+    lon = np.concatenate([_track(route)[0] for route in routes])
+    lat = np.concatenate([_track(route)[1] for route in routes])
+    return np.nanmin(lon) - margin, np.nanmin(lat) - margin, np.nanmax(lon) + margin, np.nanmax(lat) + margin
+
+
+def _route_feature(name, route, start_time, max_points, digits):
+    lon, lat, t, speed = _track(route)
+    i = decimate(len(lon), max_points)
+    coordinates = np.round(np.stack([lon[i], lat[i]], axis=1), digits).tolist()
+    return {'type': 'Feature', 'geometry': {'type': 'LineString', 'coordinates': coordinates},
+            'properties': {'kind': 'route', 'name': name, 'passage_time': _number(t[-1] - start_time),
+                           'time': [_number(x) for x in np.round(t[i] - start_time)],
+                           'speed': [_number(x) for x in np.round(speed[i], 2)]}}
+
+
+def _number(x):
+    '''JSON has no NaN, so it is written as null'''
+    return None if np.isnan(x) else float(x)
+
+
+def write_geojson(filename, routes, isochrones=(), start_time=0., max_points=1000, digits=5):
+    '''
+    Write routes (name -> route) and isochrones (e.g. router.get_isochrones()) as a GeoJSON FeatureCollection of
+    LineStrings, one feature at a time. Times are in s since start_time and coordinates are rounded to digits.
+    '''
+    with open(filename, 'w') as f:
+        f.write('{"type": "FeatureCollection", "features": [\n')
+        separator = ''
+        for name, route in routes.items():
+            f.write(separator + json.dumps(_route_feature(name, route, start_time, max_points, digits)))
+            separator = ',\n'
+        for layer in isochrones:
+            if len(layer) < 2:
+                continue
+            i = decimate(len(layer), max_points)
+            coordinates = np.round(np.stack([layer.lon[i], layer.lat[i]], axis=1), digits).tolist()
+            feature = {'type': 'Feature', 'geometry': {'type': 'LineString', 'coordinates': coordinates},
+                       'properties': {'kind': 'isochrone', 'time': _number(np.nanmin(layer.time) - start_time)}}
+            f.write(separator + json.dumps(feature))
+            separator = ',\n'
+        f.write('\n]}\n')
+
+
+def write_binary(filename, routes, isochrones=(), start_time=0., wind=None, times=None, bbox=None, resolution=1.,
+                 max_points=1000):
+    '''
+    Write routes (name -> route), isochrones and optionally the wind view (see wind_view) at times in the binary
+    format (see MAGIC) as float32 arrays. Times are in s since start_time. The arrays are
+        route/<name>            (n, 4) lon, lat, time and speed of each point
+        isochrones/points       (m, 3) lon, lat and time of the points of all isochrones
+        isochrones/offsets      (k + 1,) index of the first point of each isochrone and the number of points
+        wind/times, wind/lons, wind/lats and wind/u, wind/v (times, lats, lons)
+    '''
+    arrays = {}
+    for name, route in routes.items():
+        lon, lat, t, speed = _track(route)
+        arrays[f'route/{name}'] = np.stack([lon, lat, t - start_time, speed], axis=1)
+    if len(isochrones):
+        layers = [layer for layer in isochrones if len(layer)]
+        indices = [decimate(len(layer), max_points) for layer in layers]
+        arrays['isochrones/points'] = np.concatenate(
+            [np.stack([layer.lon[i], layer.lat[i], layer.time[i] - start_time], axis=1)
+             for layer, i in zip(layers, indices)])
+        arrays['isochrones/offsets'] = np.cumsum([0] + [len(i) for i in indices]).astype(np.int32)
+    if wind is not None:
+        bbox = bbox if bbox is not None else bounds(routes.values())
+        lons, lats, u, v = wind_view(wind, times, bbox, resolution)
+        arrays.update({'wind/times': np.asarray(times) - start_time, 'wind/lons': lons, 'wind/lats': lats,
+                       'wind/u': u, 'wind/v': v})
+
+    arrays = {name: np.ascontiguousarray(a, dtype=np.int32 if a.dtype == np.int32 else '<f4')
+              for name, a in arrays.items()}
+    header, offset = {}, 0
+    for name, a in arrays.items():
+        header[name] = {'dtype': a.dtype.str, 'shape': a.shape, 'offset': offset}
+        offset += -(-a.nbytes // 8) * 8
+    header = json.dumps({'start_time': start_time, 'arrays': header}).encode()
+    header += b' ' * (-(len(MAGIC) + 4 + len(header)) % 8)
+    with open(filename, 'wb') as f:
+        f.write(MAGIC + struct.pack('<I', len(header)) + header)
+        for a in arrays.values():
+            f.write(a.tobytes() + b'\0' * (-a.nbytes % 8))
+
+
+def read_binary(filename):
+    '''Read a file written by write_binary. Returns the start time and the arrays by name (memory mapped).'''
+    with open(filename, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{filename} is not a route file')
+        length, = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(length))
+    start = len(MAGIC) + 4 + length
+    arrays = {name: np.memmap(filename, a['dtype'], 'r', start + a['offset'], tuple(a['shape']))
+              for name, a in header['arrays'].items()}
+    return header['start_time'], arrays
 
 
 class Visualizer:
+    '''
+    Plots routes (colored by speed, see SPEEDS), isochrones and wind on a map. Each route and all isochrones are a
+    single LineCollection with at most max_points points per line.
+    '''
+
+    def __init__(self, projection=None, max_points=1000):
+        import matplotlib.pyplot as plt
+        import cartopy.crs as crs
+        self.figure = plt.figure()
+        self.ax = self.figure.add_subplot(1, 1, 1, projection=projection or crs.Mercator())
+        self.ax.coastlines()
+        self.max_points = max_points
+        self.bbox = None
+        self.barbs = None
+
+    def _extend(self, lon, lat):
+        '''Extend the map to the bounding box of the plotted lines'''
+        bbox = (np.nanmin(lon), np.nanmin(lat), np.nanmax(lon), np.nanmax(lat))
+        if self.bbox is not None:
+            bbox = (min(bbox[0], self.bbox[0]), min(bbox[1], self.bbox[1]), max(bbox[2], self.bbox[2]),
+                    max(bbox[3], self.bbox[3]))
+        self.bbox = bbox
+
+    def add_route(self, route, linewidth=1.5):
+        '''Add a route (see _track), each leg colored by the speed it is sailed at'''
+        from matplotlib.collections import LineCollection
+        from matplotlib.colors import BoundaryNorm, ListedColormap
+        import cartopy.crs as crs
+        lon, lat, _, speed = _track(route)
+        i = decimate(len(lon), self.max_points)
+        points = np.stack([lon[i], lat[i]], axis=1)
+        lines = LineCollection(np.stack([points[:-1], points[1:]], axis=1), cmap=ListedColormap(COLORS),
+                               norm=BoundaryNorm(SPEEDS, len(COLORS)), linewidth=linewidth,
+                               transform=crs.PlateCarree())
+        # The speed of a leg is stored at its end point
+        lines.set_array(speed[i[1:]])
+        self.ax.add_collection(lines)
+        self._extend(lon, lat)
+        return lines
+
+    def add_isochrones(self, isochrones, linewidth=0.2, color='black'):
+        '''Add isochrones (or the layers of a DP mesh), e.g. router.get_isochrones()'''
+        from matplotlib.collections import LineCollection
+        import cartopy.crs as crs
+        lines = []
+        for layer in isochrones:
+            if len(layer) > 1:
+                i = decimate(len(layer), self.max_points)
+                lines.append(np.stack([layer.lon[i], layer.lat[i]], axis=1))
+        collection = LineCollection(lines, colors=color, linewidths=linewidth, transform=crs.PlateCarree())
+        self.ax.add_collection(collection)
+        if lines:
+            points = np.concatenate(lines)
+            self._extend(points[:, 0], points[:, 1])
+        return collection
+
+    def add_points(self, points, **kwargs):
+        '''Add markers for points given as (lon, lat), e.g. start and end'''
+        import cartopy.crs as crs
+        points = np.asarray(points, dtype=float)
+        return self.ax.scatter(points[:, 0], points[:, 1], transform=crs.PlateCarree(), zorder=3, **kwargs)
 
-    def visualize(self, route=None):
-        fig = plt.figure()
-        ax = fig.add_subplot(1, 1, 1, projection=crs.PlateCarree())
-        ax.add_feature(cfeature.COASTLINE)
-        if route:
-            plt.plot()
+    def add_wind(self, wind, t, bbox=None, resolution=None, barbs=20):
+        '''
+        Add wind barbs at time t from a view of the wind over bbox (by default the plotted lines plus a margin). The
+        resolution defaults to about barbs barbs along the longer side.
+        '''
+        bbox = bbox if bbox is not None else self._wind_bbox()
+        resolution = resolution or max(bbox[2] - bbox[0], bbox[3] - bbox[1]) / barbs
+        lons, lats, u, v = wind_view(wind, t, bbox, resolution)
+        self._draw_barbs(lons, lats, u[0], v[0])
+
+    def _wind_bbox(self, margin=2.):
+        return self.bbox[0] - margin, self.bbox[1] - margin, self.bbox[2] + margin, self.bbox[3] + margin
+
+    def _draw_barbs(self, lons, lats, u, v):
+        import cartopy.crs as crs
+        if self.barbs is not None:
+            self.barbs.remove()
+        self.barbs = self.ax.barbs(lons, lats, u, v, length=4, linewidth=0.4, transform=crs.PlateCarree())
+
+    def add_slider(self, routes, wind=None, start_time=0., end_time=None, step=3 * 3600, bbox=None, resolution=None,
+                   barbs=20):
+        '''
+        Add a time slider that moves a marker along each route and, if wind is given, shows the wind at that time.
+        The wind view is computed once for all times of the slider (every step seconds), the routes are only
+        interpolated.
+        '''
+        from matplotlib.widgets import Slider
+        import cartopy.crs as crs
+        tracks = [_track(route) for route in routes]
+        end_time = end_time if end_time is not None else max(np.nanmax(t) for _, _, t, _ in tracks)
+        times = np.arange(start_time, end_time + step, step)
+        if wind is not None:
+            bbox = bbox if bbox is not None else self._wind_bbox()
+            resolution = resolution or max(bbox[2] - bbox[0], bbox[3] - bbox[1]) / barbs
+            lons, lats, u, v = wind_view(wind, times, bbox, resolution)
+
+        def positions(t):
+            return np.array([[np.interp(t, time, lon), np.interp(t, time, lat)] for lon, lat, time, _ in tracks])
+
+        boats = self.ax.scatter(*positions(start_time).T, transform=crs.PlateCarree(), color='orange', zorder=4)
+        self.figure.subplots_adjust(bottom=0.15)
+        slider = Slider(self.figure.add_axes([0.15, 0.05, 0.7, 0.03]), 'h', 0, (times[-1] - start_time) / 3600,
+                        valinit=0, valstep=step / 3600)
+
+        def update(hours):
+            i = int(round(hours * 3600 / step))
+            boats.set_offsets(positions(times[i]))
+            if wind is not None:
+                self._draw_barbs(lons, lats, u[i], v[i])
+            self.figure.canvas.draw_idle()
+
+        slider.on_changed(update)
+        update(0)
+        # The slider only works as long as it is referenced
+        self.slider = slider
+        return slider
+
+    def show(self, margin=1.):
+        import matplotlib.pyplot as plt
+        import cartopy.crs as crs
+        if self.bbox is not None:
+            self.ax.set_extent([self.bbox[0] - margin, self.bbox[2] + margin, self.bbox[1] - margin,
+                                self.bbox[3] + margin], crs=crs.PlateCarree())
         plt.show()
+
+    def save(self, filename, margin=1., dpi=200):
+        import cartopy.crs as crs
+        if self.bbox is not None:
+            self.ax.set_extent([self.bbox[0] - margin, self.bbox[2] + margin, self.bbox[1] - margin,
+                                self.bbox[3] + margin], crs=crs.PlateCarree())
+        self.figure.savefig(filename, dpi=dpi)
@@ -1,3 +1,5 @@
+import numpy as np
+
 from util import angle360
 from wind.wind import Wind
 
@@ -9,3 +11,7 @@ class ConstantWind(Wind):
 
     def get_wind(self, loc, h, t):
         return angle360(h - self.direction), self.velocity  # direction, speed
+
+    def get_wind_batch(self, lons, lats, h, t):
+        lons, lats, h, t = np.broadcast_arrays(lons, lats, h, t)
+        return angle360(h - self.direction), np.full(h.shape, self.velocity, dtype=float)
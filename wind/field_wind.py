@@ -0,0 +1,32 @@
+import numpy as np
+
+from util import angle360, wind_from_uv
+from wind.wind import Wind
+from wind.wind_field import WindField
+
+
+class FieldWind(Wind):
+    '''
+    Wind from a WindField, e.g. the forecast cube of a GRIBLoader. After the last time of the field, we fallback to a
+    climatology field whose time axis is the month (0-11), if given.
+    '''
+
+    def __init__(self, field: WindField, clima: WindField = None, revision=0):
+        self.field = field
+        self.clima = clima
+        self.revision = revision
+
+    def get_wind(self, loc, h, t):
+        direction, velocity = self.get_wind_batch(loc.x, loc.y, h, t)
+        return np.atleast_1d(direction), np.atleast_1d(velocity)
+
+    def get_wind_batch(self, lons, lats, h, t):
+        lons, lats, h, t = np.broadcast_arrays(*(np.asarray(a, dtype=float) for a in (lons, lats, h, t)))
+        u, v = self.field.interpolate(t, lats, lons)
+        if self.clima is not None:
+            clima = t > self.field.times[-1]
+            if np.any(clima):
+                month = t[clima].astype('datetime64[s]').astype('datetime64[M]').astype(int) % 12
+                u[clima], v[clima] = self.clima.interpolate(month, lats[clima], lons[clima])
+        direction, velocity = wind_from_uv(u, v)
+        return angle360(h - direction), velocity  # direction, speed
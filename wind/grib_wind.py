@@ -1,3 +1,5 @@
+import time
+
 from grib_loader import GRIBLoader
 from util import angle360
 from wind.wind import Wind
@@ -6,10 +8,33 @@ from wind.wind import Wind
 class GRIBWind(Wind):
     '''Wind from GRIB files'''
     
-    def __init__(self):
-        self.loader = GRIBLoader(path='./tmp')
+    def __init__(self, path='./tmp', **kwargs):
+        # See GRIBLoader for the keyword arguments (bounding box, cache, ...)
+        self.loader = GRIBLoader(path=path, **kwargs)
 
     def get_wind(self, loc, h, t):
         direction, velocity = self.loader.get_wind(t, loc)
         return angle360(h - direction), velocity  # direction, speed
 
+    @property
+    def revision(self):
+        return self.loader.run_id
+
+    def refresh(self, prefetch_horizon=None):
+        # The new run is loaded next to the current one and swapped in with a single assignment, so concurrent
+        # lookups use either run but never a mix of both
+        loader = self.loader.newer_run()
+        if loader is None:
+            return False
+        if prefetch_horizon:
+            loader.prefetch(time.time(), prefetch_horizon)
+        self.loader = loader
+        return True
+
+    def instrument(self, instrumentation):
+        previous, self.loader.instrumentation = self.loader.instrumentation, instrumentation
+        return previous
+
+    def get_wind_batch(self, lons, lats, h, t):
+        direction, velocity = self.loader.get_wind_batch(t, lons, lats)
+        return angle360(h - direction), velocity  # direction, speed
@@ -0,0 +1,28 @@
+import numpy as np
+
+from util import angle360
+from wind.wind import Wind
+
+
+class PerturbedWind(Wind):
+    '''
+    Wind of another source with its speed scaled and its direction rotated clockwise by offset degrees, e.g. to route
+    an ensemble of plausible deviations from a forecast
+    '''
+
+    def __init__(self, wind: Wind, speed_factor=1., direction_offset=0.):
+        self.wind = wind
+        self.speed_factor = speed_factor
+        self.direction_offset = direction_offset
+
+    @property
+    def revision(self):
+        return self.wind.revision
+
+    def get_wind(self, loc, h, t):
+        direction, velocity = self.wind.get_wind(loc, h, t)
+        return angle360(direction - self.direction_offset), velocity * self.speed_factor  # direction, speed
+
+    def get_wind_batch(self, lons, lats, h, t):
+        direction, velocity = self.wind.get_wind_batch(lons, lats, h, t)
+        return angle360(direction - self.direction_offset), np.asarray(velocity) * self.speed_factor
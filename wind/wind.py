@@ -1,5 +1,41 @@
+import numpy as np
+from shapely.geometry import Point
+
+
 class Wind:
     '''Wind interface'''
-    
+
+    # Identifies the wind data; changes whenever the data changes (e.g. with a new forecast run)
+    revision = 0
+
+    def refresh(self, prefetch_horizon=None):
+        '''
+        Update to the latest wind data. Returns True if the data (and revision) changed. Wind sources that download
+        their data load the next prefetch_horizon seconds (if given) before switching.
+        '''
+        return False
+
     def get_wind(self, loc, h, t):
-        raise NotImplementedError()
\ No newline at end of file
+        raise NotImplementedError()
+
+    def instrument(self, instrumentation):
+        '''
+        Record cache statistics and file loading of the wind source in the given Instrumentation from now on. Returns
+        the previous one, so it can be restored.
+        '''
+        return None
+
+    def get_wind_batch(self, lons, lats, h, t):
+        '''
+        Vectorized version of get_wind for arrays of longitudes, latitudes, headings and times. Returns arrays of
+        directions (relative to the heading) and speeds. Subclasses should override this; the default falls back to
+        calling get_wind for each element.
+        '''
+        lons, lats, h, t = np.broadcast_arrays(lons, lats, h, t)
+        direction = np.empty(lons.shape)
+        velocity = np.empty(lons.shape)
+        for i in np.ndindex(lons.shape):
+            d, v = self.get_wind(Point(lons[i], lats[i]), h[i], t[i])
+            direction[i] = np.squeeze(d)
+            velocity[i] = np.squeeze(v)
+        return direction, velocity
@@ -0,0 +1,85 @@
+import os
+
+import numpy as np
+
+
+class WindField:
+    '''
+    Wind components on a regular lat/lon grid, stacked over time into (time, lat, lon) cubes. Lookups locate the
+    surrounding grid cell by index arithmetic and interpolate u and v trilinearly in time, latitude and longitude.
+    '''
+
+    def __init__(self, times, lats, lons, u, v):
+        self.times = np.asarray(times, dtype=float)
+        self.lat0 = float(lats[0])
+        self.dlat = float(lats[1] - lats[0])
+        self.nlat = len(lats)
+        self.lon0 = float(lons[0])
+        self.dlon = float(lons[1] - lons[0])
+        self.nlon = len(lons)
+        # A grid spanning all longitudes wraps around, so the last column is interpolated with the first one
+        self.periodic = bool(np.isclose(self.nlon * abs(self.dlon), 360))
+        self.u = u
+        self.v = v
+
+    ARRAYS = ('times', 'lats', 'lons', 'u', 'v')
+
+    def save(self, directory):
+        '''Save the field as .npy files, which can be memory mapped by several processes with load'''
+        os.makedirs(directory, exist_ok=True)
+        for name in self.ARRAYS:
+            np.save(os.path.join(directory, f'{name}.npy'), getattr(self, name))
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        '''Load a field saved with save. By default the cubes are memory mapped read-only, not copied.'''
+        return cls(*(np.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mmap_mode) for name in cls.ARRAYS))
+
+    @property
+    def lats(self):
+        return self.lat0 + self.dlat * np.arange(self.nlat)
+
+    @property
+    def lons(self):
+        return self.lon0 + self.dlon * np.arange(self.nlon)
+
+    def interpolate(self, t, lats, lons):
+        '''Returns the interpolated u and v components at the given times, latitudes and longitudes.'''
+        t, lats, lons = np.broadcast_arrays(np.asarray(t, dtype=float), np.asarray(lats, dtype=float),
+                                            np.asarray(lons, dtype=float))
+        # Times are not necessarily equidistant (e.g. 1h and 3h forecast steps), so they are looked up by bisection
+        if len(self.times) == 1:
+            t0 = t1 = np.zeros(t.shape, dtype=int)
+            wt = np.zeros(t.shape)
+        else:
+            t1 = np.clip(np.searchsorted(self.times, t, side='right'), 1, len(self.times) - 1)
+            t0 = t1 - 1
+            wt = np.clip((t - self.times[t0]) / (self.times[t1] - self.times[t0]), 0, 1)
+
+        y = np.clip((lats - self.lat0) / self.dlat, 0, self.nlat - 1)
+        y0 = np.minimum(np.floor(y).astype(int), self.nlat - 2)
+        y1 = y0 + 1
+        wy = y - y0
+
+        if self.periodic:
+            x = np.mod((lons - self.lon0) / self.dlon, self.nlon)
+            x0 = np.floor(x).astype(int) % self.nlon
+            x1 = (x0 + 1) % self.nlon
+            wx = x - np.floor(x)
+        else:
+            # Cropped grids may extend beyond 180 degrees, so longitudes are wrapped to the 360 degrees around the
+            # center of the grid first
+            center = self.lon0 + self.dlon * (self.nlon - 1) / 2
+            lons = np.mod(lons - center + 180, 360) - 180 + center
+            x = np.clip((lons - self.lon0) / self.dlon, 0, self.nlon - 1)
+            x0 = np.minimum(np.floor(x).astype(int), self.nlon - 2)
+            x1 = x0 + 1
+            wx = x - x0
+
+        def trilinear(cube):
+            return ((1 - wt) * ((1 - wy) * ((1 - wx) * cube[t0, y0, x0] + wx * cube[t0, y0, x1]) +
+                                wy * ((1 - wx) * cube[t0, y1, x0] + wx * cube[t0, y1, x1])) +
+                    wt * ((1 - wy) * ((1 - wx) * cube[t1, y0, x0] + wx * cube[t1, y0, x1]) +
+                          wy * ((1 - wx) * cube[t1, y1, x0] + wx * cube[t1, y1, x1])))
+
+        return trilinear(self.u), trilinear(self.v)
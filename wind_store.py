@@ -0,0 +1,110 @@
+import json
+import os
+
+import numpy as np
+
+# Forecast steps of an ICON run: 1h steps up to 78h, 3h steps up to 180h
+FORECAST_STEPS = list(range(0, 79)) + list(range(81, 181, 3))
+# Value used for missing data (e.g. NaN) in the quantized store
+FILL_VALUE = np.iinfo(np.int16).min
+
+
+def grid_window(lats, lons, bbox, margin=0.):
+    '''
+    Returns a latitude slice and an array of longitude indices selecting the part of a regular grid that covers the
+    bounding box (lon_min, lat_min, lon_max, lat_max) plus a margin in degrees. If lon_min > lon_max, the box crosses
+    the antimeridian. Longitude indices wrap around, so the selected longitudes are contiguous but may exceed 180.
+    '''
+    lon_min, lat_min, lon_max, lat_max = bbox
+    lat0, dlat = lats[0], lats[1] - lats[0]
+    i = sorted([(lat_min - margin - lat0) / dlat, (lat_max + margin - lat0) / dlat])
+    lat_slice = slice(int(np.clip(np.floor(i[0]), 0, len(lats) - 1)), int(np.clip(np.ceil(i[1]), 0, len(lats) - 1)) + 1)
+
+    lon0, dlon = lons[0], lons[1] - lons[0]
+    width = np.mod(lon_max - lon_min, 360) + 2 * margin
+    if width >= 360 - abs(dlon) or not np.isclose(len(lons) * abs(dlon), 360):
+        return lat_slice, np.arange(len(lons))
+    first = int(np.floor(np.mod(lon_min - margin - lon0, 360) / dlon))
+    lon_index = np.arange(first, first + int(np.ceil(width / dlon)) + 2) % len(lons)
+    return lat_slice, lon_index
+
+
+def window_coordinates(lats, lons, window):
+    '''Returns the latitudes and (unwrapped) longitudes of a window returned by grid_window'''
+    lat_slice, lon_index = window
+    lon0, dlon = lons[0], lons[1] - lons[0]
+    first = lon_index[0]
+    return lats[lat_slice], lon0 + dlon * (first + np.arange(len(lon_index)))
+
+
+class WindStore:
+    '''
+    Compact on-disk cache of the u/v fields of one forecast run. The fields are quantized to int16 with a scale and
+    offset and stored in one contiguous file of shape (steps, 2, lat, lon), which is opened via memory mapping so only
+    the pages of the requested windows are read. A JSON header next to it describes the grid and which steps are
+    filled.
+    '''
+
+    def __init__(self, filename, lats=None, lons=None, scale=0.01, offset=0.):
+        self.filename = filename
+        self.header_file = f'{filename}.json'
+        if os.path.isfile(self.header_file):
+            with open(self.header_file) as f:
+                self.header = json.load(f)
+        elif lats is not None and lons is not None:
+            self.header = {
+                'lat0': float(lats[0]), 'dlat': float(lats[1] - lats[0]), 'nlat': len(lats),
+                'lon0': float(lons[0]), 'dlon': float(lons[1] - lons[0]), 'nlon': len(lons),
+                'scale': scale, 'offset': offset, 'steps': FORECAST_STEPS, 'filled': [],
+            }
+        else:
+            raise FileNotFoundError(self.header_file)
+        shape = (len(self.header['steps']), 2, self.header['nlat'], self.header['nlon'])
+        # The file is created sparse, so steps that were never written don't take up disk space
+        mode = 'r+' if os.path.isfile(filename) else 'w+'
+        self.data = np.memmap(filename, dtype=np.int16, mode=mode, shape=shape)
+        if mode == 'w+':
+            self._write_header()
+
+    @property
+    def lats(self):
+        return self.header['lat0'] + self.header['dlat'] * np.arange(self.header['nlat'])
+
+    @property
+    def lons(self):
+        return self.header['lon0'] + self.header['dlon'] * np.arange(self.header['nlon'])
+
+    def has(self, step):
+        return step in self.header['filled']
+
+    def put(self, step, u, v):
+        '''Quantize and store u and v of a forecast step'''
+        i = self.header['steps'].index(step)
+        for j, x in enumerate((u, v)):
+            q = np.round((x - self.header['offset']) / self.header['scale'])
+            q = np.clip(q, FILL_VALUE + 1, np.iinfo(np.int16).max)
+            self.data[i, j] = np.where(np.isnan(q), FILL_VALUE, q)
+        self.data.flush()
+        if step not in self.header['filled']:
+            self.header['filled'].append(step)
+            self._write_header()
+
+    def get(self, step, window=None):
+        '''Returns u and v of a forecast step as float32, optionally cropped to a window returned by grid_window'''
+        return self.get_variable(step, 0, window), self.get_variable(step, 1, window)
+
+    def get_variable(self, step, variable, window=None):
+        '''Returns u (variable 0) or v (variable 1) of a forecast step as float32'''
+        q = self.data[self.header['steps'].index(step), variable]
+        if window is not None:
+            lat_slice, lon_index = window
+            q = q[lat_slice][:, lon_index]
+        x = q.astype(np.float32) * self.header['scale'] + self.header['offset']
+        return np.where(q == FILL_VALUE, np.nan, x).astype(np.float32)
+
+    def _write_header(self):
+        # Write to a temporary file first, so a crash never leaves a broken header behind
+        tmp = f'{self.header_file}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.header, f)
+        os.replace(tmp, self.header_file)